@@ -5,15 +5,19 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from datetime import datetime, timedelta
-import glob
 from flask import Flask, request, jsonify, send_file, render_template, make_response
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
+from io import BytesIO
 import json
 from config import (
     UPLOAD_FOLDER, 
     RESULT_FOLDER, 
     DOWNLOAD_FOLDER,
-    ALLOWED_EXTENSIONS
+    ALLOWED_EXTENSIONS,
+    RESULT_EXPIRY,
+    VLOOKUP_DUPLICATE_POLICY,
+    VLOOKUP_MAX_LOOKUPS
 )
 
 # 现在应该能正确导入这些模块了
@@ -22,6 +26,13 @@ from functions.concatenate import ConcatenateProcessor
 from functions.pivot import PivotProcessor
 from functions.format import ExcelProcessor
 from functions.import_processor import ImportProcessor
+from functions.workbook_cache import workbook_cache
+from functions.reader import column_index
+from functions.pivot_engine import numeric_columns
+from functions.jobs import job_manager
+from functions.result_store import result_store
+from functions.lookup_index import DUPLICATE_POLICIES, MATCH_MODES
+from functions.lookup_registry import lookup_registry
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -54,13 +65,97 @@ def initialize():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def resolve_workbook(file_field='file', token_field='token'):
+    """
+    获取请求对应的工作簿文件路径
+    优先使用 /api/upload-workbook 返回的 token，否则保存本次上传的文件
+    :return: (文件路径, 错误信息)
+    """
+    token = request.form.get(token_field)
+    if token:
+        return workbook_cache.get_path(token), None
+
+    if file_field not in request.files:
+        return None, '未找到文件'
+
+    file = request.files[file_field]
+    if not file.filename:
+        return None, '文件名不能为空'
+
+    if not allowed_file(file.filename):
+        return None, '不支持的文件格式'
+
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
+    file.save(file_path)
+    return file_path, None
+
+def run_as_job(kind, func, result_id=None):
+    """
+    执行处理函数：请求参数 async=true 时提交为后台任务并立即返回任务 ID，
+    否则在请求线程中执行并直接返回结果
+    :param func: 无参数函数，返回响应数据（dict）
+    :param result_id: 为本次处理分配的结果 ID；func 抛出异常或任务未能提交时释放（删除写了一半的结果文件）
+    """
+    if result_id is not None:
+        process = func
+
+        def func():
+            try:
+                return process()
+            except Exception:
+                result_store.discard(result_id)
+                raise
+
+    if request.form.get('async', '').lower() == 'true':
+        try:
+            job_id = job_manager.submit(kind, func)
+        except Exception:
+            if result_id is not None:
+                result_store.discard(result_id)
+            raise
+        return jsonify({'success': True, 'jobId': job_id})
+    return jsonify(func())
+
+def detach_uploads(files):
+    """把上传的文件复制到内存，请求结束后后台任务仍可读取"""
+    return [
+        FileStorage(stream=BytesIO(file.read()), filename=file.filename, content_type=file.content_type)
+        for file in files
+    ]
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/api/upload-workbook', methods=['POST'])
+def upload_workbook():
+    """上传工作簿并返回 token，后续接口可以直接使用 token 而无需重复上传"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'error': '未找到文件'})
+
+        file = request.files['file']
+        if not file.filename:
+            return jsonify({'success': False, 'error': '文件名不能为空'})
+
+        if not allowed_file(file.filename):
+            return jsonify({'success': False, 'error': '不支持的文件格式'})
+
+        token = workbook_cache.register(file)
+        sheets = workbook_cache.get_sheets(token)
+
+        return jsonify({'success': True, 'token': token, 'sheets': sheets})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/get-sheets', methods=['POST'])
 def get_sheets():
     try:
+        token = request.form.get('token')
+        if token:
+            return jsonify({'success': True, 'sheets': workbook_cache.get_sheets(token)})
+
         if 'file' not in request.files:
             return jsonify({'success': False, 'error': '未找到文件'})
         
@@ -91,25 +186,14 @@ def get_sheets():
 @app.route('/api/get-columns', methods=['POST'])
 def get_columns():
     try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'error': '未找到文件'})
-        
-        file = request.files['file']
         sheet = request.form.get('sheet')
-        
-        if not file.filename:
-            return jsonify({'success': False, 'error': '文件名不能为空'})
-            
-        if not allowed_file(file.filename):
-            return jsonify({'success': False, 'error': '不支持的文件格式'})
-        
         if not sheet:
             return jsonify({'success': False, 'error': '未指定工作表'})
         
-        # 保存文件
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        # 获取文件（token 或上传的文件）
+        file_path, error = resolve_workbook()
+        if error:
+            return jsonify({'success': False, 'error': error})
         
         # 根据请求来源选择不同的处理器
         if 'concatenateFile' in request.form:
@@ -121,8 +205,9 @@ def get_columns():
             
         sheet_info = processor.get_sheet_info(file_path, sheet)
         
-        # 清理临时文件
-        os.remove(file_path)
+        # 清理临时文件（会话文件保留供后续请求使用）
+        if not workbook_cache.is_session_file(file_path):
+            os.remove(file_path)
         
         return jsonify({
             'success': True,
@@ -132,19 +217,80 @@ def get_columns():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def parse_batch_lookups(specs, main_match_type, main_columns, duplicate_policy, match_mode):
+    """
+    解析批量 VLOOKUP 的查找配置（lookups 参数）
+    每项未指定主表匹配列、重复值处理方式和匹配方式时使用顶层参数；
+    查找表只能是已上传的工作簿（lookupToken）或常用查找表（lookupTable）
+    :return: (查找配置列表, 错误信息)
+    """
+    if not isinstance(specs, list) or not specs:
+        return None, '批量查找至少需要一个查找表'
+    if len(specs) > VLOOKUP_MAX_LOOKUPS:
+        return None, f'一次最多批量查找 {VLOOKUP_MAX_LOOKUPS} 个查找表'
+
+    lookups = []
+    for pos, spec in enumerate(specs, 1):
+        if not isinstance(spec, dict):
+            return None, f'第 {pos} 个查找的参数格式不正确'
+
+        lookup_table = spec.get('lookupTable')
+        lookup_token = spec.get('lookupToken')
+        lookup = {
+            'main_match_type': spec.get('mainMatchType') or main_match_type,
+            'main_columns': spec.get('mainColumns') or main_columns,
+            'lookup_path': None,
+            'lookup_sheet': spec.get('lookupSheet'),
+            'lookup_match_type': spec.get('lookupMatchType'),
+            'lookup_match_columns': spec.get('lookupMatchColumns'),
+            'return_type': spec.get('returnType'),
+            'return_columns': spec.get('returnColumns'),
+            'duplicate_policy': spec.get('duplicatePolicy') or duplicate_policy,
+            'lookup_table': lookup_table,
+            'match_mode': spec.get('matchMode') or match_mode
+        }
+
+        required = [lookup['main_match_type'], lookup['main_columns']]
+        if not lookup_table:
+            required += [lookup_token, lookup['lookup_sheet'], lookup['lookup_match_type'],
+                         lookup['lookup_match_columns'], lookup['return_type'], lookup['return_columns']]
+        if not all(required):
+            return None, f'第 {pos} 个查找缺少必要的参数'
+        if lookup['duplicate_policy'] not in DUPLICATE_POLICIES:
+            return None, '不支持的重复值处理方式'
+        if lookup['match_mode'] not in MATCH_MODES:
+            return None, '不支持的匹配方式'
+
+        if lookup_table:
+            lookup_registry.get(lookup_table)  # 不存在时直接报错
+        else:
+            lookup['lookup_path'] = workbook_cache.get_path(lookup_token)
+        lookups.append(lookup)
+
+    return lookups, None
+
 @app.route('/api/vlookup', methods=['POST'])
 def vlookup():
     try:
-        # 检查文件
-        if 'mainFile' not in request.files:
-            return jsonify({'success': False, 'error': '请上传主数据表文件'})
-        
-        main_file = request.files['mainFile']
-        if not main_file.filename:
-            return jsonify({'success': False, 'error': '主数据表文件名不能为空'})
+        main_token = request.form.get('mainToken')
+        lookup_token = request.form.get('lookupToken')
+        # 使用已注册的常用查找表时不需要上传查找表
+        lookup_table = request.form.get('lookupTable')
+        # 批量查找：lookups 为查找配置列表，主表只读取一次，结果写入同一个文件
+        lookups_param = request.form.get('lookups')
+
+        # 检查文件（已上传的工作簿可以直接使用 token）
+        main_file = request.files.get('mainFile')
+        if not main_token:
+            if main_file is None:
+                return jsonify({'success': False, 'error': '请上传主数据表文件'})
+            if not main_file.filename:
+                return jsonify({'success': False, 'error': '主数据表文件名不能为空'})
 
         # 获取查找表文件（可能与主表是同一个文件）
         lookup_file = request.files.get('lookupFile', main_file)
+        if not lookups_param and not lookup_table and not lookup_token and lookup_file is None:
+            return jsonify({'success': False, 'error': '请上传查找表文件'})
         
         # 获取所有参数
         main_sheet = request.form.get('mainSheet')
@@ -156,28 +302,52 @@ def vlookup():
         lookup_match_columns = json.loads(request.form.get('lookupMatchColumns', '[]'))
         return_type = request.form.get('returnType')
         return_columns = json.loads(request.form.get('returnColumns', '[]'))
+        duplicate_policy = request.form.get('duplicatePolicy') or VLOOKUP_DUPLICATE_POLICY
+        # exact 精确匹配，range 区间匹配（返回不大于查找值的最大键所在行），fuzzy 模糊匹配（追加相似度列）
+        match_mode = request.form.get('matchMode') or 'exact'
 
         # 验证参数
-        if not all([
-            main_sheet, main_match_type, main_columns,
-            lookup_sheet, lookup_match_type, 
-            lookup_match_columns, return_type, return_columns
-        ]):
-            return jsonify({'success': False, 'error': '缺少必要的参数'})
-
-        if not (allowed_file(main_file.filename) and allowed_file(lookup_file.filename)):
+        lookups = None
+        if lookups_param:
+            if not main_sheet:
+                return jsonify({'success': False, 'error': '缺少必要的参数'})
+            lookups, error = parse_batch_lookups(json.loads(lookups_param), main_match_type,
+                                                 main_columns, duplicate_policy, match_mode)
+            if error:
+                return jsonify({'success': False, 'error': error})
+        else:
+            required = [main_sheet, main_match_type, main_columns]
+            if not lookup_table:
+                required += [lookup_sheet, lookup_match_type, lookup_match_columns, return_type, return_columns]
+            if not all(required):
+                return jsonify({'success': False, 'error': '缺少必要的参数'})
+            if duplicate_policy not in DUPLICATE_POLICIES:
+                return jsonify({'success': False, 'error': '不支持的重复值处理方式'})
+            if match_mode not in MATCH_MODES:
+                return jsonify({'success': False, 'error': '不支持的匹配方式'})
+
+        if not main_token and not allowed_file(main_file.filename):
+            return jsonify({'success': False, 'error': '不支持的文件格式'})
+        if not lookups and not lookup_table and not lookup_token and not allowed_file(lookup_file.filename):
             return jsonify({'success': False, 'error': '不支持的文件格式'})
+        if lookup_table:
+            lookup_registry.get(lookup_table)  # 不存在时直接报错
 
-        # 生成唯一的结果文件名
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        result_filename = f'result_{timestamp}.xlsx'
-        result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
+        # 分配唯一的结果 ID
+        result_id, result_path = result_store.allocate()
 
         # 保存文件
-        main_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(main_file.filename))
-        main_file.save(main_path)
-
-        if lookup_file != main_file:
+        if main_token:
+            main_path = workbook_cache.get_path(main_token)
+        else:
+            main_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(main_file.filename))
+            main_file.save(main_path)
+
+        if lookups or lookup_table:
+            lookup_path = None
+        elif lookup_token:
+            lookup_path = workbook_cache.get_path(lookup_token)
+        elif lookup_file != main_file:
             # 如果是不同文件，则保存查找表文件
             lookup_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(lookup_file.filename))
             lookup_file.save(lookup_path)
@@ -186,54 +356,110 @@ def vlookup():
             lookup_path = main_path
 
         # 处理VLOOKUP
-        processor = VlookupProcessor(main_path, lookup_path, result_path)
-        success, error_message = processor.process(
-            main_sheet=main_sheet,
-            main_match_type=main_match_type,
-            main_columns=main_columns,
-            lookup_sheet=lookup_sheet,
-            lookup_match_type=lookup_match_type,
-            lookup_match_columns=lookup_match_columns,
-            return_type=return_type,
-            return_columns=return_columns
-        )
-        
-        # 清理临时文件
-        processor.cleanup()
+        def run():
+            processor = VlookupProcessor(main_path, lookup_path, result_path)
+            try:
+                if lookups:
+                    success, error_message = processor.process_batch(main_sheet, lookups)
+                else:
+                    success, error_message = processor.process(
+                        main_sheet=main_sheet,
+                        main_match_type=main_match_type,
+                        main_columns=main_columns,
+                        lookup_sheet=lookup_sheet,
+                        lookup_match_type=lookup_match_type,
+                        lookup_match_columns=lookup_match_columns,
+                        return_type=return_type,
+                        return_columns=return_columns,
+                        duplicate_policy=duplicate_policy,
+                        lookup_table=lookup_table,
+                        match_mode=match_mode
+                    )
+            finally:
+                # 清理临时文件
+                processor.cleanup()
+            
+            if success:
+                result_store.add(result_id)
+                return {'success': True, 'resultId': result_id}
+            result_store.discard(result_id)
+            return {'success': False, 'error': error_message}
         
-        if success:
-            return jsonify({'success': True})
-        else:
-            return jsonify({'success': False, 'error': error_message})
+        return run_as_job('vlookup', run, result_id)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/lookup-tables', methods=['GET'])
+def list_lookup_tables():
+    """已注册的常用查找表"""
+    return jsonify({'success': True, 'tables': lookup_registry.list_tables()})
+
+@app.route('/api/lookup-tables', methods=['POST'])
+def register_lookup_table():
+    """
+    注册常用查找表：解析一次查找表并保存索引，之后的 VLOOKUP 通过 lookupTable 参数按名称引用
+    源文件内容未变化时直接复用已有索引
+    """
+    try:
+        name = request.form.get('name', '')
+        sheet = request.form.get('sheet')
+        match_columns = json.loads(request.form.get('matchColumns', '[]'))
+        return_columns = json.loads(request.form.get('returnColumns', '[]'))
+        if not sheet:
+            return jsonify({'success': False, 'error': '缺少必要的参数'})
+
+        file_path, error = resolve_workbook()
+        if error:
+            return jsonify({'success': False, 'error': error})
+
+        token = request.form.get('token')
+        if token:
+            source_name = workbook_cache.get_filename(token)
+        else:
+            source_name = request.files['file'].filename
+
+        try:
+            table, rebuilt = lookup_registry.register(
+                name, file_path, sheet, match_columns, return_columns, source_name=source_name
+            )
+        finally:
+            if not workbook_cache.is_session_file(file_path) and os.path.exists(file_path):
+                os.remove(file_path)
+
+        return jsonify({'success': True, 'table': table, 'rebuilt': rebuilt})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/lookup-tables/<name>', methods=['DELETE'])
+def delete_lookup_table(name):
+    """删除常用查找表"""
+    try:
+        lookup_registry.unregister(name)
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/concatenate', methods=['POST'])
 def concatenate():
     try:
-        if 'file' not in request.files:
+        if 'file' not in request.files and not request.form.get('token'):
             return jsonify({'success': False, 'error': '请上传文件'})
         
-        file = request.files['file']
         sheet = request.form.get('sheet')
         columns_data = json.loads(request.form.get('columnsData', '[]'))
         
-        if not all([file.filename, sheet, columns_data]):
+        if not all([sheet, columns_data]):
             return jsonify({'success': False, 'error': '缺少必要的参数'})
-            
-        if not allowed_file(file.filename):
-            return jsonify({'success': False, 'error': '不支持的文件格式'})
         
-        # 生成唯一的结果文件名
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        result_filename = f'result_{timestamp}.xlsx'
-        
-        # 保存文件
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
-        result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
+        # 保存文件（或使用已上传的工作簿）
+        file_path, error = resolve_workbook()
+        if error:
+            return jsonify({'success': False, 'error': error})
         
-        file.save(file_path)
+        # 分配唯一的结果 ID
+        result_id, result_path = result_store.allocate()
         
         # 理合并
         processor = ConcatenateProcessor(file_path, result_path)
@@ -243,8 +469,10 @@ def concatenate():
         processor.cleanup()
         
         if success:
-            return jsonify({'success': True})
+            result_store.add(result_id)
+            return jsonify({'success': True, 'resultId': result_id})
         else:
+            result_store.discard(result_id)
             return jsonify({'success': False, 'error': error_message})
             
     except Exception as e:
@@ -253,18 +481,14 @@ def concatenate():
 @app.route('/api/pivot', methods=['POST'])
 def pivot():
     try:
-        if 'file' not in request.files:
+        if 'file' not in request.files and not request.form.get('token'):
             return jsonify({'success': False, 'error': '请上传文件'})
         
-        file = request.files['file']
         sheet = request.form.get('sheet')
         config = json.loads(request.form.get('config', '{}'))
         
-        if not all([file.filename, sheet, config]):
+        if not all([sheet, config]):
             return jsonify({'success': False, 'error': '缺少要的参数'})
-            
-        if not allowed_file(file.filename):
-            return jsonify({'success': False, 'error': '不支持的文件格式'})
         
         # 验证配置
         if not config.get('rows'):
@@ -272,46 +496,70 @@ def pivot():
         if not config.get('values'):
             return jsonify({'success': False, 'error': '请至少选择一个值字段'})
         
-        # 生成唯一的结果文件名
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        result_filename = f'result_{timestamp}.xlsx'
+        # 保存文件（或使用已上传的工作簿）
+        file_path, error = resolve_workbook()
+        if error:
+            return jsonify({'success': False, 'error': error})
         
-        # 保存文件
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
-        result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-        
-        file.save(file_path)
+        # 分配唯一的结果 ID
+        result_id, result_path = result_store.allocate()
         
         # 处理透视表
-        processor = PivotProcessor(file_path, result_path)
-        success, error_message = processor.process(sheet, config)
-        
-        # 清理临时文件
-        processor.cleanup()
+        def run():
+            processor = PivotProcessor(file_path, result_path)
+            try:
+                success, error_message = processor.process(sheet, config)
+            finally:
+                # 清理临时文件
+                processor.cleanup()
+            
+            if success:
+                result_store.add(result_id)
+                return {'success': True, 'resultId': result_id}
+            result_store.discard(result_id)
+            return {'success': False, 'error': error_message}
         
-        if success:
-            return jsonify({'success': True})
-        else:
-            return jsonify({'success': False, 'error': error_message})
+        return run_as_job('pivot', run, result_id)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """查询后台任务的状态和进度"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/result')
+def job_result(job_id):
+    """获取已完成任务的结果（与同步调用接口时的返回内容相同）"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+    if job.status == 'failed':
+        return jsonify({'success': False, 'error': job.error})
+    if job.status != 'finished':
+        return jsonify({'success': False, 'status': job.status, 'error': '任务尚未完成'}), 202
+    return jsonify(job.result)
+
 @app.route('/api/download-result')
 def download_result():
     try:
-        # 获取最新的结果文件
-        result_files = glob.glob(os.path.join(app.config['RESULT_FOLDER'], 'result_*.xlsx'))
-        if not result_files:
-            return jsonify({'success': False, 'error': '没有可下载的结果文件'})
+        # 按结果 ID 下载（每次处理的结果相互独立）
+        result_id = request.args.get('id')
+        if not result_id:
+            return jsonify({'success': False, 'error': '缺少结果 ID'}), 400
         
-        # 按文件名排序（因为包含时间戳），获取最新的文件
-        latest_result = max(result_files)
+        result = result_store.get(result_id)
+        if result is None:
+            return jsonify({'success': False, 'error': '结果文件不存在或已过期，请重新处理'}), 404
         
         return send_file(
-            latest_result,
+            result['path'],
             as_attachment=True,
-            download_name='result.xlsx'
+            download_name=result['download_name']
         )
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -320,25 +568,26 @@ def download_result():
 def check_column_type():
     try:
         data = request.json
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], data['file'])
+        if data.get('token'):
+            file_path = workbook_cache.get_path(data['token'])
+        else:
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], data['file'])
         sheet = data['sheet']
         column = data['column']
 
-        # 读取Excel文件
-        df = pd.read_excel(file_path, sheet_name=sheet)
-        
         # 获取列索引
-        col_idx = ord(column.upper()) - ord('A')
+        col_idx = column_index(column)
         
-        # 获取列数据
-        col_data = df.iloc[:, col_idx]
+        # 检查整列（与透视表判断值列类型的方式一致），只读取这一列：
+        # 会话中的工作簿直接从内存缓存或列式文件取出该列
+        df = workbook_cache.read_sheet(file_path, sheet, usecols=[col_idx])
+        if col_idx >= df.attrs.get('sheet_width', len(df.columns)):
+            return jsonify({'error': f'列标识 {column} 超出范围'}), 400
         
-        # 检查是否可以转换为数值
-        try:
-            pd.to_numeric(col_data, errors='raise')
+        # 空列和数值列都可以进行数值聚合
+        if numeric_columns(df, [df.columns[0]]):
             return jsonify({'type': 'numeric'})
-        except:
-            return jsonify({'type': 'text'})
+        return jsonify({'type': 'text'})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -419,23 +668,32 @@ def merge_excel():
         merge_mode = request.form.get('mergeMode', 'sheets')
         output_filename = request.form.get('filename', '合并文件')
         
-        # 创建 ExcelProcessor 实例
-        processor = ExcelProcessor()
+        # 后台任务在请求结束后执行，先把上传的文件复制到内存
+        files = detach_uploads(file for file in files if file.filename)
         
-        # 处理文件合并
-        result = processor.merge_excel(
-            files,
-            merge_all=merge_all,
-            add_source=add_source,
-            output_filename=output_filename,
-            merge_mode=merge_mode
-        )
+        def run():
+            try:
+                # 创建 ExcelProcessor 实例
+                processor = ExcelProcessor()
+                
+                # 处理文件合并
+                result = processor.merge_excel(
+                    files,
+                    merge_all=merge_all,
+                    add_source=add_source,
+                    output_filename=output_filename,
+                    merge_mode=merge_mode
+                )
+                
+                return {
+                    'success': True,
+                    'filename': result['filename'],
+                    'downloadUrl': result['downloadUrl']
+                }
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
         
-        return jsonify({
-            'success': True,
-            'filename': result['filename'],
-            'downloadUrl': result['downloadUrl']
-        })
+        return run_as_job('merge', run)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -462,25 +720,22 @@ def cleanup_temp_files():
     """定期清理临时文件"""
     try:
         current_time = datetime.now()
-        expiry_time = current_time - timedelta(seconds=config.RESULT_EXPIRY)
+        expiry_time = current_time - timedelta(seconds=RESULT_EXPIRY)
         
-        # 清理上传目录
+        # 清理上传目录（会话工作簿和列式文件目录由 workbook_cache 按会话有效期清理）
+        workbook_cache.purge_expired()
         for filename in os.listdir(app.config['UPLOAD_FOLDER']):
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            if not os.path.isfile(file_path) or workbook_cache.is_session_file(file_path):
+                continue
             if os.path.getmtime(file_path) < expiry_time.timestamp():
                 try:
                     os.remove(file_path)
                 except Exception as e:
                     print(f"清理临时文件失败: {str(e)}")
         
-        # 清理结果目录
-        for filename in os.listdir(app.config['RESULT_FOLDER']):
-            file_path = os.path.join(app.config['RESULT_FOLDER'], filename)
-            if os.path.getmtime(file_path) < expiry_time.timestamp():
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    print(f"清理结果文件失败: {str(e)}")
+        # 清理结果目录（由结果索引按有效期和磁盘预算淘汰）
+        result_store.evict()
                     
     except Exception as e:
         print(f"清理文件时出错: {str(e)}")
@@ -542,16 +797,19 @@ def import_data():
             upload_folder=app.config['UPLOAD_FOLDER'],
             download_folder=app.config['DOWNLOAD_FOLDER']
         )
-        result = processor.import_data(
-            files=files,
-            source_type=source_type,
-            delimiter=delimiter,
-            start_row=start_row,
-            header_row=header_row,
-            auto_split=auto_split
-        )
-        
-        return jsonify(result)
+        files = detach_uploads(files)
+        
+        def run():
+            return processor.import_data(
+                files=files,
+                source_type=source_type,
+                delimiter=delimiter,
+                start_row=start_row,
+                header_row=header_row,
+                auto_split=auto_split
+            )
+        
+        return run_as_job('import', run)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
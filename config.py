@@ -16,9 +16,42 @@ ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'txt', 'csv'}  # 添加 csv 格式
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 最大文件大小限制：16MB
 
 # 数据处理配置
-MAX_ROWS = 100000        # 最大处理行数
+MAX_ROWS = 100000        # 最大处理行数（分块读取时超出即停止；VLOOKUP 主表见 VLOOKUP_MAX_MAIN_ROWS）
 CHUNK_SIZE = 10000       # 分块处理的大小
+CHUNKED_PROCESSING = True  # 逐行操作（VLOOKUP、文本合并、导入、合并）按 CHUNK_SIZE 分块读取、处理和写出
+HASHED_COMPOSITE_KEYS = True  # 多列匹配时用 64 位哈希作为组合键（检查哈希冲突，冲突时改用字符串组合键）
+VLOOKUP_DUPLICATE_POLICY = 'last'  # 查找表匹配值重复时的默认处理方式：first（第一条）/ last（最后一条）/ error（报错）/
+                                   # all（全部，主表行展开）/ count（匹配数）/ sum（求和）/ join（连接）
+VLOOKUP_JOIN_SEPARATOR = '、'  # join 方式连接多个匹配值时使用的分隔符
+VLOOKUP_MAX_LOOKUPS = 10  # 一次批量 VLOOKUP 最多包含的查找表数量
+VLOOKUP_MAX_MAIN_ROWS = 1048576  # VLOOKUP 主表最大行数：主表逐块读取、匹配、写出，内存占用与行数无关，上限取 Excel 单个工作表的行数
+FUZZY_MATCH_THRESHOLD = 0.6  # 模糊匹配的最低相似度（二元组 Dice 系数，0～1），低于此值视为未匹配
+HEADER_PROBE_ROWS = 50   # 探测列信息时采样的数据行数
+AUTOFIT_SAMPLE_ROWS = 1000  # 自动列宽计算时采样的行数
 RESULT_EXPIRY = 3600    # 结果文件过期时间（秒）
+RESULT_MAX_BYTES = 1024 * 1024 * 1024  # 结果文件占用磁盘的上限（字节），超出时删除最早的结果
+
+# Excel 读取引擎配置（所有处理器统一通过 functions/reader.py 读取）
+# 可选值：openpyxl / calamine（需要安装 python-calamine，速度快数倍）/ xlrd（仅 .xls）/ auto（自动选择最快的可用引擎）
+# 指定的引擎未安装时自动回退到可用的引擎
+EXCEL_READER_ENGINE = 'openpyxl'  # .xlsx / .xlsm 使用的引擎
+XLS_READER_ENGINE = 'xlrd'        # .xls 使用的引擎
+STYLED_WRITER_ENGINE = 'auto'     # 带样式结果（透视表）的写出引擎：xlsxwriter / openpyxl（只写模式）/ auto（已安装 xlsxwriter 时优先使用）
+
+# 工作簿会话缓存配置
+WORKBOOK_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 已解析工作表缓存的内存上限（字节）
+WORKBOOK_SESSION_EXPIRY = 3600                # 工作簿会话过期时间（秒）
+COLUMNAR_STORE_ENABLED = True                 # 是否把会话中工作簿解析后的工作表转存为 Arrow 列式文件（需要 pyarrow）
+COLUMNAR_FOLDER = os.path.join(UPLOAD_FOLDER, 'columnar')  # 列式文件存储目录
+LOOKUP_REGISTRY_FOLDER = os.path.join(BASE_DIR, 'lookup_tables')  # 常用查找表索引的存储目录（长期保存，不随会话过期）
+PIVOT_CUBE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 透视立方体（按最细分组预聚合的结果）缓存的内存上限（字节）
+PIVOT_HLL_PRECISION = 12         # 近似去重计数（HyperLogLog）的精度：每个分组最多 2^12 个寄存器，标准误差约 1.6%
+PIVOT_QUANTILE_ACCURACY = 0.01   # 近似中位数、分位数的相对误差上限（对数分桶）
+
+# 后台任务配置
+JOB_WORKERS = 4          # 同时执行的后台任务数
+JOB_QUEUE_SIZE = 32      # 排队和执行中的任务总数上限
+JOB_EXPIRY = 3600        # 任务完成后状态和结果的保留时间（秒）
 
 # 错误消息配置
 ERROR_MESSAGES = {
@@ -26,7 +59,8 @@ ERROR_MESSAGES = {
     'invalid_format': '不支持的文件格式',
     'file_too_large': '文件大小超过限制',
     'no_sheets': '文件中没有工作表',
-    'process_failed': '处理失败，请检查数据格式'
+    'process_failed': '处理失败，请检查数据格式',
+    'too_many_rows': '数据行数超过上限（最多 {max_rows} 行）'
 }
 
 # 开发环境配置
@@ -5,17 +5,18 @@ import pandas as pd
 import numpy as np
 from abc import ABC, abstractmethod
 
+from functions.reader import read_excel
+
 def parse_excel_for_chart(file_content):
     """解析Excel文件为图表数据"""
     try:
-        # 读取所有sheet
-        excel_file = pd.ExcelFile(BytesIO(file_content))
-        sheet_names = excel_file.sheet_names
+        # 一次读取所有sheet
+        all_sheets = read_excel(BytesIO(file_content), sheet_name=None)
+        sheet_names = list(all_sheets.keys())
         
         # 返回所有sheet的数据
         sheets_data = {}
-        for sheet in sheet_names:
-            df = pd.read_excel(BytesIO(file_content), sheet_name=sheet)
+        for sheet, df in all_sheets.items():
             sheets_data[sheet] = {
                 'columns': df.columns.tolist(),
                 'data': df.to_dict('records')
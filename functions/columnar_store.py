@@ -0,0 +1,308 @@
+import pandas as pd
+import numpy as np
+import os
+import hashlib
+import json
+import numbers
+import threading
+import time
+import uuid
+from datetime import date, datetime, time as dt_time
+from typing import Iterator, List, Optional
+
+from functions.reader import read_excel
+from config import COLUMNAR_FOLDER, COLUMNAR_STORE_ENABLED, WORKBOOK_SESSION_EXPIRY
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow 为可选依赖，未安装时直接解析 Excel
+    pa = None
+
+_META_KEY = b'excel_tools'
+
+# object 列按值的类型拆分存储，读取时用 fill 值补齐空位后再按掩码还原
+_KIND_FILL = {'int': 0, 'float': 0.0, 'bool': False}
+_KIND_TYPES = {
+    'str': lambda: pa.string(),
+    'bool': lambda: pa.bool_(),
+    'int': lambda: pa.int64(),
+    'float': lambda: pa.float64(),
+    'datetime': lambda: pa.timestamp('us'),
+    'date': lambda: pa.date32(),
+    'time': lambda: pa.time64('us'),
+}
+
+
+def _value_kind(value) -> str:
+    """判断混合类型列中单个值的类型"""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, numbers.Integral):
+        return 'int' if -2 ** 63 <= value < 2 ** 63 else 'str'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, datetime):
+        return 'datetime'
+    if isinstance(value, date):
+        return 'date'
+    if isinstance(value, dt_time):
+        return 'time'
+    return 'str'
+
+
+def _label_to_json(label):
+    """列名只保留 JSON 可表示的类型"""
+    if isinstance(label, (bool, np.bool_)):
+        return str(label)
+    if isinstance(label, numbers.Integral):
+        return int(label)
+    if isinstance(label, float):
+        return label
+    return str(label)
+
+
+class ColumnarStore:
+    """
+    Arrow 列式中间存储
+    每个工作表第一次被读取时解析一次 Excel 并写成 Arrow IPC 文件，
+    之后的读取通过内存映射完成，并且只加载用到的列
+    """
+
+    def __init__(self, folder: str, enabled: bool, expiry: int):
+        self.folder = folder
+        self.enabled = enabled and pa is not None
+        self.expiry = expiry
+        self._lock = threading.Lock()
+        self._hashes = {}  # 文件路径 -> (修改时间, 大小, 内容哈希)
+
+        if self.enabled:
+            os.makedirs(self.folder, exist_ok=True)
+
+    def file_hash(self, file_path: str) -> str:
+        """计算文件内容哈希，未修改过的文件只计算一次"""
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        cached = self._hashes.get(key)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        digest = hasher.hexdigest()[:32]
+        self._hashes[key] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def _store_path(self, file_hash: str, sheet_name: str, header) -> str:
+        sheet_key = hashlib.sha1(str(sheet_name).encode('utf-8')).hexdigest()[:12]
+        header_key = 'none' if header is None else str(header)
+        return os.path.join(self.folder, f"{file_hash}_{sheet_key}_{header_key}.arrow")
+
+    def read(self, file_path: str, sheet_name: str, header=0,
+             usecols: Optional[List[int]] = None, file_hash: Optional[str] = None) -> pd.DataFrame:
+        """
+        读取工作表，首次读取时转换为 Arrow 文件
+        :param usecols: 需要的列位置，None 表示全部列
+        """
+        file_hash = file_hash or self.file_hash(file_path)
+        store_path = self._store_path(file_hash, sheet_name, header)
+
+        if not os.path.exists(store_path):
+            df = read_excel(file_path, sheet_name=sheet_name, header=header)
+            try:
+                self.write_frame(store_path, df)
+            except Exception as e:
+                print(f"写入列式缓存失败: {str(e)}")
+            if usecols is None:
+                df.attrs['sheet_width'] = len(df.columns)
+                return df
+            return project_columns(df, usecols)
+
+        os.utime(store_path)
+        return self.read_frame(store_path, usecols)
+
+    def write_frame(self, path: str, df: pd.DataFrame):
+        """把 DataFrame 写成 Arrow IPC 文件，并顺带清理过期文件"""
+        self.purge_expired()
+        write_frame(path, df)
+
+    def read_frame(self, path: str, usecols: Optional[List[int]] = None) -> pd.DataFrame:
+        """通过内存映射读取 Arrow 文件，只物化需要的列"""
+        return read_frame(path, usecols)
+
+    def iter_frames(self, path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """按行切片读取 Arrow 文件，每次只物化 chunk_size 行"""
+        with pa.memory_map(path, 'r') as source:
+            table = ipc.open_file(source).read_all()
+            metadata = json.loads(table.schema.metadata[_META_KEY].decode('utf-8'))
+            positions = range(len(metadata['labels']))
+            total = metadata['rows']
+            for start in range(0, max(total, 1), chunk_size):
+                length = min(chunk_size, total - start)
+                chunk = _table_to_frame(table.slice(start, length), metadata, positions, length)
+                chunk.index = pd.RangeIndex(start, start + length)
+                yield chunk
+
+    def stored_path(self, file_path: str, sheet_name: str, header=0,
+                    file_hash: Optional[str] = None) -> Optional[str]:
+        """工作表已转换为列式文件时返回文件路径，否则返回 None"""
+        if not self.enabled:
+            return None
+        store_path = self._store_path(file_hash or self.file_hash(file_path), sheet_name, header)
+        if not os.path.exists(store_path):
+            return None
+        os.utime(store_path)
+        return store_path
+
+    def remove(self, file_hash: str):
+        """删除一个工作簿（按内容哈希）的所有列式文件"""
+        if not self.enabled:
+            return
+        prefix = f"{file_hash}_"
+        with self._lock:
+            for filename in os.listdir(self.folder):
+                if filename.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(self.folder, filename))
+                    except OSError:
+                        pass
+
+    def purge_expired(self):
+        """清理长时间未被读取的列式文件"""
+        now = time.time()
+        with self._lock:
+            for filename in os.listdir(self.folder):
+                path = os.path.join(self.folder, filename)
+                try:
+                    if now - os.path.getmtime(path) > self.expiry:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+def write_frame(path: str, df: pd.DataFrame):
+    """把 DataFrame 写成 Arrow IPC 文件（不压缩，便于内存映射）"""
+    arrays, names, columns_meta = [], [], []
+    for pos in range(len(df.columns)):
+        series = df.iloc[:, pos]
+        meta = {'fields': []}
+
+        if series.dtype == object:
+            na_mask = series.isna().to_numpy()
+            values = series.to_numpy()
+            kinds = pd.Series([_value_kind(v) for v in values[~na_mask]], dtype=object)
+            unique_kinds = kinds.unique().tolist()
+            meta['kind'] = 'object'
+
+            if len(unique_kinds) <= 1:
+                kind = unique_kinds[0] if unique_kinds else 'str'
+                field = f"c{pos}"
+                arr = values.copy()
+                arr[na_mask] = None
+                if kind == 'str':
+                    arr[~na_mask] = [str(v) for v in arr[~na_mask]]
+                arrays.append(pa.array(arr, type=_KIND_TYPES[kind](), from_pandas=True))
+                names.append(field)
+                meta['fields'].append([field, kind])
+            else:
+                # 混合类型列：每种类型单独存一列，其他位置为空
+                kind_array = np.full(len(values), None, dtype=object)
+                kind_array[~na_mask] = kinds.to_numpy()
+                for kind in unique_kinds:
+                    field = f"c{pos}_{kind}"
+                    mask = kind_array == kind
+                    arr = np.full(len(values), None, dtype=object)
+                    if kind == 'str':
+                        arr[mask] = [str(v) for v in values[mask]]
+                    else:
+                        arr[mask] = values[mask]
+                    arrays.append(pa.array(arr, type=_KIND_TYPES[kind](), from_pandas=True))
+                    names.append(field)
+                    meta['fields'].append([field, kind])
+        else:
+            field = f"c{pos}"
+            arrays.append(pa.Array.from_pandas(series))
+            names.append(field)
+            meta['kind'] = 'plain'
+            meta['fields'].append([field, None])
+
+        columns_meta.append(meta)
+
+    metadata = {
+        'labels': [_label_to_json(label) for label in df.columns],
+        'columns': columns_meta,
+        'rows': len(df)
+    }
+    table = pa.Table.from_arrays(arrays, names=names)
+    table = table.replace_schema_metadata({_META_KEY: json.dumps(metadata).encode('utf-8')})
+
+    # 先写临时文件再改名，避免并发读取到写了一半的文件
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+
+def read_frame(path: str, usecols: Optional[List[int]] = None) -> pd.DataFrame:
+    """通过内存映射读取 Arrow 文件，只物化需要的列"""
+    with pa.memory_map(path, 'r') as source:
+        table = ipc.open_file(source).read_all()
+        metadata = json.loads(table.schema.metadata[_META_KEY].decode('utf-8'))
+        width = len(metadata['labels'])
+        positions = range(width) if usecols is None else \
+            [i for i in dict.fromkeys(usecols) if 0 <= i < width]
+        return _table_to_frame(table, metadata, positions)
+
+
+def _table_to_frame(table, metadata: dict, positions, rows: Optional[int] = None) -> pd.DataFrame:
+    """把 Arrow 表中指定位置的列还原为 DataFrame"""
+    rows = metadata['rows'] if rows is None else rows
+    labels = metadata['labels']
+    data = {}
+    for pos in positions:
+        meta = metadata['columns'][pos]
+        fields = meta['fields']
+        if meta['kind'] == 'plain':
+            data[pos] = table.column(fields[0][0]).to_pandas()
+            continue
+
+        values = np.full(rows, np.nan, dtype=object)
+        for field, kind in fields:
+            column = table.column(field)
+            mask = pc.is_valid(column).to_numpy(zero_copy_only=False)
+            if not mask.any():
+                continue
+            if kind in _KIND_FILL:
+                part = column.fill_null(_KIND_FILL[kind]).to_numpy(zero_copy_only=False)
+                values[mask] = part[mask].tolist()
+            elif kind == 'str':
+                values[mask] = column.to_numpy(zero_copy_only=False)[mask]
+            else:
+                part = column.to_pylist()
+                values[mask] = [v for v, m in zip(part, mask) if m]
+        data[pos] = pd.Series(values, dtype=object)
+
+    df = pd.DataFrame(data, index=pd.RangeIndex(rows))
+    df.columns = [labels[pos] for pos in positions]
+    df.attrs['sheet_width'] = len(labels)
+    return df
+
+
+def project_columns(df: pd.DataFrame, usecols: Optional[List[int]] = None) -> pd.DataFrame:
+    """按列位置选取列（超出范围的位置会被忽略），并记录工作表原始列数"""
+    width = len(df.columns)
+    if usecols is None:
+        result = df.copy()
+    else:
+        positions = [i for i in dict.fromkeys(usecols) if 0 <= i < width]
+        result = df.iloc[:, positions].copy()
+    result.attrs['sheet_width'] = width
+    return result
+
+
+# 全局共享的列式存储
+columnar_store = ColumnarStore(COLUMNAR_FOLDER, COLUMNAR_STORE_ENABLED, WORKBOOK_SESSION_EXPIRY)
@@ -1,6 +1,20 @@
 import pandas as pd
 import os
 from typing import Tuple, List
+from itertools import chain
+from functions.workbook_cache import workbook_cache
+from functions.reader import list_sheets, probe_sheet, column_index, column_letters
+from functions.writer import StreamingWriter
+
+
+def _cell_text(value) -> str:
+    """单元格转为合并用的文本：空值为空文本，整数值的浮点数去掉小数点（10000.0 -> 10000）"""
+    if pd.isna(value):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
 
 class ConcatenateProcessor:
     def __init__(self, file_path: str, result_path: str):
@@ -11,24 +25,23 @@ class ConcatenateProcessor:
     def get_sheets(file_path: str) -> List[str]:
         """获取Excel文件中的所有工作表名称"""
         try:
-            with pd.ExcelFile(file_path) as xl:
-                return xl.sheet_names
+            return list_sheets(file_path)
         except Exception as e:
             raise Exception(f"读取工作表失败: {str(e)}")
 
     @staticmethod
     def get_sheet_info(file_path: str, sheet_name: str) -> dict:
-        """获取工作表的列信息"""
+        """获取工作表的列信息（只读取表头和采样行）"""
         try:
-            df = pd.read_excel(file_path, sheet_name=sheet_name, header=None)
             # 获取第一行作为参考
-            headers = [str(x).strip() if pd.notna(x) else '' for x in df.iloc[0].tolist()]
-            columns = [chr(65 + i) for i in range(len(headers))]
+            info = probe_sheet(file_path, sheet_name)
+            headers = info['headers']
+            columns = column_letters(len(headers))
             
-            del df
             return {
                 'headers': headers,
-                'columns': columns
+                'columns': columns,
+                'dtypes': info['dtypes']
             }
         except Exception as e:
             raise Exception(f"读取列信息失败: {str(e)}")
@@ -44,7 +57,7 @@ class ConcatenateProcessor:
         try:
             # 将列号转换为索引
             def get_column_index(col_letter: str) -> int:
-                return ord(col_letter.upper()) - 65
+                return column_index(col_letter)
 
             # 获取所有列索引和分隔符
             columns = [item['column'] for item in columns_data]
@@ -53,35 +66,6 @@ class ConcatenateProcessor:
             separator_before = [item.get('separator_before', False) for item in columns_data]
             col_indices = [get_column_index(col) for col in columns]
 
-            # 读取Excel文件
-            df = pd.read_excel(self.file_path, sheet_name=sheet, header=None)
-
-            # 验证列索引是否有效
-            if any(idx >= len(df.columns) for idx in col_indices):
-                return False, "列号超出范围"
-
-            # 创建用于合并的数据副本
-            df_merge = df.copy()
-
-            # 处理每一列的数据
-            for idx in col_indices:
-                try:
-                    numeric_data = pd.to_numeric(df_merge[idx], errors='coerce')
-                    if numeric_data.notna().all():
-                        df_merge[idx] = numeric_data.astype(int).astype(str)
-                    else:
-                        df_merge[idx] = (df_merge[idx]
-                                       .fillna('')
-                                       .astype(str)
-                                       .str.strip()
-                                       .replace('nan', ''))
-                except:
-                    df_merge[idx] = (df_merge[idx]
-                                   .fillna('')
-                                   .astype(str)
-                                   .str.strip()
-                                   .replace('nan', ''))
-
             # 合并选定的列
             def merge_columns(row):
                 result = []
@@ -102,12 +86,26 @@ class ConcatenateProcessor:
                 
                 return ''.join(result)
 
-            # 创建结果DataFrame
-            result = df.copy()
-            result[len(result.columns)] = df_merge.apply(merge_columns, axis=1)
+            # 按 CHUNK_SIZE 分块读取Excel文件，逐块合并后写出
+            chunks = workbook_cache.iter_chunks(self.file_path, sheet, header=None)
+            df = next(chunks)
+
+            # 验证列索引是否有效
+            if any(idx >= len(df.columns) for idx in col_indices):
+                return False, "列号超出范围"
+
+            with StreamingWriter(self.result_path) as writer:
+                output = writer.add_sheet('Sheet1', header=False)
+                for df in chain([df], chunks):
+                    # 创建用于合并的数据副本，逐个值转为文本（结果与分块边界、每块推断出的列类型无关）
+                    df_merge = df.copy()
+                    for idx in col_indices:
+                        df_merge[idx] = df_merge[idx].map(_cell_text)
 
-            # 保存结果
-            result.to_excel(self.result_path, index=False, header=False)
+                    # 创建结果块
+                    df[len(df.columns)] = df_merge.apply(merge_columns, axis=1)
+                    output.write_frame(df)
+                    del df_merge
 
             return True, ""
             
@@ -119,7 +117,7 @@ class ConcatenateProcessor:
     def cleanup(self):
         """清理临时文件"""
         try:
-            if os.path.exists(self.file_path):
+            if os.path.exists(self.file_path) and not workbook_cache.is_session_file(self.file_path):
                 os.close(os.open(self.file_path, os.O_RDONLY))
                 os.remove(self.file_path)
         except Exception as e:
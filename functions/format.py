@@ -7,6 +7,11 @@ from werkzeug.utils import secure_filename
 import shutil
 import gc
 import time
+from functions.reader import list_sheets
+from functions.workbook_cache import workbook_cache, RowLimitError
+from functions.writer import StreamingWriter
+from functions.jobs import report_progress
+from config import MAX_ROWS, ERROR_MESSAGES
 
 class ExcelProcessor:
     def __init__(self):
@@ -44,50 +49,46 @@ class ExcelProcessor:
             used_filenames = set()  # 用于跟踪已使用的文件名
             
             try:
-                with pd.ExcelFile(file_path) as excel_file:
-                    sheets_to_split = excel_file.sheet_names if split_all else selected_sheets
+                sheet_names = list_sheets(file_path)
+                sheets_to_split = sheet_names if split_all else selected_sheets
                     
-                    for sheet_name in sheets_to_split:
-                        try:
-                            # 读取工作表
-                            df = pd.read_excel(file_path, sheet_name=sheet_name)
+                for sheet_name in sheets_to_split:
+                    try:
+                        # 生成安全的文件名（用于存储）
+                        safe_base_name = secure_filename(original_filename)
+                        safe_sheet_name = secure_filename(sheet_name)
+                        safe_output_filename = f"{safe_base_name}_{safe_sheet_name}.xlsx"
                             
-                            # 生成安全的文件名（用于存储）
-                            safe_base_name = secure_filename(original_filename)
-                            safe_sheet_name = secure_filename(sheet_name)
-                            safe_output_filename = f"{safe_base_name}_{safe_sheet_name}.xlsx"
+                        # 处理文件名冲突
+                        counter = 1
+                        while safe_output_filename in used_filenames:
+                            safe_output_filename = f"{safe_base_name}_{safe_sheet_name}_{counter}.xlsx"
+                            counter += 1
                             
-                            # 处理文件名冲突
-                            counter = 1
-                            while safe_output_filename in used_filenames:
-                                safe_output_filename = f"{safe_base_name}_{safe_sheet_name}_{counter}.xlsx"
-                                counter += 1
+                        used_filenames.add(safe_output_filename)
+                        output_path = os.path.join(self.result_folder, safe_output_filename)
                             
-                            used_filenames.add(safe_output_filename)
-                            output_path = os.path.join(self.result_folder, safe_output_filename)
+                        # 按 CHUNK_SIZE 分块读取并流式写出
+                        with StreamingWriter(output_path) as writer:
+                            output = writer.add_sheet(sheet_name)
+                            for df in workbook_cache.iter_chunks(file_path, sheet_name):
+                                output.write_frame(df)
                             
-                            # 使用 ExcelWriter 保存并调整列宽
-                            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                                df.to_excel(writer, sheet_name=sheet_name, index=False)
-                                
-                                # 调整列宽
-                                worksheet = writer.sheets[sheet_name]
-                                for idx, col in enumerate(df.columns):
-                                    max_length = max(
-                                        df[col].astype(str).apply(len).max(),
-                                        len(str(col))
-                                    ) + 2
-                                    worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
+                        result_files.append({
+                            'filename': safe_output_filename,
+                            'originalName': f"{original_filename}_{sheet_name}.xlsx",
+                            'downloadUrl': f'/download/{safe_output_filename}?original_name={original_filename}_{sheet_name}.xlsx'
+                        })
                             
-                            result_files.append({
-                                'filename': safe_output_filename,
-                                'originalName': f"{original_filename}_{sheet_name}.xlsx",
-                                'downloadUrl': f'/download/{safe_output_filename}?original_name={original_filename}_{sheet_name}.xlsx'
-                            })
-                            
-                        except Exception as e:
-                            print(f"处理工作表 {sheet_name} 时出错: {str(e)}")
-                            continue
+                    except RowLimitError:
+                        # 行数超过上限时停止整个拆分，不留下不完整的结果文件
+                        for path in [output_path] + [os.path.join(self.result_folder, f['filename']) for f in result_files]:
+                            if os.path.exists(path):
+                                os.remove(path)
+                        raise
+                    except Exception as e:
+                        print(f"处理工作表 {sheet_name} 时出错: {str(e)}")
+                        continue
                             
             finally:
                 # 清理临时文件
@@ -118,92 +119,76 @@ class ExcelProcessor:
             print(f"添加来源列: {add_source}")
             
             add_source = True
+            total_rows = 0  # 所有输出工作表合计的数据行数，超过 MAX_ROWS 时停止合并
             
             if merge_mode == 'by-name':
-                # 按工作表名合并
-                sheet_data = {}  # 用于存储各个工作表的数据
+                # 按工作表名合并：各文件的工作表按 CHUNK_SIZE 分块读取，直接写入同名的输出工作表
+                sheet_data = {}  # 工作表名 -> {'columns': 第一个文件的列名, 'sheet': 输出工作表}
                 
-                for file in files:
-                    if file.filename == '':
-                        continue
-                    
-                    temp_filename = secure_filename(file.filename)
-                    temp_path = os.path.join(self.upload_folder, temp_filename)
-                    temp_files.append(temp_path)
-                    file.save(temp_path)
-                    
-                    try:
-                        with pd.ExcelFile(temp_path) as excel_file:
-                            sheets_to_merge = excel_file.sheet_names if merge_all else [excel_file.sheet_names[0]]
-                            
+                with StreamingWriter(output_path) as writer:
+                    for file_number, file in enumerate(files, 1):
+                        if file.filename == '':
+                            continue
+                        
+                        temp_filename = secure_filename(file.filename)
+                        temp_path = os.path.join(self.upload_folder, temp_filename)
+                        temp_files.append(temp_path)
+                        file.save(temp_path)
+                        
+                        report_progress((file_number - 1) * 100 / len(files), f"正在合并 {file.filename}")
+                        try:
+                            sheet_names = list_sheets(temp_path)
+                            sheets_to_merge = sheet_names if merge_all else [sheet_names[0]]
+                                
                             for sheet_name in sheets_to_merge:
                                 try:
-                                    # 读取工作表
-                                    df = pd.read_excel(temp_path, sheet_name=sheet_name)
-                                    
-                                    # 总是添加来源信息列
-                                    df['来源文件'] = file.filename
-                                    df['来源工作表'] = sheet_name
-                                    
-                                    # 将所有列名转换为字符串类型
-                                    df.columns = df.columns.astype(str)
-                                    
-                                    if sheet_name not in sheet_data:
-                                        # 第一次遇到这个工作表名
-                                        sheet_data[sheet_name] = {
-                                            'columns': list(df.columns),
-                                            'data': [df]
-                                        }
-                                    else:
-                                        # 检查列数是否相同（不包括来源列）
-                                        base_columns = [col for col in sheet_data[sheet_name]['columns'] 
-                                                      if col not in ['来源文件', '来源工作表']]
-                                        current_columns = [col for col in df.columns 
-                                                      if col not in ['来源文件', '来源工作表']]
-                                        
-                                        if len(base_columns) == len(current_columns):
+                                    for df in workbook_cache.iter_chunks(temp_path, sheet_name):
+                                        # 总是添加来源信息列
+                                        df['来源文件'] = file.filename
+                                        df['来源工作表'] = sheet_name
+                                            
+                                        # 将所有列名转换为字符串类型
+                                        df.columns = df.columns.astype(str)
+                                            
+                                        if sheet_name not in sheet_data:
+                                            # 第一次遇到这个工作表名
+                                            sheet_data[sheet_name] = {
+                                                'columns': list(df.columns),
+                                                'sheet': writer.add_sheet(sheet_name)
+                                            }
+                                        else:
+                                            # 检查列数是否相同（不包括来源列）
+                                            base_columns = [col for col in sheet_data[sheet_name]['columns'] 
+                                                          if col not in ['来源文件', '来源工作表']]
+                                            current_columns = [col for col in df.columns 
+                                                          if col not in ['来源文件', '来源工作表']]
+                                                
+                                            if len(base_columns) != len(current_columns):
+                                                print(f"工作表 {sheet_name} 在文件 {file.filename} 中的列数不匹配")
+                                                print(f"预期列: {base_columns}")
+                                                print(f"实际列: {current_columns}")
+                                                break
+                                            
                                             # 使用第一个文件的列名顺序
                                             df = df[sheet_data[sheet_name]['columns']]
-                                            sheet_data[sheet_name]['data'].append(df)
-                                        else:
-                                            print(f"工作表 {sheet_name} 在文件 {file.filename} 中的列数不匹配")
-                                            print(f"预期列: {base_columns}")
-                                            print(f"实际列: {current_columns}")
+                                        
+                                        # 如果不需要来源信息，则删除这些列
+                                        if not add_source:
+                                            df = df.drop(['来源文件', '来源工作表'], axis=1)
+                                        total_rows += len(df)
+                                        if total_rows > MAX_ROWS:
+                                            raise RowLimitError(ERROR_MESSAGES['too_many_rows'].format(max_rows=MAX_ROWS))
+                                        sheet_data[sheet_name]['sheet'].write_frame(df)
+                                except RowLimitError:
+                                    raise
                                 except Exception as e:
                                     print(f"处理工作表 {sheet_name} 时出错: {str(e)}")
                                     continue
-                    except Exception as e:
-                        print(f"处理文件 {file.filename} 时出错: {str(e)}")
-                        continue
-                
-                # 合并并保存数据
-                with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                    for sheet_name, sheet_info in sheet_data.items():
-                        if sheet_info['data']:  # 确保有数据要合并
-                            try:
-                                merged_df = pd.concat(sheet_info['data'], ignore_index=True)
-                                
-                                # 如果不需要来源信息，则删除这些列
-                                if not add_source:
-                                    merged_df = merged_df.drop(['来源文件', '来源工作表'], axis=1)
-                                
-                                merged_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                                
-                                # 调整列宽
-                                worksheet = writer.sheets[sheet_name]
-                                for idx, col in enumerate(merged_df.columns):
-                                    max_length = max(
-                                        merged_df[col].astype(str).apply(len).max(),
-                                        len(str(col))
-                                    ) + 2
-                                    worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
-                            except Exception as e:
-                                print(f"合并工作表 {sheet_name} 时出错: {str(e)}")
-                                continue
-                            finally:
-                                if 'merged_df' in locals():
-                                    del merged_df
-                                    gc.collect()
+                        except RowLimitError:
+                            raise
+                        except Exception as e:
+                            print(f"处理文件 {file.filename} 时出错: {str(e)}")
+                            continue
                 
                 return {
                     'filename': output_filename,
@@ -211,91 +196,70 @@ class ExcelProcessor:
                 }
             
             elif merge_mode == 'single':
-                # 合并到单个工作表
-                all_data = []
-                first_df = None  # 用于存储第一个数据框的结构
+                # 合并到单个工作表：各工作表按 CHUNK_SIZE 分块读取后依次写出
+                first_columns = None  # 第一个数据框的列名
                 
-                for file in files:
-                    if file.filename == '':
-                        continue
+                with StreamingWriter(output_path) as writer:
+                    output = writer.add_sheet('合并数据')
                     
-                    # 保存上传的文件
-                    temp_filename = secure_filename(file.filename)
-                    temp_path = os.path.join(self.upload_folder, temp_filename)
-                    temp_files.append(temp_path)
-                    file.save(temp_path)
-                    
-                    try:
-                        # 使用with语句确保Excel文件正确关闭
-                        with pd.ExcelFile(temp_path) as excel_file:
-                            sheets_to_merge = excel_file.sheet_names if merge_all else [excel_file.sheet_names[0]]
-                            
+                    for file_number, file in enumerate(files, 1):
+                        if file.filename == '':
+                            continue
+                        
+                        # 保存上传的文件
+                        temp_filename = secure_filename(file.filename)
+                        temp_path = os.path.join(self.upload_folder, temp_filename)
+                        temp_files.append(temp_path)
+                        file.save(temp_path)
+                        
+                        report_progress((file_number - 1) * 100 / len(files), f"正在合并 {file.filename}")
+                        try:
+                            # 只读取工作簿目录获取工作表名
+                            sheet_names = list_sheets(temp_path)
+                            sheets_to_merge = sheet_names if merge_all else [sheet_names[0]]
+                                
                             for sheet_name in sheets_to_merge:
                                 try:
-                                    # 读取工作表
-                                    df = pd.read_excel(temp_path, sheet_name=sheet_name)
-                                    
-                                    # 添加来源信息列（无论是否选择add_source，都添加这些信息）
-                                    df['来源文件'] = file.filename
-                                    df['来源工作表'] = sheet_name
-                                    
-                                    # 如果是第一个数据框，保存其结构
-                                    if first_df is None:
-                                        first_df = df
-                                        all_data.append(df)
-                                    else:
-                                        # 检查列结构是否匹配（不包括来源列）
-                                        if len(df.columns) == len(first_df.columns):  # 只检查列数是否相同
-                                            # 将所有列名转换为字符串
-                                            df.columns = df.columns.astype(str)
+                                    for df in workbook_cache.iter_chunks(temp_path, sheet_name):
+                                        # 添加来源信息列（无论是否选择add_source，都添加这些信息）
+                                        df['来源文件'] = file.filename
+                                        df['来源工作表'] = sheet_name
+                                            
+                                        # 如果是第一个数据框，保存其结构
+                                        if first_columns is None:
+                                            first_columns = df.columns
+                                        elif len(df.columns) == len(first_columns):  # 只检查列数是否相同
                                             # 使用第一个数据框的列名
-                                            df.columns = first_df.columns
-                                            all_data.append(df)
+                                            df.columns = first_columns
                                         else:
                                             print(f"工作表 {sheet_name} 在文件 {file.filename} 中的列数不匹配")
-                                            print(f"预期列数: {len(first_df.columns)}")
+                                            print(f"预期列数: {len(first_columns)}")
                                             print(f"实际列数: {len(df.columns)}")
+                                            break
+                                        
+                                        # 如果不需要来源信息，则删除这些列
+                                        if not add_source:
+                                            df = df.drop(['来源文件', '来源工作表'], axis=1)
+                                        total_rows += len(df)
+                                        if total_rows > MAX_ROWS:
+                                            raise RowLimitError(ERROR_MESSAGES['too_many_rows'].format(max_rows=MAX_ROWS))
+                                        output.write_frame(df)
+                                except RowLimitError:
+                                    raise
                                 except Exception as e:
                                     print(f"处理工作表 {sheet_name} 时出错: {str(e)}")
                                     continue
-                            
-                        # 确保文件句柄已关闭
-                        gc.collect()
-                    
-                    except Exception as e:
-                        print(f"处理文件 {file.filename} 时出错: {str(e)}")
-                        continue
+                        
+                        except RowLimitError:
+                            raise
+                        except Exception as e:
+                            print(f"处理文件 {file.filename} 时出错: {str(e)}")
+                            continue
                 
-                # 合并所有数据
-                if not all_data:
+                if first_columns is None:
                     raise Exception("没有可合并的数据，可能是由于列结构不匹配")
                 
-                merged_df = pd.concat(all_data, ignore_index=True)
-                
-                # 如果不需要来源信息，则删除这些列
-                if not add_source:
-                    merged_df = merged_df.drop(['来源文件', '来源工作表'], axis=1)
-                
-                # 保存合并后的文件
-                with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                    merged_df.to_excel(writer, sheet_name='合并数据', index=False)
-                    
-                    # 调整列宽
-                    worksheet = writer.sheets['合并数据']
-                    for idx, col in enumerate(merged_df.columns):
-                        max_length = max(
-                            merged_df[col].astype(str).apply(len).max(),
-                            len(str(col))
-                        ) + 2
-                        worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
-                
-                # 清理内存
-                del merged_df
-                gc.collect()
-                
                 # 确保文件已经保存
-                time.sleep(0.5)
-                
                 if not os.path.exists(output_path):
                     raise Exception("文件保存失败")
                 
@@ -306,8 +270,8 @@ class ExcelProcessor:
             
             else:
                 # 保持在不同工作表
-                with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                    for file in files:
+                with StreamingWriter(output_path) as writer:
+                    for file_number, file in enumerate(files, 1):
                         if file.filename == '':
                             continue
                         
@@ -316,37 +280,29 @@ class ExcelProcessor:
                         temp_files.append(temp_path)
                         file.save(temp_path)
                         
+                        report_progress((file_number - 1) * 100 / len(files), f"正在合并 {file.filename}")
                         try:
-                            with pd.ExcelFile(temp_path) as excel_file:
-                                sheets_to_merge = excel_file.sheet_names if merge_all else [excel_file.sheet_names[0]]
+                            sheet_names = list_sheets(temp_path)
+                            sheets_to_merge = sheet_names if merge_all else [sheet_names[0]]
+                                
+                            for sheet_name in sheets_to_merge:
+                                new_sheet_name = f"{os.path.splitext(file.filename)[0]}_{sheet_name}"
+                                if len(new_sheet_name) > 31:
+                                    new_sheet_name = new_sheet_name[:31]
+                                output = writer.add_sheet(new_sheet_name)
                                 
-                                for sheet_name in sheets_to_merge:
-                                    df = pd.read_excel(temp_path, sheet_name=sheet_name)
-                                    
+                                for df in workbook_cache.iter_chunks(temp_path, sheet_name):
                                     # 添加来源信息（如果需要）
                                     if add_source:
                                         df['来源文件'] = file.filename
                                         df['来源工作表'] = sheet_name
-                                    
-                                    new_sheet_name = f"{os.path.splitext(file.filename)[0]}_{sheet_name}"
-                                    if len(new_sheet_name) > 31:
-                                        new_sheet_name = new_sheet_name[:31]
-                                    
-                                    df.to_excel(writer, sheet_name=new_sheet_name, index=False)
-                                    
-                                    # 调整列宽
-                                    worksheet = writer.sheets[new_sheet_name]
-                                    for idx, col in enumerate(df.columns):
-                                        max_length = max(
-                                            df[col].astype(str).apply(len).max(),
-                                            len(str(col))
-                                        ) + 2
-                                        worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
-                                    
-                                    # 清理内存
-                                    del df
-                                    gc.collect()
+                                    total_rows += len(df)
+                                    if total_rows > MAX_ROWS:
+                                        raise RowLimitError(ERROR_MESSAGES['too_many_rows'].format(max_rows=MAX_ROWS))
+                                    output.write_frame(df)
                             
+                        except RowLimitError:
+                            raise
                         except Exception as e:
                             print(f"处理文件 {file.filename} 时出错: {str(e)}")
                             continue
@@ -397,9 +353,8 @@ class ExcelProcessor:
             file_path = os.path.join(self.upload_folder, filename)
             file.save(file_path)
             
-            # 使用 with 语句读取工作表名
-            with pd.ExcelFile(file_path) as excel_file:
-                return excel_file.sheet_names
+            # 只读取工作簿目录，不加载工作表数据
+            return list_sheets(file_path)
             
         except Exception as e:
             raise Exception(f"获取工作表名失败: {str(e)}")
@@ -5,8 +5,14 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 import chardet
 import csv
+import codecs
+import uuid
 from io import StringIO
+from itertools import islice
 from flask import current_app
+from functions.writer import StreamingWriter
+from functions.jobs import report_progress
+from config import CHUNK_SIZE, MAX_ROWS, ERROR_MESSAGES
 
 class ImportProcessor:
     def __init__(self, upload_folder=None, download_folder=None):
@@ -49,63 +55,117 @@ class ImportProcessor:
             print(f"编码检测出错: {str(e)}")
             return 'utf-8'  # 默认返回 UTF-8
     
+    def resolve_encoding(self, file_path, encoding=None):
+        """按优先级找到能完整解码文件的编码（分块解码，不把整个文件读入内存）"""
+        encodings_to_try = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5']
+        if encoding:
+            encodings_to_try.insert(0, encoding)  # 如果指定了编码，优先使用
+        
+        last_error = None
+        for enc in encodings_to_try:
+            try:
+                decoder = codecs.getincrementaldecoder(enc)()
+                with open(file_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        decoder.decode(block)
+                    decoder.decode(b'', final=True)
+                print(f"成功使用编码 {enc} 读取文件")
+                return enc
+            except UnicodeDecodeError as e:
+                print(f"编码 {enc} 失败: {str(e)}")
+                last_error = e
+                continue
+        
+        raise Exception(f"无法读取文件，所有编码尝试都失败: {str(last_error)}")
+    
+    def iter_csv_rows(self, file_path, encoding=None, delimiter=None):
+        """逐行读取类CSV格式的文件，正确处理带引号的字段"""
+        return self.read_csv_rows(file_path, self.resolve_encoding(file_path, encoding), delimiter)
+    
+    def read_csv_rows(self, file_path, enc, delimiter=None):
+        """用已确定的编码逐行读取类CSV格式的文件（同一文件多次读取时只需确定一次编码）"""
+        with open(file_path, 'r', encoding=enc) as f:
+            # 使用 csv.reader 的高级配置
+            csv.register_dialect('custom',
+                delimiter=delimiter or ',',    # 默认使用逗号分隔符
+                quotechar='"',                # 使用双引号作为引用字符
+                doublequote=True,             # 处理字段中的双引号
+                skipinitialspace=True,        # 跳过分隔符后的空格
+                quoting=csv.QUOTE_MINIMAL     # 仅在必要时使用引号
+            )
+            
+            for row in csv.reader(f, dialect='custom'):
+                # 处理每个字段
+                processed_row = []
+                for value in row:
+                    # 去除首尾空白，但保留内部空格
+                    value = value.strip()
+                    
+                    # 如果字段包含引号和逗号，保留原始格式
+                    if ',' in value and value.startswith('"') and value.endswith('"'):
+                        value = value[1:-1]  # 移除外部引号但保留内容
+                    elif value.startswith('"') and value.endswith('"'):
+                        value = value[1:-1]  # 移除不必要的引号
+                        
+                    processed_row.append(value)
+                yield processed_row
+    
     def read_csv_like_file(self, file_path, encoding=None, delimiter=None):
         """读取类CSV格式的文件，正确处理带引号的字段"""
         try:
-            # 尝试不同的编码
-            encodings_to_try = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5']
-            if encoding:
-                encodings_to_try.insert(0, encoding)  # 如果指定了编码，优先使用
-            
-            last_error = None
-            for enc in encodings_to_try:
-                try:
-                    with open(file_path, 'r', encoding=enc) as f:
-                        print(f"尝试使用编码: {enc}")
-                        # 使用 csv.reader 的高级配置
-                        csv.register_dialect('custom',
-                            delimiter=delimiter or ',',    # 默认使用逗号分隔符
-                            quotechar='"',                # 使用双引号作为引用字符
-                            doublequote=True,             # 处理字段中的双引号
-                            skipinitialspace=True,        # 跳过分隔符后的空格
-                            quoting=csv.QUOTE_MINIMAL     # 仅在必要时使用引号
-                        )
-                        
-                        reader = csv.reader(f, dialect='custom')
-                        data = []
-                        
-                        for row in reader:
-                            # 处理每个字段
-                            processed_row = []
-                            for value in row:
-                                # 去除首尾空白，但保留内部空格
-                                value = value.strip()
-                                
-                                # 如果字段包含引号和逗号，保留原始格式
-                                if ',' in value and value.startswith('"') and value.endswith('"'):
-                                    value = value[1:-1]  # 移除外部引号但保留内容
-                                elif value.startswith('"') and value.endswith('"'):
-                                    value = value[1:-1]  # 移除不必要的引号
-                                    
-                                processed_row.append(value)
-                            data.append(processed_row)
-                        
-                        print(f"成功使用编码 {enc} 读取文件")
-                        return data, True  # True 表示有表头
-                        
-                except UnicodeDecodeError as e:
-                    print(f"编码 {enc} 失败: {str(e)}")
-                    last_error = e
-                    continue
-                
-            # 如果所有编码都失败了
-            if last_error:
-                raise Exception(f"无法读取文件，所有编码尝试都失败: {str(last_error)}")
-                
+            data = list(self.iter_csv_rows(file_path, encoding, delimiter))
+            return data, True  # True 表示有表头
         except Exception as e:
             print(f"读取文件出错: {str(e)}")
             raise
     
+    def split_header(self, rows, header_row=1, start_row=1):
+        """把逐行读取的结果分为 (表头, 数据行迭代器)，表头和跳过行的处理与整表读取一致"""
+        columns = None
+        if header_row > 0:
+            head = list(islice(rows, header_row))
+            if len(head) >= header_row:
+                columns = head[header_row - 1]
+            else:
+                rows = iter(head)  # 行数不足时没有表头，全部作为数据
+        
+        # 跳过指定行数
+        if start_row > 1:
+            rows = islice(rows, start_row - 1, None)
+        return columns, rows
+
+    def file_columns(self, file_path, enc, delimiter=None, header_row=1):
+        """
+        扫描一遍文件确定列名：列数取所有行的最大列数（与整表读取一致），
+        比表头多出的列生成 Unnamed: n 列名；没有表头时列名为列位置
+        """
+        header = None
+        width = 0
+        for line, row in enumerate(self.read_csv_rows(file_path, enc, delimiter), 1):
+            if line == header_row:
+                header = row
+            width = max(width, len(row))
+        if header is None:
+            return list(range(width))
+        return list(header) + [f"Unnamed: {i}" for i in range(len(header), width)]
+
+    def iter_data_chunks(self, file_path, enc, delimiter=None, start_row=1, header_row=1,
+                         columns=None, chunk_size=CHUNK_SIZE):
+        """
+        按 chunk_size 行分块读取文件，表头和跳过行的处理与整表读取一致
+        :param enc: 已确定的编码（resolve_encoding 的结果）
+        :param columns: file_columns 的结果，未提供时扫描文件得到；较短的行补空值
+        """
+        if columns is None:
+            columns = self.file_columns(file_path, enc, delimiter, header_row)
+        _, rows = self.split_header(self.read_csv_rows(file_path, enc, delimiter), header_row, start_row)
+        
+        while True:
+            block = list(islice(rows, chunk_size))
+            if not block:
+                break
+            yield pd.DataFrame(block, columns=columns)
+    
     def preview_data(self, file, source_type, delimiter=None, 
                     start_row=1, header_row=1, auto_split=True):
         """预览数据"""
@@ -180,47 +240,30 @@ class ImportProcessor:
     def import_data(self, files, source_type, column_settings=None, encoding=None, 
                    delimiter=None, sheet=None, start_row=1, header_row=1, auto_split=True):
         """导入数据"""
+        saved_paths = []
         try:
-            all_data = []
-            
+            # 每个上传文件保存为唯一的临时文件名（secure_filename 会去掉中文，不同文件可能得到相同的文件名）
             for file in files:
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(self.upload_folder, filename)
+                ext = os.path.splitext(file.filename)[1].lower()
+                file_path = os.path.join(self.upload_folder, f"import_{uuid.uuid4().hex}{ext}")
                 file.save(file_path)
-                
-                try:
-                    # 检测编码
-                    if not encoding:
-                        encoding = self.detect_encoding(file_path)
-                    
-                    # 读取文件内容
-                    data, has_header = self.read_csv_like_file(file_path, encoding, delimiter)
-                    
-                    # 创建DataFrame
-                    df = pd.DataFrame(data)
-                    
-                    # 处理表头
-                    if header_row > 0 and len(df) >= header_row:
-                        df.columns = df.iloc[header_row-1]
-                        df = df.iloc[header_row:]
-                    
-                    # 跳过指定行数
-                    if start_row > 1:
-                        df = df.iloc[start_row-1:]
-                    
-                    # 重置索引
-                    df = df.reset_index(drop=True)
-                    
-                    # 添加到总数据中
-                    all_data.append(df)
-                
-                finally:
-                    # 清理临时文件
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                saved_paths.append(file_path)
+            
+            # 检测编码
+            if not encoding:
+                encoding = self.detect_encoding(saved_paths[0])
             
-            # 合并所有数据
-            final_df = pd.concat(all_data, ignore_index=True)
+            # 每个文件只确定一次编码，再扫描一遍确定列名；
+            # 输出列与 pd.concat 一样按出现顺序合并各文件的列
+            layouts = []
+            columns = None
+            for file_path in saved_paths:
+                enc = self.resolve_encoding(file_path, encoding)
+                file_columns = self.file_columns(file_path, enc, delimiter, header_row)
+                layouts.append((file_path, enc, file_columns))
+                file_columns = pd.Index(file_columns)
+                columns = file_columns if columns is None else columns.append(
+                    file_columns[~file_columns.isin(columns)])
             
             # 保存为Excel文件
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -230,17 +273,20 @@ class ImportProcessor:
             # 确保下载目录存在
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
-            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                final_df.to_excel(writer, index=False)
-                
-                # 调整列宽
-                worksheet = writer.sheets['Sheet1']
-                for idx, col in enumerate(final_df.columns):
-                    max_length = max(
-                        final_df[col].astype(str).apply(len).max(),
-                        len(str(col))
-                    ) + 2
-                    worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
+            # 逐块读取、转换并写出，超过 MAX_ROWS 时立即停止
+            total_rows = 0
+            with StreamingWriter(output_path) as writer:
+                output = writer.add_sheet('Sheet1')
+                for file_path, enc, file_columns in layouts:
+                    for df in self.iter_data_chunks(file_path, enc, delimiter, start_row, header_row, file_columns):
+                        total_rows += len(df)
+                        if total_rows > MAX_ROWS:
+                            raise ValueError(ERROR_MESSAGES['too_many_rows'].format(max_rows=MAX_ROWS))
+                        
+                        if columns is not None and not df.columns.equals(columns):
+                            df = df.reindex(columns=columns)
+                        output.write_frame(df)
+                        report_progress(message=f"已导入 {total_rows} 行")
             
             return {
                 'success': True,
@@ -253,4 +299,10 @@ class ImportProcessor:
             return {
                 'success': False,
                 'error': str(e)
-            }
\ No newline at end of file
+            }
+        
+        finally:
+            # 清理临时文件
+            for file_path in saved_paths:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_EXPIRY
+
+_local = threading.local()
+
+
+def report_progress(progress: Optional[float] = None, message: Optional[str] = None):
+    """
+    在处理过程中报告进度（0-100）和状态说明
+    不在后台任务中运行时（同步请求）直接忽略
+    """
+    job = getattr(_local, 'job', None)
+    if job is None:
+        return
+    if progress is not None:
+        job.progress = max(0, min(100, int(progress)))
+    if message is not None:
+        job.message = message
+
+
+class Job:
+    """后台任务的状态"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'  # queued / running / finished / failed
+        self.progress = 0
+        self.message = '等待处理'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'finishedAt': self.finished_at
+        }
+
+
+class JobManager:
+    """
+    后台任务管理
+    耗时的处理在固定大小的线程池中执行，请求线程只负责提交并立即返回任务 ID，
+    前端通过任务 ID 轮询状态并获取结果
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, expiry: int):
+        self.max_pending = max_pending
+        self.expiry = expiry
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, kind: str, func: Callable[[], dict]) -> str:
+        """
+        提交任务，func 的返回值作为任务结果
+        排队和执行中的任务数达到上限时拒绝提交
+        """
+        self.purge_expired()
+
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.status in ('queued', 'running'))
+            if active >= self.max_pending:
+                raise RuntimeError('当前处理任务较多，请稍后再试')
+            job = Job(kind)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, func)
+        return job.id
+
+    def _run(self, job: Job, func: Callable[[], dict]):
+        _local.job = job
+        job.status = 'running'
+        job.message = '正在处理'
+        try:
+            job.result = func()
+            job.status = 'finished'
+            job.progress = 100
+            job.message = '处理完成'
+        except Exception as e:
+            print(f"任务 {job.id} 执行失败: {str(e)}")
+            job.status = 'failed'
+            job.error = str(e)
+            job.message = '处理失败'
+        finally:
+            job.finished_at = time.time()
+            _local.job = None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """获取任务，不存在或已过期时返回 None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def purge_expired(self):
+        """清理完成时间超过有效期的任务记录"""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > self.expiry]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+# 全局共享的任务管理器
+job_manager = JobManager(JOB_WORKERS, JOB_QUEUE_SIZE, JOB_EXPIRY)
@@ -0,0 +1,337 @@
+import pandas as pd
+import numpy as np
+from typing import List, Optional, Tuple
+
+from functions.match_keys import (
+    combine_keys, hash_keys, has_hash_collisions, hash_collisions, fuzzy_key, bigrams
+)
+from config import FUZZY_MATCH_THRESHOLD, VLOOKUP_JOIN_SEPARATOR
+
+UNIQUE_POLICIES = ('first', 'last', 'error')      # 每个键只保留一行
+GROUP_POLICIES = ('all', 'count', 'sum', 'join')  # 一对多：全部展开、匹配数、求和、连接
+DUPLICATE_POLICIES = UNIQUE_POLICIES + GROUP_POLICIES
+MATCH_MODES = ('exact', 'range', 'fuzzy')
+
+FUZZY_MAX_POSTINGS = 500   # 包含同一个二元组的键超过此数量时，该二元组区分度太低，不用于筛选候选键
+
+
+def _deduplicate(keys: pd.Series, duplicate_policy: str) -> np.ndarray:
+    """按 duplicate_policy 处理重复键，返回保留的行；error 时有重复键直接报错"""
+    if duplicate_policy not in UNIQUE_POLICIES:
+        raise ValueError(f"不支持的重复值处理方式：{duplicate_policy}")
+
+    if duplicate_policy == 'error':
+        duplicated = keys[keys.duplicated()].unique()
+        if len(duplicated):
+            example_str = '、'.join(str(v) for v in duplicated[:5])
+            if len(duplicated) > 5:
+                example_str += ' 等'
+            raise ValueError(f"查找表中存在重复的匹配值：{example_str}")
+        return np.ones(len(keys), dtype=bool)
+    return ~keys.duplicated(keep=duplicate_policy).to_numpy()
+
+
+class LookupIndex:
+    """
+    查找表索引
+    键去重后建立一次哈希索引，主表每一块只需一次 get_indexer 得到命中位置，
+    再按位置一次取出所有返回列
+
+    只有返回值全部非空的行参与匹配；同一个键出现多次时按 duplicate_policy 处理：
+    first 保留第一条，last 保留最后一条，error 直接报错
+    """
+
+    def __init__(self, keys: pd.Series, values: pd.DataFrame, duplicate_policy: str = 'last'):
+        valid = values.notna().all(axis=1).to_numpy()
+        keys = pd.Series(keys.to_numpy()[valid])
+        values = values[valid]
+        keep = _deduplicate(keys, duplicate_policy)
+
+        self.index = pd.Index(keys.to_numpy()[keep])
+        self.columns = [values.iloc[:, pos].to_numpy()[keep] for pos in range(len(values.columns))]
+        self.hashed = False
+        self.key_parts = None  # 哈希键模式下：哈希 -> 各列标准化值，用于核对命中的行
+
+    @classmethod
+    def from_parts(cls, parts: pd.DataFrame, values: pd.DataFrame, duplicate_policy: str = 'last',
+                   hashed: bool = False) -> 'LookupIndex':
+        """
+        根据各匹配列标准化后的值建立索引
+        :param parts: 每列一个匹配列（已标准化）
+        :param hashed: 多列匹配时用 64 位哈希作为组合键；查找表内出现哈希冲突时改用字符串组合键
+        """
+        keys = None
+        if hashed and len(parts.columns) > 1:
+            keys = hash_keys(parts)
+            if has_hash_collisions(parts, keys):
+                print("查找表组合键出现哈希冲突，改用字符串组合键")
+                keys = None
+
+        if keys is None:
+            return cls(combine_keys([parts.iloc[:, pos] for pos in range(len(parts.columns))]),
+                       values, duplicate_policy)
+
+        index = cls(keys, values, duplicate_policy)
+        first = ~keys.duplicated().to_numpy()
+        index.hashed = True
+        index.key_parts = parts[first].set_axis(pd.Index(keys[first]), axis=0)
+        return index
+
+    def make_keys(self, parts: pd.DataFrame) -> pd.Series:
+        """按索引的键模式由主表各匹配列生成键"""
+        if self.hashed:
+            return hash_keys(parts)
+        return combine_keys([parts.iloc[:, pos] for pos in range(len(parts.columns))])
+
+    def probe(self, parts: pd.DataFrame, keys: Optional[pd.Series] = None) -> np.ndarray:
+        """
+        查找主表各行在索引中的位置，未匹配为 -1
+        哈希键模式下，哈希相同但实际键不同的行视为未匹配
+        """
+        keys = self.make_keys(parts) if keys is None else keys
+        positions = self.get_positions(keys)
+        if self.hashed:
+            positions[hash_collisions(parts, keys, self.key_parts)] = -1
+        return positions
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_positions(self, keys: pd.Series) -> np.ndarray:
+        """返回每个键在索引中的位置，未匹配为 -1"""
+        return self.index.get_indexer(keys)
+
+    def take(self, positions: np.ndarray, index=None) -> List[pd.Series]:
+        """按位置取出所有返回列，未匹配（-1）的位置为空值"""
+        missing = positions < 0
+        results = []
+        for column in self.columns:
+            if len(column):
+                result = pd.Series(column[positions], index=index)
+            else:
+                result = pd.Series(np.full(len(positions), np.nan, dtype=object), index=index)
+            if missing.any():
+                result = result.mask(missing)
+            results.append(result)
+        return results
+
+
+class RangeLookupIndex(LookupIndex):
+    """
+    区间查找索引（Excel VLOOKUP 近似匹配）：返回不大于查找值的最大键所在的行
+    数值键排序一次，主表每一块用 searchsorted 一次完成二分查找；
+    不是数字的键（如表头行）仍按精确匹配。只支持单列匹配
+    """
+
+    def __init__(self, keys: pd.Series, values: pd.DataFrame, duplicate_policy: str = 'last'):
+        valid = values.notna().all(axis=1).to_numpy() & (keys.to_numpy() != '')
+        keys = pd.Series(keys.to_numpy()[valid])
+        values = values[valid]
+        keep = _deduplicate(keys, duplicate_policy)
+
+        # 标准化后的数字文本可以直接转为数值；数值相同的键标准化结果也相同，去重不受影响
+        numbers = pd.to_numeric(keys, errors='coerce').to_numpy(dtype=np.float64)
+        numeric = ~np.isnan(numbers)
+        numeric_rows = np.flatnonzero(numeric & keep)
+        numeric_rows = numeric_rows[np.argsort(numbers[numeric_rows], kind='stable')]
+        text_rows = np.flatnonzero(~numeric & keep)
+        rows = np.concatenate([numeric_rows, text_rows])
+
+        self.bounds = numbers[numeric_rows]
+        self.index = pd.Index(keys.to_numpy()[text_rows])
+        self.columns = [values.iloc[:, pos].to_numpy()[rows] for pos in range(len(values.columns))]
+        self.hashed = False
+        self.key_parts = None
+
+    def make_keys(self, parts: pd.DataFrame) -> pd.Series:
+        return parts.iloc[:, 0]
+
+    def probe(self, parts: pd.DataFrame, keys: Optional[pd.Series] = None) -> np.ndarray:
+        """数值按区间查找，小于最小键时未匹配；其他值按精确匹配"""
+        keys = self.make_keys(parts) if keys is None else keys
+        numbers = pd.to_numeric(keys, errors='coerce').to_numpy(dtype=np.float64)
+        numeric = ~np.isnan(numbers)
+
+        positions = np.full(len(keys), -1, dtype=np.intp)
+        positions[numeric] = np.searchsorted(self.bounds, numbers[numeric], side='right') - 1
+        if len(self.index) and not numeric.all():
+            text_positions = self.index.get_indexer(keys[~numeric])
+            positions[~numeric] = np.where(text_positions >= 0, text_positions + len(self.bounds), -1)
+        return positions
+
+    def __len__(self) -> int:
+        return len(self.bounds) + len(self.index)
+
+
+class FuzzyLookupIndex(LookupIndex):
+    """
+    模糊查找索引：先按标准化后的键精确匹配，未匹配的值再找二元组相似度最高的键
+    键的二元组建立倒排索引，每个查找值只与共享二元组最多的少量候选键比较，不必遍历整个查找表；
+    比较时忽略全角/半角、大小写、空白和标点。相似度低于 threshold 的视为未匹配。只支持单列匹配
+    """
+
+    def __init__(self, keys: pd.Series, values: pd.DataFrame, duplicate_policy: str = 'last',
+                 threshold: float = FUZZY_MATCH_THRESHOLD):
+        super().__init__(keys, values, duplicate_policy)
+        self.threshold = threshold
+        self.gram_sets = [bigrams(fuzzy_key(key)) for key in self.index]
+        self.gram_sizes = np.fromiter(map(len, self.gram_sets), dtype=np.float64, count=len(self.gram_sets))
+
+        postings = {}
+        for pos, grams in enumerate(self.gram_sets):
+            for gram in grams:
+                postings.setdefault(gram, []).append(pos)
+        self.postings = {gram: np.array(rows, dtype=np.intp) for gram, rows in postings.items()}
+
+    def make_keys(self, parts: pd.DataFrame) -> pd.Series:
+        return parts.iloc[:, 0]
+
+    def probe(self, parts: pd.DataFrame, keys: Optional[pd.Series] = None) -> np.ndarray:
+        return self.match(parts, keys)[0]
+
+    def match(self, parts: pd.DataFrame,
+              keys: Optional[pd.Series] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        返回 (位置, 相似度, 是否由模糊查找匹配)：精确匹配的相似度为 1，未匹配的位置为 -1、相似度为 NaN；
+        标准化后相同但原值不同的键由模糊查找匹配，相似度也可能为 1
+        相同的查找值只计算一次
+        """
+        keys = self.make_keys(parts) if keys is None else keys
+        positions = self.get_positions(keys)
+        scores = np.where(positions >= 0, 1.0, np.nan)
+        fuzzy = np.zeros(len(positions), dtype=bool)
+
+        missing = positions < 0
+        if missing.any() and self.postings:
+            missing_keys = keys.to_numpy()[missing]
+            best = {value: self._best_match(value) for value in pd.unique(missing_keys)}
+            positions[missing] = [best[value][0] for value in missing_keys]
+            scores[missing] = [best[value][1] for value in missing_keys]
+            fuzzy[missing] = positions[missing] >= 0
+        return positions, scores, fuzzy
+
+    def _best_match(self, value: str) -> Tuple[int, float]:
+        """在候选键中找相似度最高的键，返回 (位置, 相似度)，低于阈值时返回 (-1, NaN)"""
+        grams = bigrams(fuzzy_key(value))
+        lists = sorted((self.postings[gram] for gram in grams if gram in self.postings), key=len)
+        if not lists:
+            return -1, np.nan
+
+        # 相似度达到阈值的键至少共享 min_shared 个二元组，因此一定出现在最少见的
+        # len(lists) - min_shared + 1 个倒排列表之一中（前缀过滤）；区分度高的二元组也都用于筛选
+        min_shared = int(np.ceil(self.threshold * len(grams) / (2 - self.threshold) - 1e-9))
+        if min_shared > len(lists):
+            return -1, np.nan
+        rare = sum(1 for rows in lists if len(rows) <= FUZZY_MAX_POSTINGS)
+        selected = max(rare, len(lists) - max(min_shared, 1) + 1)
+        candidates, counts = np.unique(np.concatenate(lists[:selected]), return_counts=True)
+
+        if selected < len(lists):
+            # 其余列表都算上也达不到 min_shared 的候选键直接排除，
+            # 再补上其余（常见）二元组的计数（倒排列表有序，二分查找即可）
+            keep = counts + (len(lists) - selected) >= min_shared
+            candidates, counts = candidates[keep], counts[keep]
+            for rows in lists[selected:]:
+                found = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+                counts = counts + (rows[found] == candidates)
+            if not len(candidates):
+                return -1, np.nan
+
+        # 计数就是共享的二元组数，直接算出所有候选键的 Dice 相似度
+        scores = 2 * counts / (len(grams) + self.gram_sizes[candidates])
+        best = int(np.argmax(scores))
+        best_pos, best_score = int(candidates[best]), float(scores[best])
+
+        if best_score < self.threshold:
+            return -1, np.nan
+        return best_pos, best_score
+
+
+class GroupedLookupIndex(LookupIndex):
+    """
+    一对多查找索引（分组哈希连接）：键 factorize 一次得到分组编号，所有行按分组编号稳定排序，
+    之后的计数、求和、连接都按分组整体计算，不逐个键循环；主表每一块仍只需一次 get_indexer
+
+    与 first / last 不同，返回值为空的行也参与匹配：
+    all 返回所有匹配行（主表行按匹配数展开，未匹配的行保留一行空值），
+    count 返回匹配行数（未匹配为 0），sum 对各返回列按数值求和（忽略非数字），
+    join 把各返回列的非空值按原顺序用 separator 连接
+    """
+
+    def __init__(self, keys: pd.Series, values: pd.DataFrame, duplicate_policy: str = 'all',
+                 separator: str = VLOOKUP_JOIN_SEPARATOR):
+        if duplicate_policy not in GROUP_POLICIES:
+            raise ValueError(f"不支持的重复值处理方式：{duplicate_policy}")
+
+        codes, uniques = pd.factorize(keys.to_numpy())
+        self.policy = duplicate_policy
+        self.index = pd.Index(uniques)
+        self.hashed = False
+        self.key_parts = None
+
+        counts = np.bincount(codes, minlength=len(uniques))
+        order = np.argsort(codes, kind='stable')
+        self.counts = counts
+        self.starts = np.cumsum(counts) - counts
+
+        if duplicate_policy == 'all':
+            # 每个分组的行在 columns 中连续存放，从 starts 开始共 counts 行
+            self.columns = [values.iloc[:, pos].to_numpy()[order] for pos in range(len(values.columns))]
+        elif duplicate_policy == 'count':
+            self.columns = [counts]
+        elif duplicate_policy == 'sum':
+            numbers = values.apply(pd.to_numeric, errors='coerce')
+            sums = numbers.groupby(codes).sum(min_count=1)
+            self.columns = [sums.iloc[:, pos].to_numpy() for pos in range(len(sums.columns))]
+        else:
+            self.columns = [self._join(values.iloc[:, pos].to_numpy()[order], codes[order], len(uniques), separator)
+                            for pos in range(len(values.columns))]
+
+    @staticmethod
+    def _join(column: np.ndarray, codes: np.ndarray, groups: int, separator: str) -> np.ndarray:
+        """按分组（codes 已排序）连接非空值；分组内没有非空值时为空值"""
+        result = np.full(groups, np.nan, dtype=object)
+        present = pd.notna(column)
+        if not present.any():
+            return result
+        text = pd.Series(column[present], dtype=object).astype(str).to_numpy(dtype=object)
+        codes = codes[present]
+        # 每个值前面加分隔符后按分组一次 reduceat 拼接，再去掉开头的分隔符
+        boundaries = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        joined = np.add.reduceat(separator + text, boundaries) if separator else np.add.reduceat(text, boundaries)
+        result[codes[boundaries]] = [value[len(separator):] for value in joined] if separator else joined
+        return result
+
+    def take(self, positions: np.ndarray, index=None) -> List[pd.Series]:
+        """count 模式下未匹配的位置为 0，其他模式与 LookupIndex 相同"""
+        results = super().take(positions, index=index)
+        if self.policy == 'count':
+            results = [result.fillna(0).astype(np.int64) for result in results]
+        return results
+
+    def expand(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        all 模式下展开主表行，返回 (主表行号, 返回值所在行)
+        每个主表行按匹配行数重复，未匹配的行保留一行，返回值所在行为 -1
+        """
+        matched = positions >= 0
+        repeats = np.ones(len(positions), dtype=np.intp)
+        starts = np.full(len(positions), -1, dtype=np.intp)
+        repeats[matched] = self.counts[positions[matched]]
+        starts[matched] = self.starts[positions[matched]]
+
+        rows = np.repeat(np.arange(len(positions)), repeats)
+        # 展开后每一行在所属主表行中的序号
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        starts = starts[rows]
+        return rows, np.where(starts >= 0, starts + within, -1)
+
+
+def index_class(match_mode: str, duplicate_policy: str = 'last') -> type:
+    """匹配方式和重复值处理方式对应的索引类型；一对多处理方式只支持精确匹配"""
+    if duplicate_policy in GROUP_POLICIES:
+        if match_mode != 'exact':
+            raise ValueError("全部匹配、匹配数、求和、连接只支持精确匹配")
+        return GroupedLookupIndex
+    return {'exact': LookupIndex, 'range': RangeLookupIndex, 'fuzzy': FuzzyLookupIndex}[match_mode]
+
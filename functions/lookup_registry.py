@@ -0,0 +1,197 @@
+import pandas as pd
+import os
+import hashlib
+import json
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from functions.workbook_cache import workbook_cache
+from functions.columnar_store import columnar_store, write_frame, read_frame, pa
+from functions.reader import column_index
+from functions.match_keys import normalize_keys
+from functions.lookup_index import LookupIndex, index_class
+from config import LOOKUP_REGISTRY_FOLDER
+
+MAX_NAME_LENGTH = 50
+
+
+class LookupRegistry:
+    """
+    常用查找表
+    查找表注册时解析一次，把标准化后的匹配列和返回列写成 Arrow 文件（可内存映射）；
+    之后的 VLOOKUP 按名称引用，不再解析 Excel、不再标准化查找表。
+    加载后的索引按 (名称, 内容哈希, 重复值处理方式, 键模式, 匹配方式) 缓存在内存中，
+    用不同内容的文件重新注册同名查找表时，旧索引随之失效
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.enabled = pa is not None
+
+        self._lock = threading.Lock()
+        self._entries = {}  # 名称 -> 注册信息
+        self._indexes = {}  # (名称, 内容哈希, 重复值处理方式, 键模式, 匹配方式) -> LookupIndex
+
+        if self.enabled:
+            os.makedirs(self.folder, exist_ok=True)
+            self._load_entries()
+
+    def _file_stem(self, name: str) -> str:
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+    def _load_entries(self):
+        """启动时读取已注册的查找表信息"""
+        for filename in os.listdir(self.folder):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.folder, filename), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if os.path.exists(os.path.join(self.folder, entry['indexFile'])):
+                    self._entries[entry['name']] = entry
+            except Exception as e:
+                print(f"读取查找表注册信息失败 {filename}: {str(e)}")
+
+    def list_tables(self) -> List[dict]:
+        """已注册的查找表，按名称排序"""
+        with self._lock:
+            return [dict(self._entries[name]) for name in sorted(self._entries)]
+
+    def get(self, name: str) -> dict:
+        """获取注册信息，不存在时报错"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            raise ValueError(f"常用查找表不存在：{name}")
+        return dict(entry)
+
+    def register(self, name: str, file_path: str, sheet_name: str, match_columns: List[str],
+                 return_columns: List[str], source_name: Optional[str] = None) -> Tuple[dict, bool]:
+        """
+        注册查找表，返回 (注册信息, 是否重建了索引)
+        同名查找表的源文件内容和列配置都没有变化时直接复用已有索引
+        """
+        if not self.enabled:
+            raise ValueError("常用查找表需要安装 pyarrow")
+
+        name = (name or '').strip()
+        if not name:
+            raise ValueError("请输入查找表名称")
+        if len(name) > MAX_NAME_LENGTH:
+            raise ValueError(f"查找表名称不能超过 {MAX_NAME_LENGTH} 个字符")
+        if not match_columns or not return_columns:
+            raise ValueError("请选择匹配列和返回列")
+
+        source_hash = columnar_store.file_hash(file_path)
+        spec = {
+            'sheet': sheet_name,
+            'matchColumns': list(match_columns),
+            'returnColumns': list(return_columns)
+        }
+
+        with self._lock:
+            existing = self._entries.get(name)
+        if existing and existing['sourceHash'] == source_hash and \
+                all(existing[key] == value for key, value in spec.items()):
+            return dict(existing), False
+
+        # 与 VLOOKUP 读取查找表的方式一致：不使用第一行作为列名
+        match_indices = [column_index(col) for col in match_columns]
+        return_indices = [column_index(col) for col in return_columns]
+        df = workbook_cache.read_sheet(file_path, sheet_name, header=None,
+                                       usecols=match_indices + return_indices)
+        width = df.attrs.get('sheet_width', len(df.columns))
+        for col, idx in zip(match_columns + return_columns, match_indices + return_indices):
+            if idx >= width:
+                raise ValueError(f"查找表中的列标识 {col} 超出范围（表格只有 {width} 列）")
+
+        # 保留返回值不完整的行：first / last 建索引时会去掉，count / sum 等一对多方式仍要用到
+        values = df[return_indices]
+        frame = pd.DataFrame(index=pd.RangeIndex(len(df)))
+        for pos, idx in enumerate(match_indices):
+            frame[f"key_{pos}"] = normalize_keys(df[idx]).to_numpy()
+        for pos in range(len(return_indices)):
+            frame[f"value_{pos}"] = values.iloc[:, pos].to_numpy()
+
+        stem = self._file_stem(name)
+        index_file = f"{stem}_{source_hash[:12]}.arrow"
+        write_frame(os.path.join(self.folder, index_file), frame)
+
+        first_row = df.iloc[0] if len(df) else None
+        entry = {
+            'name': name,
+            'sourceName': source_name or os.path.basename(file_path),
+            'sourceHash': source_hash,
+            **spec,
+            'returnHeaders': [
+                '' if first_row is None or pd.isna(first_row[idx]) else str(first_row[idx])
+                for idx in return_indices
+            ],
+            'rows': len(frame),
+            'indexFile': index_file,
+            'createdAt': time.time()
+        }
+        with open(os.path.join(self.folder, f"{stem}.json"), 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+        with self._lock:
+            old = self._entries.get(name)
+            self._entries[name] = entry
+            self._drop_indexes(name)
+        if old and old['indexFile'] != index_file:
+            self._remove_file(old['indexFile'])
+
+        return dict(entry), True
+
+    def unregister(self, name: str):
+        """删除已注册的查找表"""
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            self._drop_indexes(name)
+        if entry is None:
+            raise ValueError(f"常用查找表不存在：{name}")
+        self._remove_file(entry['indexFile'])
+        self._remove_file(f"{self._file_stem(name)}.json")
+
+    def get_index(self, name: str, duplicate_policy: str, hashed: bool,
+                  match_mode: str = 'exact') -> Tuple[dict, LookupIndex]:
+        """
+        获取查找表索引
+        第一次使用时内存映射读取 Arrow 文件并建立索引，之后直接使用内存中的索引
+        :param duplicate_policy: first / last / error，或一对多的 all / count / sum / join
+        :param match_mode: exact 精确匹配，range 区间匹配（近似匹配），fuzzy 模糊匹配
+        """
+        cls = index_class(match_mode, duplicate_policy)  # 组合不支持时在读取 Arrow 文件之前报错
+        entry = self.get(name)
+        hashed = hashed and len(entry['matchColumns']) > 1
+        key = (name, entry['sourceHash'], duplicate_policy, hashed, match_mode)
+        with self._lock:
+            index = self._indexes.get(key)
+        if index is not None:
+            return entry, index
+
+        frame = read_frame(os.path.join(self.folder, entry['indexFile']))
+        key_count = len(entry['matchColumns'])
+        index = cls.from_parts(frame.iloc[:, :key_count], frame.iloc[:, key_count:], duplicate_policy, hashed=hashed)
+        with self._lock:
+            if self._entries.get(name, {}).get('sourceHash') == entry['sourceHash']:
+                self._indexes[key] = index
+        return entry, index
+
+    def _drop_indexes(self, name: str):
+        """清除查找表在内存中的索引（调用方持有锁）"""
+        for key in [k for k in self._indexes if k[0] == name]:
+            del self._indexes[key]
+
+    def _remove_file(self, filename: str):
+        try:
+            path = os.path.join(self.folder, filename)
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"删除查找表文件失败: {str(e)}")
+
+
+# 全局共享的常用查找表
+lookup_registry = LookupRegistry(LOOKUP_REGISTRY_FOLDER)
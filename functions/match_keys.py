@@ -0,0 +1,160 @@
+import pandas as pd
+import numpy as np
+import re
+import unicodedata
+from typing import FrozenSet, List
+
+# 可能被 float() 解析的文本（包含下划线分隔、全角数字、inf、nan 等写法），实际能否解析以 float() 为准
+_NUMBER_RE = re.compile(r'[+-]?(?:(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:e[+-]?\d[\d_]*)?|inf(?:inity)?|nan)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+# 模糊匹配时忽略的字符：空白和标点符号
+_FUZZY_IGNORED_RE = re.compile(r'[\W_]+')
+# 转为字符串再解析后数值不变的类型（bool 和 float32 除外）
+_NUMBER_TYPES = {int, float, np.int8, np.int16, np.int32, np.int64,
+                 np.uint8, np.uint16, np.uint32, np.uint64, np.float64}
+
+
+def standardize_value(value) -> str:
+    """标准化单个数据值（normalize_keys 的逐个单元格版本，结果以此为准）"""
+    if pd.isna(value):
+        return ''
+    
+    # 转换为字符串
+    value = str(value).strip()
+    
+    try:
+        # 尝试转换为数字并格式化
+        num = float(value)
+        if num.is_integer():
+            return str(int(num))  # 整数去掉小数点
+        return str(num)  # 保留小数
+    except ValueError:
+        # 不是数字，进行文本处理
+        value = value.strip()  # 去除首尾空格
+        value = ' '.join(value.split())  # 合并多个空格
+        return value
+
+
+def _mask(func, values) -> np.ndarray:
+    """对每个值调用 func，返回布尔数组"""
+    return np.fromiter(map(func, values), dtype=bool, count=len(values))
+
+
+def _object_array(values: list) -> np.ndarray:
+    """列表转为一维 object 数组（不让 numpy 把元素当作序列展开）"""
+    result = np.empty(len(values), dtype=object)
+    result[:] = values
+    return result
+
+
+def _format_numbers(numbers: np.ndarray) -> np.ndarray:
+    """按 standardize_value 的规则格式化浮点数：整数去掉小数点，其他保留 repr 形式"""
+    result = np.empty(len(numbers), dtype=object)
+    integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+    small = integral & (np.abs(numbers) < 2.0 ** 63)
+    result[small] = list(map(str, numbers[small].astype(np.int64).tolist()))
+    result[~integral] = numbers[~integral].astype(str)
+    # 超出 int64 范围的整数很少见，逐个转换
+    for pos in np.flatnonzero(integral & ~small):
+        result[pos] = str(int(numbers[pos]))
+    return result
+
+
+def _normalize_text(text: np.ndarray) -> np.ndarray:
+    """标准化已去除首尾空白的文本：能解析为数字的按数字格式化，其他合并连续空白"""
+    result = np.empty(len(text), dtype=object)
+    
+    # 纯数字文本最常见，先单独处理（numpy 转换浮点数时与 float() 规则相同）
+    digits = _mask(str.isdecimal, text)
+    if digits.any():
+        result[digits] = _format_numbers(text[digits].astype(np.float64))
+    
+    other = ~digits
+    candidates = np.zeros(len(text), dtype=bool)
+    candidates[other] = _mask(_NUMBER_RE.fullmatch, text[other])
+    if candidates.any():
+        try:
+            result[candidates] = _format_numbers(text[candidates].astype(np.float64))
+        except ValueError:
+            # 有 float() 无法解析的值时逐个处理
+            result[candidates] = [standardize_value(value) for value in text[candidates]]
+    
+    other &= ~candidates
+    result[other] = [_WHITESPACE_RE.sub(' ', value) for value in text[other]]
+    return result
+
+
+def normalize_keys(series: pd.Series) -> pd.Series:
+    """
+    标准化匹配列，结果与逐个单元格调用 standardize_value 完全一致
+    数值直接按数值格式化，文本按类别批量处理；
+    只有形似数字但 float() 无法解析的文本（如 1__0）才逐个处理
+    """
+    result = np.full(len(series), '', dtype=object)
+    
+    if series.dtype == np.float64 or (isinstance(series.dtype, np.dtype) and series.dtype.kind in 'iu'):
+        numbers = series.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(numbers)
+        result[valid] = _format_numbers(numbers[valid])
+        return pd.Series(result, index=series.index, dtype=object)
+    
+    values = series.to_numpy(dtype=object)
+    valid = series.notna().to_numpy()
+    
+    # 混合类型列（如表头行 + 数值）中的数值单元格不必先转成字符串
+    numeric = valid & _mask(_NUMBER_TYPES.__contains__, list(map(type, values)))
+    if numeric.any():
+        try:
+            result[numeric] = _format_numbers(values[numeric].astype(np.float64))
+        except OverflowError:
+            numeric[:] = False
+    
+    rest = valid & ~numeric
+    if rest.any():
+        text = _object_array([str(value).strip() for value in values[rest]])
+        result[rest] = _normalize_text(text)
+    return pd.Series(result, index=series.index, dtype=object)
+
+
+def combine_keys(keys: List[pd.Series]) -> pd.Series:
+    """把多列标准化后的值用 | 连接成组合键"""
+    return keys[0].str.cat(keys[1:], sep='|') if len(keys) > 1 else keys[0]
+
+
+def hash_keys(parts: pd.DataFrame) -> pd.Series:
+    """把多列标准化后的值按行合并为 64 位哈希（按列分别哈希后组合，不拼接字符串）"""
+    return pd.util.hash_pandas_object(parts, index=False)
+
+
+def has_hash_collisions(parts: pd.DataFrame, hashes: pd.Series) -> bool:
+    """检查同一张表中不同的键组合是否得到了相同的哈希"""
+    distinct = parts.assign(_hash=hashes.to_numpy()).drop_duplicates()
+    return bool(distinct['_hash'].duplicated().any())
+
+
+def hash_collisions(parts: pd.DataFrame, hashes: pd.Series, known: pd.DataFrame) -> np.ndarray:
+    """
+    找出哈希在 known 中存在、但实际键与 known 中的键不同的行（两张表之间的哈希冲突）
+    :param known: 以哈希为索引（无重复）的各列标准化值
+    """
+    positions = known.index.get_indexer(hashes)
+    hit = positions >= 0
+    collided = np.zeros(len(hashes), dtype=bool)
+    if hit.any():
+        expected = known.to_numpy()[positions[hit]]
+        collided[hit] = (parts.to_numpy()[hit] != expected).any(axis=1)
+    return collided
+
+
+def fuzzy_key(value: str) -> str:
+    """模糊匹配用的键：全角转半角（NFKC）、忽略大小写、去掉空白和标点"""
+    return _FUZZY_IGNORED_RE.sub('', unicodedata.normalize('NFKC', value).casefold())
+
+
+def bigrams(text: str) -> FrozenSet[str]:
+    """首尾加边界标记后的二元组集合（单个字符的键也至少有两个二元组）"""
+    if not text:
+        return frozenset()
+    text = f"\x02{text}\x03"
+    return frozenset(text[pos:pos + 2] for pos in range(len(text) - 1))
+
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from openpyxl.utils import get_column_letter
+
+from functions.workbook_cache import workbook_cache
+from functions.columnar_store import columnar_store
+from functions.pivot_engine import PivotCube, numeric_columns
+from functions.jobs import report_progress
+from config import PIVOT_CUBE_CACHE_MAX_BYTES
+
+
+class PivotCubeCache:
+    """
+    透视立方体缓存
+    同一个工作表反复调整行标签、列标签和值字段时，不必重新读取和分组原始数据：
+    立方体按 (工作簿内容哈希, 工作表, 分组列) 缓存，分组列包含本次所有分组列、
+    且已检查过本次所有值列的立方体都可以直接汇总出结果（更粗的分组、不同的聚合方式）；
+    去重计数和分位数还要求立方体保存了对应的明细，且精确 / 近似模式与本次相同。
+    按字节预算做 LRU 淘汰
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # (内容哈希, 工作表, 分组列位置) -> {'cube', 'names', 'columns', 'details', 'nbytes'}
+        # names: 列位置 -> 列名；columns: 已检查过类型的值列位置；details: 已保存明细的 (值列位置, 明细种类)
+        self._entries = OrderedDict()
+        self._cached_bytes = 0
+
+    def get_cube(self, file_path: str, sheet_name: str, group_indices: List[int], value_indices: List[int],
+                 details: List[Tuple[int, str]] = (), approximate: bool = False) -> Tuple[PivotCube, Dict[int, str]]:
+        """
+        获取以 group_indices 为分组的立方体，返回 (立方体, 列位置 -> 列名)
+        命中缓存时由缓存的立方体汇总得到；否则读取分组列和值列建立立方体（同一分组已缓存的值列、
+        同一模式已缓存的明细一并计算）
+        :param details: 需要保存明细的 [(值列位置, 明细种类)]
+        :param approximate: 明细是否使用近似摘要
+        """
+        file_hash = workbook_cache.get_token(file_path) or columnar_store.file_hash(file_path)
+        group_key = tuple(group_indices)
+
+        entry = self._find(file_hash, sheet_name, set(group_indices), set(value_indices), set(details), approximate)
+        if entry is None:
+            with self._lock:
+                existing = self._entries.get((file_hash, sheet_name, group_key))
+            columns = list(dict.fromkeys(value_indices + (existing['columns'] if existing else [])))
+            kept = existing['details'] if existing and existing['cube'].approximate == approximate else []
+            entry = self._build(file_path, sheet_name, group_indices, columns,
+                                list(dict.fromkeys(list(details) + kept)), approximate)
+            self._store((file_hash, sheet_name, group_key), entry)
+
+        names = entry['names']
+        cube = entry['cube'].coarsen([names[idx] for idx in group_indices])
+        return cube, names
+
+    def _find(self, file_hash: str, sheet_name: str, group_indices: set, value_indices: set,
+              details: set, approximate: bool):
+        """找行数最少的可用立方体"""
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if key[0] == file_hash and key[1] == sheet_name
+                and group_indices <= set(key[2]) and value_indices <= set(entry['columns'])
+                and details <= set(entry['details'])
+                and (not details or entry['cube'].approximate == approximate)
+            ]
+            if not candidates:
+                return None
+            key, entry = min(candidates, key=lambda item: len(item[1]['cube'].table))
+            self._entries.move_to_end(key)
+            return entry
+
+    @staticmethod
+    def _build(file_path: str, sheet_name: str, group_indices: List[int], value_indices: List[int],
+               details: List[Tuple[int, str]], approximate: bool) -> dict:
+        """读取分组列和值列（只读取用到的列），每个值列判断一次类型，一次分组建立立方体"""
+        used_cols = list(dict.fromkeys(group_indices + value_indices))
+        report_progress(message='正在读取数据')
+        df = workbook_cache.read_sheet(file_path, sheet_name, usecols=used_cols)
+        sheet_width = df.attrs.get('sheet_width', len(df.columns))
+        for idx in used_cols:
+            if idx >= sheet_width:
+                raise ValueError(f"列标识 {get_column_letter(idx + 1)} 超出范围（表格只有 {sheet_width} 列）")
+        names = dict(zip(used_cols, df.columns))
+
+        report_progress(message='正在计算透视表')
+        numeric = numeric_columns(df, [names[idx] for idx in value_indices])
+        cube = PivotCube.build(df, [names[idx] for idx in group_indices], numeric,
+                               [(names[idx], kind) for idx, kind in details], approximate)
+        return {'cube': cube, 'names': names, 'columns': list(value_indices), 'details': list(details),
+                'nbytes': cube.nbytes()}
+
+    def _store(self, key, entry: dict):
+        """放入缓存（替换同一分组的旧立方体）并按字节预算淘汰最久未使用的立方体"""
+        if entry['nbytes'] > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._cached_bytes -= old['nbytes']
+            self._entries[key] = entry
+            self._cached_bytes += entry['nbytes']
+            while self._cached_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._cached_bytes -= evicted['nbytes']
+
+
+# 全局共享的透视立方体缓存
+pivot_cache = PivotCubeCache(PIVOT_CUBE_CACHE_MAX_BYTES)
@@ -0,0 +1,297 @@
+import pandas as pd
+import numpy as np
+from typing import Collection, Dict, List, Tuple
+
+from functions.sketches import hll_table, hll_merge, hll_estimate, ddsketch_table, ddsketch_merge, ddsketch_quantile
+
+AGG_FUNCS = ('sum', 'mean', 'count', 'max', 'min', 'nunique', 'median', 'p90', 'p99')
+TEXT_AGG_FUNCS = ('count', 'nunique')                # 非数值列支持的聚合方式
+QUANTILES = {'median': 0.5, 'p90': 0.9, 'p99': 0.99}
+# 不能由可合并统计量得到的聚合方式 -> 立方体需要保存的明细种类（distinct 去重计数，quantile 分位数）
+DETAIL_KINDS = {'nunique': 'distinct', **{agg_func: 'quantile' for agg_func in QUANTILES}}
+TOTAL_LABEL = '总计'
+
+
+def value_label(col: str, agg_func: str) -> str:
+    """值列在结果中的列名"""
+    return f"{col}({agg_func})"
+
+
+def numeric_columns(df: pd.DataFrame, columns: List[str]) -> Dict[str, pd.Series]:
+    """
+    每个值列只判断一次类型：能整体转换为数值的列返回转换后的数值列，不能转换的列不在结果中
+    """
+    numeric = {}
+    for col in dict.fromkeys(columns):
+        try:
+            numeric[col] = pd.to_numeric(df[col], errors='raise')
+        except (ValueError, TypeError):
+            pass
+    return numeric
+
+
+def check_value_types(values: List[Tuple[str, str]], numeric: Collection[str]):
+    """非数值列只支持计数和去重计数，其他聚合方式直接报错
+    :param numeric: 数值列的列名
+    """
+    for col, agg_func in values:
+        if agg_func not in AGG_FUNCS:
+            raise ValueError(f"不支持的聚合方式：{agg_func}")
+        if col not in numeric and agg_func not in TEXT_AGG_FUNCS:
+            raise ValueError(f"列 '{col}' 是非数值类型，只支持计数和去重计数操作")
+
+
+def detail_specs(values: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """值列配置需要的明细 [(值列名, 明细种类)]"""
+    return list(dict.fromkeys((col, DETAIL_KINDS[agg_func]) for col, agg_func in values if agg_func in DETAIL_KINDS))
+
+
+def pivot_frame(cube: 'PivotCube', values: List[Tuple[str, str]]) -> pd.DataFrame:
+    """
+    长表：每个分组一行，末尾追加总计行
+    分组结果和总计都由立方体得到，平均值、最大值、最小值的总计是整体的统计值，而不是各分组结果的合计
+    :param cube: 以透视表分组列为分组的立方体
+    :param values: [(值列名, 聚合方式)]
+    """
+    group_cols = cube.group_cols
+    result = cube.derive(cube.table, values).reset_index()
+    result.columns = list(group_cols) + list(result.columns[len(group_cols):])
+
+    totals = cube.derive(cube.rollup([]), values)
+    total_row = pd.DataFrame([[TOTAL_LABEL] + [''] * (len(group_cols) - 1)], columns=list(group_cols))
+    total_row = pd.concat([total_row, totals.reset_index(drop=True)], axis=1)
+
+    return pd.concat([result, total_row], ignore_index=True)
+
+
+def format_values(result: pd.DataFrame, group_cols: List[str]) -> pd.DataFrame:
+    """值列格式化为千分位文本：平均值、中位数和分位数保留两位小数，其他取整；空值为空文本"""
+    decimal_suffixes = tuple(f"({agg_func})" for agg_func in ('mean', *QUANTILES))
+    for col in result.columns[len(group_cols):]:
+        pattern = '{:,.2f}' if col.endswith(decimal_suffixes) else '{:,}'
+        values = result[col]
+        valid = values.notna()
+        text = pd.Series('', index=result.index, dtype=object)
+        if valid.any():
+            present = values[valid] if pattern == '{:,.2f}' else values[valid].astype(np.float64).astype(np.int64)
+            text[valid] = [pattern.format(value) for value in present.tolist()]
+        result[col] = text
+    return result
+
+
+SUBTOTAL_SUFFIX = ' 汇总'
+STATS = ('sum', 'count', 'max', 'min')  # 每个数值列在立方体中保存的可合并统计量（平均值由 sum / count 得到）
+
+
+class PivotCube:
+    """
+    按最细分组预聚合的立方体：每个分组保存行数（size）以及每个数值列的 sum、非空个数、max、min
+    这些统计量都可以合并，任意更粗的分组（小计、总计、分组列更少的透视表）都由立方体汇总得到，
+    不必重新分组原始数据。分组列为空值的行也保留在立方体中（汇总到不含该列的分组时仍要计入），
+    coarsen 到透视表的分组列时才去掉
+
+    去重计数和分位数不能由这些统计量合并，需要的值列另外保存明细长表（分组列 + 明细列）：
+    精确模式保存非空的原始值（__value），汇总时按分组 groupby 计算；
+    近似模式保存每个分组的可合并摘要（HyperLogLog 寄存器、对数分桶计数），内存与数据行数无关
+    """
+
+    def __init__(self, table: pd.DataFrame, group_cols: List[str], value_cols: List[str],
+                 details: Dict[Tuple[str, str], pd.DataFrame] = None, approximate: bool = False):
+        self.table = table  # 以分组列为索引，列为 size 和 {统计量}{数值列序号}
+        self.group_cols = list(group_cols)
+        self.value_cols = list(value_cols)
+        self.details = details or {}  # (值列名, 明细种类) -> 明细长表
+        self.approximate = approximate
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, group_cols: List[str], numeric: Dict[str, pd.Series],
+              details: Collection[Tuple[str, str]] = (), approximate: bool = False) -> 'PivotCube':
+        """一次 groupby.agg 算出所有最细分组的统计量
+        :param numeric: numeric_columns 的结果，只有数值列保存统计量（非数值列只能计数，用 size 即可）
+        :param details: 需要保存明细的 [(值列名, 明细种类)]，非数值列没有分位数明细
+        :param approximate: 明细是否保存为近似摘要
+        """
+        value_cols = list(numeric)
+        work = pd.DataFrame({f"g{pos}": df[col] for pos, col in enumerate(group_cols)})
+        named = {'size': ('g0', 'size')}
+        for pos, col in enumerate(value_cols):
+            work[f"v{pos}"] = numeric[col]
+            for stat in STATS:
+                named[f"{stat}{pos}"] = (f"v{pos}", stat)
+        table = work.groupby([f"g{pos}" for pos in range(len(group_cols))], sort=True, dropna=False).agg(**named)
+        table.index.names = group_cols
+
+        keys = pd.DataFrame({col: df[col] for col in group_cols})
+        tables = {}
+        for col, kind in details:
+            if kind == 'quantile' and col not in numeric:
+                continue
+            source = numeric.get(col, df[col])
+            if approximate:
+                tables[(col, kind)] = (hll_table if kind == 'distinct' else ddsketch_table)(keys, source)
+            else:
+                valid = source.notna().to_numpy()
+                tables[(col, kind)] = keys[valid].assign(__value=source[valid]).reset_index(drop=True)
+        return cls(table, group_cols, value_cols, tables, approximate)
+
+    def nbytes(self) -> int:
+        """立方体和明细占用的内存（字节）"""
+        tables = [self.table] + list(self.details.values())
+        return int(sum(table.memory_usage(index=True, deep=True).sum() for table in tables))
+
+    def level_orders(self) -> Dict[str, dict]:
+        """每个分组列的值 -> 排序序号（与 groupby 的排序一致）"""
+        orders = {}
+        for col in self.group_cols:
+            values = self.table.index.get_level_values(col).unique()
+            orders[col] = {value: pos for pos, value in enumerate(sorted(values, key=_sort_key))}
+        return orders
+
+    def _merge_spec(self) -> Dict[str, str]:
+        """各统计量的合并方式"""
+        spec = {'size': 'sum'}
+        for pos in range(len(self.value_cols)):
+            spec.update({f"sum{pos}": 'sum', f"count{pos}": 'sum', f"max{pos}": 'max', f"min{pos}": 'min'})
+        return spec
+
+    def coarsen(self, group_cols: List[str]) -> 'PivotCube':
+        """汇总为以 group_cols（分组列的子集，顺序可以不同）为分组的立方体，去掉这些列为空值的行"""
+        table = self.table
+        valid = np.ones(len(table), dtype=bool)
+        for col in group_cols:
+            valid &= table.index.get_level_values(col).notna()
+        table = table[valid]
+        if list(group_cols) != self.group_cols:
+            table = table.groupby(level=list(group_cols), sort=True).agg(self._merge_spec())
+
+        details = {}
+        for (col, kind), detail in self.details.items():
+            detail = detail[detail[list(group_cols)].notna().all(axis=1).to_numpy()]
+            if self.approximate:
+                detail = (hll_merge if kind == 'distinct' else ddsketch_merge)(detail, list(group_cols))
+            details[(col, kind)] = detail[list(group_cols) + [c for c in detail.columns if c.startswith('__')]]
+        return PivotCube(table, group_cols, self.value_cols, details, self.approximate)
+
+    def rollup(self, keys: List[str]) -> pd.DataFrame:
+        """汇总到 keys 这一层（keys 为空时汇总为一行总计），返回的统计量与立方体相同"""
+        spec = self._merge_spec()
+        if not keys:
+            return self.table.agg(spec).to_frame().T.reset_index(drop=True)
+        if list(keys) == self.group_cols:
+            return self.table
+        return self.table.groupby(level=list(keys), sort=True).agg(spec)
+
+    def detail_values(self, keys: List[str], col: str, agg_func: str):
+        """由明细算出按 keys 分组的去重计数或分位数（keys 为空时返回总体的值）"""
+        detail = self.details[(col, DETAIL_KINDS[agg_func])]
+        if self.approximate:
+            if agg_func == 'nunique':
+                return hll_estimate(detail, keys)
+            return ddsketch_quantile(detail, keys, QUANTILES[agg_func])
+
+        values = detail.groupby(list(keys), sort=True)['__value'] if keys else detail['__value']
+        if agg_func == 'nunique':
+            return values.nunique()
+        return values.quantile(QUANTILES[agg_func])
+
+    def derive(self, stats: pd.DataFrame, values: List[Tuple[str, str]]) -> pd.DataFrame:
+        """由统计量算出各值列（计数为分组行数，平均值为 sum / 非空个数），去重计数和分位数由明细算出"""
+        result = pd.DataFrame(index=stats.index)
+        keys = [name for name in stats.index.names if name is not None]
+        for col, agg_func in values:
+            if agg_func in DETAIL_KINDS:
+                value = self.detail_values(keys, col, agg_func)
+                if keys:
+                    value = value.reindex(stats.index)
+                if agg_func == 'nunique':
+                    value = pd.Series(value, index=stats.index).fillna(0).astype(np.int64)
+                result[value_label(col, agg_func)] = value
+                continue
+            if agg_func == 'count':
+                result[value_label(col, agg_func)] = stats['size'].astype(np.int64)
+                continue
+            pos = self.value_cols.index(col)
+            if agg_func == 'mean':
+                count = stats[f"count{pos}"]
+                result[value_label(col, agg_func)] = stats[f"sum{pos}"] / count.where(count > 0)
+            else:
+                result[value_label(col, agg_func)] = stats[f"{agg_func}{pos}"]
+        return result
+
+
+def _label_keys(frame: pd.DataFrame, cols: List[str], depth: int, orders: Dict[str, dict],
+                prefix: str) -> Tuple[Dict[str, np.ndarray], List[np.ndarray]]:
+    """
+    一组标签列（行标签或列标签）汇总到前 depth 层时的排序键和显示文本
+    排序键每层两列（是否小计、值在立方体中的序号），同一前缀下明细在前、小计在后，总计排在最后；
+    小计把第 depth 层的值显示为“值 汇总”，总计在第一层显示“总计”
+    """
+    rows = len(frame)
+    sort_keys, labels = {}, []
+    for pos, col in enumerate(cols):
+        flag = np.zeros(rows, dtype=np.int64)
+        code = np.zeros(rows, dtype=np.int64)
+        label = np.full(rows, '', dtype=object)
+        if pos < depth:
+            code = frame[col].map(orders[col]).to_numpy(dtype=np.int64)
+            label = frame[col].to_numpy(dtype=object)
+            if pos == depth - 1 and depth < len(cols):
+                label = np.array([f"{value}{SUBTOTAL_SUFFIX}" for value in label], dtype=object)
+        elif pos == depth:
+            flag[:] = 1
+            if depth == 0:
+                label[:] = TOTAL_LABEL
+        sort_keys[f"{prefix}f{pos}"] = flag
+        sort_keys[f"{prefix}c{pos}"] = code
+        labels.append(label)
+    return sort_keys, labels
+
+
+def crosstab_frame(cube: PivotCube, row_cols: List[str], col_cols: List[str],
+                   values: List[Tuple[str, str]]) -> pd.DataFrame:
+    """
+    交叉表：值按列标签组合展开成多列，外层行标签有小计行，外层列标签有小计列，最后是总计行和总计列
+    所有小计、总计都由立方体按 (行标签前 i 层, 列标签前 j 层) 汇总得到
+    结果列为行标签列，加上每个列标签组合的各值列（列名为“列标签 / 值列(聚合方式)”）
+    :param cube: 以 row_cols + col_cols 为分组的立方体
+    """
+    orders = cube.level_orders()
+    labels = [value_label(col, agg_func) for col, agg_func in values]
+
+    parts = []
+    for i in range(len(row_cols) + 1):
+        for j in range(len(col_cols) + 1):
+            keys = list(row_cols[:i]) + list(col_cols[:j])
+            stats = cube.rollup(keys)
+            part = cube.derive(stats, values).reset_index(drop=True)
+            index = stats.index.to_frame(index=False) if keys else pd.DataFrame(index=part.index)
+            row_keys, row_labels = _label_keys(index, row_cols, i, orders, 'r')
+            col_keys, col_labels = _label_keys(index, col_cols, j, orders, 'c')
+            for name, key in {**row_keys, **col_keys}.items():
+                part[name] = key
+            for pos, label in enumerate(row_labels):
+                part[f"rl{pos}"] = label
+            part['cl'] = [' / '.join(str(v) for v in combo if v != '') for combo in zip(*col_labels)]
+            parts.append(part)
+    long = pd.concat(parts, ignore_index=True)
+
+    row_keys = [f"r{kind}{pos}" for pos in range(len(row_cols)) for kind in 'fc']
+    col_keys = [f"c{kind}{pos}" for pos in range(len(col_cols)) for kind in 'fc']
+    row_table = long.drop_duplicates(row_keys).sort_values(row_keys)
+    col_table = long.drop_duplicates(col_keys).sort_values(col_keys)
+
+    wide = long.set_index(row_keys + col_keys)[labels].unstack(col_keys)
+    wide = wide.reindex(pd.MultiIndex.from_frame(row_table[row_keys]))
+
+    result = pd.DataFrame({col: row_table[f"rl{pos}"].to_numpy() for pos, col in enumerate(row_cols)})
+    for *col_key, col_label in col_table[col_keys + ['cl']].itertuples(index=False, name=None):
+        for label in labels:
+            result[f"{col_label} / {label}"] = wide[(label, *col_key)].to_numpy()
+    return result
+
+
+def _sort_key(value):
+    """标签排序：数字在前按数值，其他按文本"""
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        return (0, float(value), '')
+    return (1, 0.0, str(value))
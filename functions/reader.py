@@ -0,0 +1,449 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import time
+import zipfile
+import importlib
+from contextlib import contextmanager
+from functools import lru_cache
+from xml.etree import ElementTree
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string, get_column_letter
+from pandas._libs.parsers import STR_NA_VALUES
+from pandas.io.excel._base import BaseExcelReader
+
+from config import HEADER_PROBE_ROWS, CHUNK_SIZE, EXCEL_READER_ENGINE, XLS_READER_ENGINE
+
+# 读取引擎及其依赖的模块
+ENGINE_MODULES = {
+    'openpyxl': 'openpyxl',
+    'calamine': 'python_calamine',
+    'xlrd': 'xlrd'
+}
+# 各格式可用的引擎，按速度从快到慢排列（auto 时按此顺序选择）
+_FORMAT_ENGINES = {
+    'xlsx': ['calamine', 'openpyxl'],
+    'xls': ['calamine', 'xlrd']
+}
+# pandas 2.2 起内置 calamine 引擎，更早的版本使用下面的适配器
+_PANDAS_HAS_CALAMINE = tuple(int(p) for p in pd.__version__.split('.')[:2]) >= (2, 2)
+# xls（OLE2 复合文档）文件头
+_XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def _is_xlsx(file_path: str) -> bool:
+    """判断是否为 openpyxl 可以流式读取的 xlsx 系列文件"""
+    return os.path.splitext(file_path)[1].lower() in ('.xlsx', '.xlsm')
+
+
+def _streams_with_openpyxl(file_path: str) -> bool:
+    """xlsx 系列文件且配置的读取引擎为 openpyxl 时，用 openpyxl 只读模式逐行读取"""
+    return _is_xlsx(file_path) and resolve_engine(file_path) == 'openpyxl'
+
+
+def _excel_format(source) -> str:
+    """判断 Excel 格式：xls 或 xlsx，source 可以是文件路径或文件对象"""
+    if isinstance(source, (str, os.PathLike)):
+        return 'xls' if os.path.splitext(str(source))[1].lower() == '.xls' else 'xlsx'
+    position = source.tell()
+    head = source.read(len(_XLS_SIGNATURE))
+    source.seek(position)
+    return 'xls' if head == _XLS_SIGNATURE else 'xlsx'
+
+
+@lru_cache(maxsize=None)
+def engine_available(engine: str) -> bool:
+    """检查引擎依赖的模块是否已安装"""
+    module = ENGINE_MODULES.get(engine)
+    if module is None:
+        return False
+    try:
+        importlib.import_module(module)
+        return True
+    except ImportError:
+        return False
+
+
+def resolve_engine(source, engine: Optional[str] = None) -> str:
+    """
+    确定读取 source 使用的引擎
+    未指定时按文件格式使用 config 中的配置；引擎不可用或不支持该格式时回退到可用的引擎
+    """
+    fmt = _excel_format(source)
+    preferred = engine or (XLS_READER_ENGINE if fmt == 'xls' else EXCEL_READER_ENGINE)
+    candidates = _FORMAT_ENGINES[fmt]
+    if preferred != 'auto':
+        if preferred not in ENGINE_MODULES:
+            raise ValueError(f"未知的 Excel 读取引擎: {preferred}")
+        candidates = [preferred] + [c for c in candidates if c != preferred]
+
+    for candidate in candidates:
+        if candidate in _FORMAT_ENGINES[fmt] and engine_available(candidate):
+            if preferred not in ('auto', candidate):
+                _warn_fallback(preferred, candidate, fmt)
+            return candidate
+
+    raise ValueError(f"没有可用的 {fmt} 读取引擎，请安装 {' 或 '.join(ENGINE_MODULES[c] for c in _FORMAT_ENGINES[fmt])}")
+
+
+@lru_cache(maxsize=None)
+def _warn_fallback(preferred: str, actual: str, fmt: str):
+    """同一种回退只提示一次"""
+    print(f"Excel 读取引擎 {preferred} 不可用于 {fmt} 文件，改用 {actual}")
+
+
+class _CalamineReader(BaseExcelReader):
+    """
+    基于 python-calamine 的读取器（供 pandas 2.2 以前的版本使用）
+    单元格转换规则与 pandas 内置的 calamine 引擎一致
+    """
+
+    def __init__(self, filepath_or_buffer, storage_options=None, engine_kwargs=None):
+        importlib.import_module('python_calamine')
+        super().__init__(filepath_or_buffer, storage_options=storage_options,
+                         engine_kwargs=engine_kwargs)
+
+    @property
+    def _workbook_class(self):
+        from python_calamine import CalamineWorkbook
+        return CalamineWorkbook
+
+    def load_workbook(self, filepath_or_buffer, engine_kwargs):
+        from python_calamine import load_workbook as calamine_load_workbook
+        return calamine_load_workbook(filepath_or_buffer, **engine_kwargs)
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return [sheet.name for sheet in self.book.sheets_metadata]
+
+    def get_sheet_by_name(self, name: str):
+        self.raise_if_bad_sheet_by_name(name)
+        return self.book.get_sheet_by_name(name)
+
+    def get_sheet_by_index(self, index: int):
+        self.raise_if_bad_sheet_by_index(index)
+        return self.book.get_sheet_by_index(index)
+
+    def get_sheet_data(self, sheet, file_rows_needed: Optional[int] = None) -> List[list]:
+        def _convert_cell(value):
+            if isinstance(value, float):
+                val = int(value)
+                return val if val == value else value
+            if isinstance(value, date):
+                return pd.Timestamp(value)
+            if isinstance(value, timedelta):
+                return pd.Timedelta(value)
+            return value
+
+        rows = sheet.to_python(skip_empty_area=False, nrows=file_rows_needed)
+        return [[_convert_cell(cell) for cell in row] for row in rows]
+
+
+@contextmanager
+def open_excel(source, engine: Optional[str] = None):
+    """
+    按配置的引擎打开工作簿，返回的对象提供 sheet_names 和 parse()（参数同 pd.read_excel）
+    同一个工作簿需要读取多个工作表时使用，避免重复解析
+    """
+    engine = resolve_engine(source, engine)
+    if engine == 'calamine' and not _PANDAS_HAS_CALAMINE:
+        book = _CalamineReader(source)
+    else:
+        book = pd.ExcelFile(source, engine=engine)
+    try:
+        yield book
+    finally:
+        book.close()
+
+
+def read_excel(source, sheet_name=0, engine: Optional[str] = None, **kwargs):
+    """
+    读取 Excel 工作表，参数与 pd.read_excel 相同
+    所有处理器都应通过此函数读取，切换引擎只需修改 config 中的 EXCEL_READER_ENGINE
+    """
+    with open_excel(source, engine) as book:
+        return book.parse(sheet_name=sheet_name, **kwargs)
+
+
+def column_index(col_letter: str) -> int:
+    """把列标识（A、B…Z、AA…）转换为从0开始的列位置"""
+    try:
+        return column_index_from_string(str(col_letter).strip().upper()) - 1
+    except ValueError:
+        raise ValueError(f"无效的列标识: {col_letter}")
+
+
+def column_letters(width: int) -> List[str]:
+    """生成前 width 列的列标识"""
+    return [get_column_letter(i + 1) for i in range(width)]
+
+
+def list_sheets(file_path: str) -> List[str]:
+    """
+    获取工作簿中的工作表名称
+    xlsx 直接读取压缩包内的 xl/workbook.xml，耗时与工作表大小无关；
+    其他格式或文件结构异常时回退到 pandas 读取
+    """
+    if _is_xlsx(file_path):
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                with zf.open('xl/workbook.xml') as f:
+                    names = []
+                    for _, elem in ElementTree.iterparse(f):
+                        # 兼容 transitional 与 strict 两种命名空间
+                        tag = elem.tag.rsplit('}', 1)[-1]
+                        if tag == 'sheet':
+                            names.append(elem.get('name'))
+                        elif tag == 'sheets':
+                            break
+            if names:
+                return names
+        except (KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+            pass
+
+    with open_excel(file_path) as book:
+        return list(book.sheet_names)
+
+
+def read_head_rows(file_path: str, sheet_name: str, nrows: int) -> List[list]:
+    """
+    只读取工作表的前 nrows 行（原始单元格值，空单元格为 None）
+    读取引擎按 resolve_engine 确定：openpyxl 读取 xlsx 时使用只读模式流式读取，
+    其他引擎（calamine、xlrd）使用 nrows 限制读取行数
+    """
+    if _streams_with_openpyxl(file_path):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            ws = wb[sheet_name]
+            rows = [list(row) for row in ws.iter_rows(max_row=nrows, values_only=True)]
+        finally:
+            wb.close()
+    else:
+        df = read_excel(file_path, sheet_name=sheet_name, header=None, nrows=nrows)
+        rows = df.astype(object).where(df.notna(), None).values.tolist()
+
+    # 与 pandas 一致：去掉每行末尾的空单元格
+    return [_trim_row(row) for row in rows]
+
+
+def _convert_cell(value):
+    """与 pandas 读取 Excel 时的单元格转换保持一致：空值和 NA 文本转为 NaN，整数值的浮点数转为整数"""
+    if value is None:
+        return np.nan
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and value in STR_NA_VALUES:
+        return np.nan
+    return value
+
+
+def _trim_row(row) -> list:
+    """去掉行末尾的空单元格"""
+    row = list(row)
+    while row and row[-1] is None:
+        row.pop()
+    return row
+
+
+def _header_labels(row: list, width: int) -> list:
+    """生成列名：空表头为 Unnamed: n，重复表头加 .1、.2 后缀（与 pandas 一致）"""
+    labels = []
+    seen = {}
+    for i in range(width):
+        value = row[i] if i < len(row) else None
+        label = f"Unnamed: {i}" if value is None or value == '' else _convert_cell(value)
+        if label in seen:
+            seen[label] += 1
+            label = f"{label}.{seen[label]}"
+        seen.setdefault(label, 0)
+        labels.append(label)
+    return labels
+
+
+def iter_excel_chunks(file_path: str, sheet_name: str, header=0,
+                      chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    分块读取工作表，每块最多 chunk_size 行，至少产出一块（可能为空）
+    读取引擎按 resolve_engine 确定：openpyxl 读取 xlsx 时使用只读模式逐行读取，内存占用只与块大小有关；
+    其他引擎（calamine、xlrd）不能逐行读取，整表读取后切片
+    列数取工作表尺寸（<dimension>）、表头和第一块数据中最大的列数；尺寸信息缺失或不准确、
+    之后仍有更宽的行时报错，不截断数据；每块的 attrs['sheet_width'] 为列数
+    """
+    if not _streams_with_openpyxl(file_path):
+        df = read_excel(file_path, sheet_name=sheet_name, header=header)
+        width = len(df.columns)
+        for start in range(0, max(len(df), 1), chunk_size):
+            chunk = df.iloc[start:start + chunk_size]
+            chunk.attrs['sheet_width'] = width
+            yield chunk
+        return
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        sheet_columns = ws.max_column or 0  # 只读模式下来自 <dimension>，没有时为 None
+        ws.reset_dimensions()  # 否则 iter_rows 会按（可能不准确的）尺寸截断每一行
+        rows = ws.iter_rows(values_only=True)
+        header_row = None
+        if header is not None:
+            for _ in range(header):
+                next(rows, None)
+            header_row = _trim_row(next(rows, None) or [])
+
+        labels = None
+        start = 0
+        block = []
+        pending_empty = 0  # 连续空行数，后面还有数据时才输出（与 pandas 一样忽略末尾空行）
+
+        def make_chunk():
+            nonlocal labels
+            if labels is None:
+                width = max([sheet_columns, len(header_row or [])] + [len(r) for r in block])
+                labels = _header_labels(header_row, width) if header_row is not None else list(range(width))
+            width = len(labels)
+            for pos, r in enumerate(block):
+                if len(r) > width:
+                    raise ValueError(f"工作表 {sheet_name} 第 {start + pos + 1} 行数据有 {len(r)} 列，"
+                                     f"超过工作表记录的列数（{width} 列），请在 Excel 中另存后重试")
+                if len(r) < width:
+                    r.extend([np.nan] * (width - len(r)))
+            chunk = pd.DataFrame(block, columns=labels, dtype=object,
+                                 index=pd.RangeIndex(start, start + len(block))).infer_objects()
+            chunk.attrs['sheet_width'] = width
+            return chunk
+
+        for row in rows:
+            row = _trim_row(row)
+            if not row:
+                pending_empty += 1
+                continue
+            block.extend([] for _ in range(pending_empty))
+            pending_empty = 0
+            block.append([_convert_cell(v) for v in row])
+
+            if len(block) >= chunk_size:
+                yield make_chunk()
+                start += len(block)
+                block = []
+
+        if block or start == 0:
+            yield make_chunk()
+    finally:
+        wb.close()
+
+
+def guess_dtype(values: list) -> str:
+    """根据采样值粗略判断列类型：numeric / datetime / boolean / text / empty"""
+    values = [v for v in values if v is not None and not (isinstance(v, str) and not v.strip())]
+    if not values:
+        return 'empty'
+    if all(isinstance(v, bool) for v in values):
+        return 'boolean'
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return 'numeric'
+    if all(isinstance(v, (datetime, date, dt_time, pd.Timestamp)) for v in values):
+        return 'datetime'
+    try:
+        pd.to_numeric(pd.Series(values, dtype=object), errors='raise')
+        return 'numeric'
+    except (ValueError, TypeError):
+        return 'text'
+
+
+def probe_sheet(file_path: str, sheet_name: str, sample_rows: int = HEADER_PROBE_ROWS) -> Dict[str, List[str]]:
+    """
+    探测工作表的表头和列类型
+    只读取表头行和少量采样行，耗时与工作表总行数无关
+    :return: {'headers': 第一行的值, 'dtypes': 每列的类型猜测}
+    """
+    rows = read_head_rows(file_path, sheet_name, sample_rows + 1)
+    if not rows:
+        return {'headers': [], 'dtypes': []}
+
+    width = max(len(row) for row in rows)
+    rows = [row + [None] * (width - len(row)) for row in rows]
+
+    headers = ['' if v is None else str(v).strip() for v in rows[0]]
+    dtypes = [guess_dtype([row[i] for row in rows[1:]]) for i in range(width)]
+
+    return {
+        'headers': headers,
+        'dtypes': dtypes
+    }
+
+
+def benchmark_engines(file_path: str, sheet_name=0, repeat: int = 3) -> List[dict]:
+    """
+    对比各可用引擎读取同一工作表的耗时
+    :return: [{'engine', 'seconds'（多次读取中最快的一次）, 'rows', 'columns'} 或 {'engine', 'error'}]
+    """
+    results = []
+    for engine in _FORMAT_ENGINES[_excel_format(file_path)]:
+        if not engine_available(engine):
+            results.append({'engine': engine, 'error': f"未安装 {ENGINE_MODULES[engine]}"})
+            continue
+        try:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                df = read_excel(file_path, sheet_name=sheet_name, engine=engine)
+                timings.append(time.perf_counter() - start)
+            results.append({
+                'engine': engine,
+                'seconds': min(timings),
+                'rows': len(df),
+                'columns': len(df.columns)
+            })
+        except Exception as e:
+            results.append({'engine': engine, 'error': str(e)})
+    return results
+
+
+def _make_sample_workbook(file_path: str, rows: int, columns: int = 10):
+    """生成测试用工作簿：数值、文本、日期混合"""
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(columns):
+        if i % 3 == 0:
+            data[f"数值{i}"] = rng.random(rows) * 1000
+        elif i % 3 == 1:
+            data[f"文本{i}"] = [f"项目{v}" for v in rng.integers(0, rows, rows)]
+        else:
+            data[f"日期{i}"] = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D')
+    pd.DataFrame(data).to_excel(file_path, index=False)
+
+
+if __name__ == '__main__':
+    # 用法：
+    #   python -m functions.reader 文件.xlsx [工作表]   对比指定文件
+    #   python -m functions.reader                      生成 1千/1万/10万 行的测试工作簿进行对比
+    import tempfile
+
+    if len(sys.argv) > 1:
+        targets = [(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 0)]
+        temp_dir = None
+    else:
+        temp_dir = tempfile.mkdtemp()
+        targets = []
+        for rows in (1000, 10000, 100000):
+            path = os.path.join(temp_dir, f"sample_{rows}.xlsx")
+            print(f"生成测试文件: {rows} 行")
+            _make_sample_workbook(path, rows)
+            targets.append((path, 0))
+
+    for path, sheet in targets:
+        print(f"\n{os.path.basename(path)} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+        for result in benchmark_engines(path, sheet, repeat=1 if temp_dir else 3):
+            if 'error' in result:
+                print(f"  {result['engine']:<10} 失败: {result['error']}")
+            else:
+                print(f"  {result['engine']:<10} {result['seconds']:.3f} 秒  "
+                      f"{result['rows']} 行 x {result['columns']} 列")
+
+    if temp_dir:
+        import shutil
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,124 @@
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import RESULT_FOLDER, RESULT_EXPIRY, RESULT_MAX_BYTES
+
+_RESULT_PATTERN = re.compile(r'^result_([0-9a-f]{32})\.xlsx$')
+
+
+class ResultStore:
+    """
+    处理结果文件的索引
+    每次处理分配一个唯一 ID，结果文件名由 ID 生成；索引在内存中记录文件路径、大小和生成时间，
+    下载时按 ID 直接查找，不再扫描结果目录。过期的结果和超出磁盘预算的最早结果会被删除
+    """
+
+    def __init__(self, folder: str, expiry: int, max_bytes: int):
+        self.folder = folder
+        self.expiry = expiry
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # ID -> {'path', 'size', 'created', 'download_name'}，按生成时间排序
+        self._total_bytes = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+        self._load_existing()
+
+    def allocate(self) -> Tuple[str, str]:
+        """分配结果 ID 和对应的文件路径（文件由处理器写入，成功后调用 add 登记）"""
+        result_id = uuid.uuid4().hex
+        return result_id, os.path.join(self.folder, f"result_{result_id}.xlsx")
+
+    def add(self, result_id: str, download_name: str = 'result.xlsx'):
+        """登记已生成的结果文件，并按有效期和磁盘预算淘汰旧结果"""
+        path = os.path.join(self.folder, f"result_{result_id}.xlsx")
+        size = os.path.getsize(path)
+        with self._lock:
+            self._results[result_id] = {
+                'path': path,
+                'size': size,
+                'created': time.time(),
+                'download_name': download_name
+            }
+            self._total_bytes += size
+        self.evict()
+
+    def get(self, result_id: str) -> Optional[dict]:
+        """按 ID 获取结果，不存在或已过期时返回 None"""
+        with self._lock:
+            entry = self._results.get(result_id)
+            if entry is None:
+                return None
+            if time.time() - entry['created'] > self.expiry or not os.path.exists(entry['path']):
+                self._remove(result_id)
+                return None
+            return dict(entry)
+
+    def discard(self, result_id: str):
+        """删除结果（处理失败时清理写了一半的文件）"""
+        with self._lock:
+            if result_id in self._results:
+                self._remove(result_id)
+                return
+        path = os.path.join(self.folder, f"result_{result_id}.xlsx")
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"清理结果文件失败: {str(e)}")
+
+    def evict(self):
+        """删除过期的结果；总大小超过磁盘预算时从最早的结果开始删除"""
+        now = time.time()
+        with self._lock:
+            expired = [result_id for result_id, entry in self._results.items()
+                       if now - entry['created'] > self.expiry]
+            for result_id in expired:
+                self._remove(result_id)
+
+            # 最新的结果即使单独超过预算也保留，保证刚处理完的结果可以下载
+            while self._total_bytes > self.max_bytes and len(self._results) > 1:
+                self._remove(next(iter(self._results)))
+
+    def _remove(self, result_id: str):
+        """从索引中移除并删除文件（调用方持有锁）"""
+        entry = self._results.pop(result_id)
+        self._total_bytes -= entry['size']
+        try:
+            if os.path.exists(entry['path']):
+                os.remove(entry['path'])
+        except Exception as e:
+            print(f"清理结果文件失败: {str(e)}")
+
+    def _load_existing(self):
+        """启动时把结果目录中已有的结果文件加入索引（只在初始化时扫描一次）"""
+        existing = []
+        for filename in os.listdir(self.folder):
+            match = _RESULT_PATTERN.match(filename)
+            if not match:
+                continue
+            path = os.path.join(self.folder, filename)
+            try:
+                existing.append((os.path.getmtime(path), match.group(1), path, os.path.getsize(path)))
+            except OSError:
+                continue
+
+        for created, result_id, path, size in sorted(existing):
+            self._results[result_id] = {
+                'path': path,
+                'size': size,
+                'created': created,
+                'download_name': 'result.xlsx'
+            }
+            self._total_bytes += size
+        self.evict()
+
+
+# 全局共享的结果索引
+result_store = ResultStore(RESULT_FOLDER, RESULT_EXPIRY, RESULT_MAX_BYTES)
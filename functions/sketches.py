@@ -0,0 +1,126 @@
+import pandas as pd
+import numpy as np
+from typing import List
+
+from config import PIVOT_HLL_PRECISION, PIVOT_QUANTILE_ACCURACY
+
+"""
+可合并的近似统计（用于透视表的近似去重计数和分位数）
+每个分组的摘要都以长表保存（分组列 + 摘要列），合并就是按分组列再做一次 groupby，
+估计值也由 groupby 一次算出，不逐个分组循环；摘要大小有上限，与数据行数无关：
+
+- HyperLogLog（去重计数）：每个分组最多 2^precision 个寄存器，保存 (__reg, __rank)，合并取最大值
+- DDSketch（分位数）：按相对误差 accuracy 划分的对数桶，保存 (__sign, __bucket, __n)，合并把计数相加；
+  t-digest / KLL 的合并需要逐个摘要处理，对数桶则可以直接用 groupby 合并，估计值的相对误差不超过 accuracy
+"""
+
+_ALL = '__all'  # 没有分组列（总计）时使用的常量分组列
+
+
+def _grouped(table: pd.DataFrame, keys: List[str]):
+    """按 keys 分组；keys 为空时整张表为一组"""
+    if keys:
+        return table, list(keys)
+    return table.assign(**{_ALL: 0}), [_ALL]
+
+
+def _finish(result: pd.Series, keys: List[str]):
+    """keys 为空时返回单个值（没有数据时为 NaN）"""
+    if keys:
+        return result
+    return result.iloc[0] if len(result) else np.nan
+
+
+def _leading_zeros(words: np.ndarray) -> np.ndarray:
+    """64 位无符号整数的前导零个数（words 不能为 0），二分法移位，全部向量化"""
+    words = words.copy()
+    count = np.zeros(len(words), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = (words >> np.uint64(64 - shift)) == 0
+        count += shift * empty
+        words = np.where(empty, words << np.uint64(shift), words)
+    return count
+
+
+def hll_table(keys: pd.DataFrame, values: pd.Series, precision: int = PIVOT_HLL_PRECISION) -> pd.DataFrame:
+    """
+    建立每个分组的 HyperLogLog 寄存器（只保存非零的寄存器）
+    :param keys: 分组列（与 values 按行对应）
+    """
+    valid = values.notna().to_numpy()
+    hashes = pd.util.hash_array(values[valid].to_numpy())
+    registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    # 剩余的位左移后最低位补 1，保证不为 0
+    rest = (hashes << np.uint64(precision)) | np.uint64(1 << (precision - 1))
+    table = keys[valid].reset_index(drop=True).assign(__reg=registers, __rank=_leading_zeros(rest) + 1)
+    return hll_merge(table, list(keys.columns))
+
+
+def hll_merge(table: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """把寄存器合并到 keys 这一层：同一寄存器取最大值"""
+    table, group = _grouped(table, keys)
+    merged = table.groupby(group + ['__reg'], sort=False, dropna=False)['__rank'].max().reset_index()
+    return merged if keys else merged.drop(columns=_ALL)
+
+
+def hll_estimate(table: pd.DataFrame, keys: List[str], precision: int = PIVOT_HLL_PRECISION):
+    """按 keys 分组估计去重个数（keys 为空时返回总体的估计值）"""
+    m = 1 << precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    table, group = _grouped(hll_merge(table, keys), keys)
+    table = table.assign(__weight=np.exp2(-table['__rank'].to_numpy(dtype=np.float64)))
+    grouped = table.groupby(group, sort=True).agg(weight=('__weight', 'sum'), present=('__reg', 'size'))
+    empty = m - grouped['present']
+    raw = alpha * m * m / (grouped['weight'] + empty)
+    # 基数较小时用线性计数修正
+    linear = m * np.log(m / empty.where(empty > 0))
+    estimate = raw.where((raw > 2.5 * m) | (empty == 0), linear).round()
+    return _finish(estimate, keys)
+
+
+def ddsketch_table(keys: pd.DataFrame, values: pd.Series,
+                   accuracy: float = PIVOT_QUANTILE_ACCURACY) -> pd.DataFrame:
+    """
+    建立每个分组的对数桶计数（values 为数值列，空值不计入）
+    负数按绝对值分桶后取负的桶号，排序后与数值顺序一致；0 单独为一个桶
+    """
+    numbers = values.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(numbers)
+    numbers = numbers[valid]
+    log_gamma = np.log((1 + accuracy) / (1 - accuracy))
+    signs = np.sign(numbers).astype(np.int8)
+    buckets = np.zeros(len(numbers), dtype=np.int64)
+    nonzero = signs != 0
+    buckets[nonzero] = np.ceil(np.log(np.abs(numbers[nonzero])) / log_gamma).astype(np.int64)
+    buckets = np.where(signs < 0, -buckets, buckets)
+    table = keys[valid].reset_index(drop=True).assign(__sign=signs, __bucket=buckets, __n=1)
+    return ddsketch_merge(table, list(keys.columns))
+
+
+def ddsketch_merge(table: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """把桶计数合并到 keys 这一层：同一个桶的计数相加"""
+    table, group = _grouped(table, keys)
+    merged = table.groupby(group + ['__sign', '__bucket'], sort=False, dropna=False)['__n'].sum().reset_index()
+    return merged if keys else merged.drop(columns=_ALL)
+
+
+def ddsketch_quantile(table: pd.DataFrame, keys: List[str], q: float,
+                      accuracy: float = PIVOT_QUANTILE_ACCURACY):
+    """
+    按 keys 分组估计分位数（与 pandas 的线性插值一样以第 q × (n - 1) 个值为准，取其所在桶的代表值）
+    keys 为空时返回总体的估计值
+    """
+    table, group = _grouped(table, keys)
+    table = table.sort_values(group + ['__sign', '__bucket'], kind='stable')
+    grouped = table.groupby(group, sort=False)['__n']
+    cumulative = grouped.cumsum()
+    target = q * (grouped.transform('sum') - 1)
+    chosen = table[cumulative > target].groupby(group, sort=True).head(1).set_index(group)
+
+    gamma = (1 + accuracy) / (1 - accuracy)
+    signs = chosen['__sign'].to_numpy(dtype=np.float64)
+    # 负数保存的是取负后的桶号，乘以符号还原为绝对值所在的桶号（绝对值小于 1 时桶号为负）
+    buckets = signs * chosen['__bucket'].to_numpy(dtype=np.float64)
+    magnitude = 2 * np.power(gamma, buckets) / (gamma + 1)
+    estimate = pd.Series(signs * magnitude, index=chosen.index).sort_index()
+    return _finish(estimate, keys)
@@ -1,8 +1,19 @@
 import pandas as pd
+import numpy as np
 import os
-from typing import Tuple, List, Dict, Union
+from typing import Tuple, List, Dict, Union, Optional
 import time
 import json
+from itertools import chain
+from openpyxl.utils import get_column_letter
+from functions.workbook_cache import workbook_cache
+from functions.reader import list_sheets, probe_sheet, column_index, column_letters
+from functions.writer import StreamingWriter
+from functions.jobs import report_progress
+from functions.match_keys import normalize_keys, combine_keys
+from functions.lookup_index import index_class
+from functions.lookup_registry import lookup_registry
+from config import HASHED_COMPOSITE_KEYS, VLOOKUP_DUPLICATE_POLICY, VLOOKUP_MAX_MAIN_ROWS
 
 class VlookupProcessor:
     def __init__(self, main_file_path: str, lookup_file_path: str, result_path: str):
@@ -14,181 +25,221 @@ class VlookupProcessor:
     def get_sheets(file_path: str) -> List[str]:
         """获取Excel文件中的所有工作表名称"""
         try:
-            with pd.ExcelFile(file_path) as xl:
-                return xl.sheet_names
+            return list_sheets(file_path)
         except Exception as e:
             raise Exception(f"读取工作表失败: {str(e)}")
 
     @staticmethod
     def get_sheet_info(file_path: str, sheet_name: str) -> Dict[str, Union[List[str], List[int]]]:
-        """获取工作表的列信息"""
+        """获取工作表的列信息（只读取表头和采样行）"""
         try:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            headers = df.columns.tolist()  # 获取实际的列名
-            columns = [chr(65 + i) for i in range(len(headers))]  # A, B, C...
+            info = probe_sheet(file_path, sheet_name)
+            headers = info['headers']  # 获取实际的列名
+            columns = column_letters(len(headers))  # A, B, C...AA, AB...
             
             return {
                 'headers': headers,
-                'columns': columns
+                'columns': columns,
+                'dtypes': info['dtypes']
             }
         except Exception as e:
             raise Exception(f"读取列信息失败: {str(e)}")
 
     def process(self, main_sheet: str, main_match_type: str, main_columns: List[str],
                 lookup_sheet: str, lookup_match_type: str, lookup_match_columns: List[str],
-                return_type: str, return_columns: List[str]) -> Tuple[bool, str]:
-        """处理VLOOKUP操作"""
+                return_type: str, return_columns: List[str],
+                duplicate_policy: str = VLOOKUP_DUPLICATE_POLICY,
+                lookup_table: Optional[str] = None, match_mode: str = 'exact') -> Tuple[bool, str]:
+        """
+        处理VLOOKUP操作
+        :param duplicate_policy: 查找表中匹配值重复时的处理方式：first / last / error 每个键只取一行；
+                                 all 返回全部匹配行（主表行按匹配数展开），count 返回匹配数，
+                                 sum 对返回列求和，join 连接返回列的所有匹配值。一对多方式只支持精确匹配
+        :param lookup_table: 已注册的常用查找表名称，指定时不再读取查找表文件
+        :param match_mode: exact 精确匹配；range 区间匹配（同 Excel VLOOKUP 的近似匹配，
+                           返回不大于查找值的最大键所在行）；fuzzy 模糊匹配（返回最相似的键所在行，
+                           并在返回列之后追加相似度列）。range 和 fuzzy 只支持单列匹配
+        """
+        return self.process_batch(main_sheet, [{
+            'main_match_type': main_match_type,
+            'main_columns': main_columns,
+            'lookup_path': self.lookup_file_path,
+            'lookup_sheet': lookup_sheet,
+            'lookup_match_type': lookup_match_type,
+            'lookup_match_columns': lookup_match_columns,
+            'return_type': return_type,
+            'return_columns': return_columns,
+            'duplicate_policy': duplicate_policy,
+            'lookup_table': lookup_table,
+            'match_mode': match_mode
+        }])
+
+    def process_batch(self, main_sheet: str, lookups: List[dict]) -> Tuple[bool, str]:
+        """
+        同一主表依次匹配多个查找表，结果列按 lookups 的顺序追加到同一个结果文件
+        主表只读取一次；每一块中同一主表列只标准化一次，匹配列相同的查找共用同一组键
+        :param lookups: 每项的键与 process 的参数相同，另有 lookup_path 指定查找表文件
+        """
         try:
-            print(f"Debug - 处理参数:")
-            print(f"主表工作表: {main_sheet}")
-            print(f"主表匹配类型: {main_match_type}")
-            print(f"主表匹配列: {main_columns}")
-            print(f"查找表工作表: {lookup_sheet}")
-            print(f"查找表匹配类型: {lookup_match_type}")
-            print(f"查找表匹配列: {lookup_match_columns}")
-            print(f"返回类型: {return_type}")
-            print(f"返回列: {return_columns}")
-            
             # 读取Excel文件，不使用第一行作为列名
-            main_df = pd.read_excel(self.main_file_path, sheet_name=main_sheet, header=None)
-            lookup_df = pd.read_excel(self.lookup_file_path, sheet_name=lookup_sheet, header=None)
-            
-            print(f"Debug - 表格列数:")
-            print(f"主表列数: {len(main_df.columns)}")
-            print(f"查找表列数: {len(lookup_df.columns)}")
+            # 先在内存中建好查找索引，主表按 CHUNK_SIZE 分块读取（xlsx 为只读模式逐行读取），
+            # 逐块匹配后交给只写模式的写出器，内存占用只与查找表和块大小有关，与主表行数无关；
+            # 查找表只读取匹配列和返回列
+            main_chunks = workbook_cache.iter_chunks(self.main_file_path, main_sheet, header=None,
+                                                     max_rows=VLOOKUP_MAX_MAIN_ROWS)
+            first_chunk = next(main_chunks)
+            main_width = first_chunk.attrs.get('sheet_width', len(first_chunk.columns))
+            print(f"Debug - 主表工作表: {main_sheet}，列数: {main_width}")
             
-            # 将字母列标识转换为列索引
-            def get_column_index(df, col_letter: str, table_name: str) -> int:
-                col_idx = ord(col_letter.upper()) - ord('A')
-                if col_idx < 0 or col_idx >= len(df.columns):
-                    raise ValueError(f"{table_name}中的列标识 {col_letter} 超出范围（表格只有 {len(df.columns)} 列，从A到{chr(ord('A') + len(df.columns) - 1)}）")
-                return col_idx
-            
-            # 转换列标识为索引
-            try:
-                main_col_indices = [get_column_index(main_df, col, "主表") for col in main_columns]
-                lookup_col_indices = [get_column_index(lookup_df, col, "查找表") for col in lookup_match_columns]
-                return_col_indices = [get_column_index(lookup_df, col, "查找表") for col in return_columns]
-                
-                print(f"Debug - 列索引:")
-                print(f"主表列索引: {main_col_indices}")
-                print(f"查找表匹配列索引: {lookup_col_indices}")
-                print(f"返回列索引: {return_col_indices}")
-                
-            except ValueError as e:
-                raise ValueError(str(e))
-            
-            def standardize_value(value) -> str:
-                """标准化数据值"""
-                if pd.isna(value):
-                    return ''
-                
-                # 转换为字符串
-                value = str(value).strip()
-                
-                try:
-                    # 尝试转换为数字并格式化
-                    num = float(value)
-                    if num.is_integer():
-                        return str(int(num))  # 整数去掉小数点
-                    return str(num)  # 保留小数
-                except ValueError:
-                    # 不是数字，进行文本处理
-                    value = value.strip()  # 去除首尾空格
-                    value = ' '.join(value.split())  # 合并多个空格
-                    return value
-            
-            def standardize_series(series: pd.Series) -> pd.Series:
-                """标准化数据列"""
-                return series.apply(standardize_value)
-            
-            # 创建匹配键
-            if main_match_type == 'single':
-                main_key = standardize_series(main_df[main_col_indices[0]])
-            else:
-                # 对多列分别标准化后再合并
-                standardized_cols = [standardize_series(main_df[idx]) for idx in main_col_indices]
-                main_key = pd.concat(standardized_cols, axis=1).apply(
-                    lambda x: '|'.join(x), axis=1
-                )
-            
-            if lookup_match_type == 'single':
-                lookup_key = standardize_series(lookup_df[lookup_col_indices[0]])
-            else:
-                standardized_cols = [standardize_series(lookup_df[idx]) for idx in lookup_col_indices]
-                lookup_key = pd.concat(standardized_cols, axis=1).apply(
-                    lambda x: '|'.join(x), axis=1
-                )
-            
-            # 创建查找字典
-            lookup_dict = {}
-            for idx, key in enumerate(lookup_key):
-                if return_type == 'single':
-                    value = lookup_df.iloc[idx][return_col_indices[0]]
-                    if pd.notna(value):
-                        lookup_dict[key] = value
-                else:
-                    values = lookup_df.iloc[idx][return_col_indices].to_dict()
-                    if all(pd.notna(v) for v in values.values()):
-                        lookup_dict[key] = values
+            prepared = [self._prepare_lookup(lookup, main_width) for lookup in lookups]
             
-            # 执行查找并检查匹配结果
-            matched_count = 0
-            total_count = len(main_key)
+            # 执行查找并检查匹配结果，逐块写出
+            total_count = 0
+            probed_counts = [0] * len(prepared)  # 参与匹配的行数（all 展开后，之后的查找按展开后的行计数）
+            matched_counts = [0] * len(prepared)
+            output_count = 0
+            fuzzy_counts = [0] * len(prepared)
             
-            # 记录未匹配的数据
-            unmatched_values = set()
+            # 记录未匹配的数据（只保留示例需要的数量）
+            unmatched_values = [set() for _ in prepared]
             
-            if return_type == 'single':
-                result_series = main_key.map(lookup_dict)
-                matched_mask = result_series.notna()
-                matched_count = matched_mask.sum()
-                
-                # 收集未匹配的值
-                if matched_count < total_count:
-                    unmatched_values = set(main_key[~matched_mask].unique())
-                
-                if matched_count == 0:
-                    return False, "未找到任何匹配的数据，请检查匹配条件是否正确"
-                
-                main_df[len(main_df.columns)] = result_series.fillna('')
-            else:
-                first_result = main_key.map({k: v[return_col_indices[0]] for k, v in lookup_dict.items()})
-                matched_mask = first_result.notna()
-                matched_count = matched_mask.sum()
-                
-                # 收集未匹配的值
-                if matched_count < total_count:
-                    unmatched_values = set(main_key[~matched_mask].unique())
-                
-                if matched_count == 0:
-                    return False, "未找到任何匹配的数据，请检查匹配条件是否正确"
-                
-                for idx, col_idx in enumerate(return_col_indices):
-                    result_series = main_key.map({k: v[col_idx] for k, v in lookup_dict.items()})
-                    main_df[len(main_df.columns) + idx] = result_series.fillna('')
+            with StreamingWriter(self.result_path) as writer:
+                sheet = writer.add_sheet('Sheet1', header=False)
+                for chunk_number, main_df in enumerate(chain([first_chunk], main_chunks)):
+                    main_df, chunk_stats = match_chunk(prepared, main_df, chunk_number)
+                    total_count += chunk_stats[0]['rows']
+                    for pos, stats in enumerate(chunk_stats):
+                        probed_counts[pos] += stats['probed']
+                        matched_counts[pos] += stats['matched']
+                        fuzzy_counts[pos] += stats['fuzzy']
+                        unmatched = unmatched_values[pos]
+                        for value in stats['unmatched']:
+                            if len(unmatched) > 5:
+                                break
+                            unmatched.add(value)
+                    
+                    sheet.write_frame(main_df)
+                    output_count += len(main_df)
+                    report_progress(message=f"已处理 {total_count} 行")
             
-            # 保存结果
-            main_df.to_excel(self.result_path, index=False, header=False)
+            if sum(matched_counts) == 0:
+                os.remove(self.result_path)
+                return False, "未找到任何匹配的数据，请检查匹配条件是否正确"
             
             # 返回匹配统计信息和未匹配的值
-            match_rate = (matched_count / total_count) * 100
-            result_message = f"匹配完成：共 {total_count} 条数据，成功匹配 {matched_count} 条（{match_rate:.1f}%）"
-            
-            if unmatched_values:
-                # 最多显示5个未匹配的值作为示例
-                example_values = list(unmatched_values)[:5]
-                example_str = '、'.join(str(v) for v in example_values)
-                if len(unmatched_values) > 5:
-                    example_str += ' 等'
-                result_message += f"\n未匹配的值示例：{example_str}"
+            messages = []
+            for pos, lookup in enumerate(prepared):
+                match_rate = (matched_counts[pos] / probed_counts[pos]) * 100
+                result_message = f"匹配完成：共 {probed_counts[pos]} 条数据，成功匹配 {matched_counts[pos]} 条（{match_rate:.1f}%）"
+                if prepared[pos]['match_mode'] == 'fuzzy':
+                    result_message += f"，其中模糊匹配 {fuzzy_counts[pos]} 条"
+                if prepared[pos]['duplicate_policy'] == 'all' and output_count != total_count:
+                    result_message += f"，按全部匹配展开后共 {output_count} 行"
+                if len(prepared) > 1:
+                    result_message = f"查找 {pos + 1}（{lookup['name']}）{result_message}"
+                
+                if unmatched_values[pos]:
+                    # 最多显示5个未匹配的值作为示例
+                    example_values = list(unmatched_values[pos])[:5]
+                    example_str = '、'.join(str(v) for v in example_values)
+                    if len(unmatched_values[pos]) > 5:
+                        example_str += ' 等'
+                    result_message += f"\n未匹配的值示例：{example_str}"
+                messages.append(result_message)
             
-            return True, result_message
+            return True, '\n'.join(messages)
             
         except Exception as e:
             print(f"Error: {str(e)}")
             return False, str(e)
 
+    @staticmethod
+    def _prepare_lookup(lookup: dict, main_width: int) -> dict:
+        """
+        读取一个查找表并建立索引
+        :return: {'name', 'main_indices', 'index', 'match_mode', 'duplicate_policy', 'headers'}
+        """
+        main_match_type = lookup['main_match_type']
+        main_columns = lookup['main_columns']
+        lookup_match_type = lookup.get('lookup_match_type')
+        lookup_match_columns = lookup.get('lookup_match_columns')
+        return_columns = lookup.get('return_columns')
+        duplicate_policy = lookup.get('duplicate_policy') or VLOOKUP_DUPLICATE_POLICY
+        lookup_table = lookup.get('lookup_table')
+        match_mode = lookup.get('match_mode') or 'exact'
+        
+        print(f"Debug - 处理参数:")
+        print(f"主表匹配类型: {main_match_type}")
+        print(f"主表匹配列: {main_columns}")
+        print(f"查找表工作表: {lookup.get('lookup_sheet')}")
+        print(f"查找表匹配类型: {lookup_match_type}")
+        print(f"查找表匹配列: {lookup_match_columns}")
+        print(f"返回类型: {lookup.get('return_type')}")
+        print(f"返回列: {return_columns}")
+        print(f"重复值处理: {duplicate_policy}")
+        print(f"匹配方式: {match_mode}")
+        
+        if lookup_table:
+            # 使用已注册的常用查找表，匹配列和返回列以注册时的配置为准
+            lookup_entry = lookup_registry.get(lookup_table)
+            lookup_match_columns = lookup_entry['matchColumns']
+            return_columns = lookup_entry['returnColumns']
+            lookup_match_type = 'single' if len(lookup_match_columns) == 1 else 'multiple'
+            name = lookup_table
+            print(f"常用查找表: {lookup_table}（匹配列 {lookup_match_columns}，返回列 {return_columns}）")
+        else:
+            lookup_usecols = [column_index(col) for col in lookup_match_columns + return_columns]
+            lookup_df = workbook_cache.read_sheet(lookup['lookup_path'], lookup['lookup_sheet'], header=None,
+                                                  usecols=lookup_usecols)
+            lookup_width = lookup_df.attrs.get('sheet_width', len(lookup_df.columns))
+            name = lookup['lookup_sheet']
+            print(f"查找表列数: {lookup_width}")
+        
+        # 将字母列标识转换为列索引
+        def get_column_index(width: int, col_letter: str, table_name: str) -> int:
+            col_idx = column_index(col_letter)
+            if col_idx >= width:
+                raise ValueError(f"{table_name}中的列标识 {col_letter} 超出范围（表格只有 {width} 列，从A到{get_column_letter(width)}）")
+            return col_idx
+        
+        # 转换列标识为索引
+        main_col_indices = [get_column_index(main_width, col, "主表") for col in main_columns]
+        print(f"Debug - 列索引:")
+        print(f"主表列索引: {main_col_indices}")
+        
+        if not lookup_table:
+            lookup_col_indices = [get_column_index(lookup_width, col, "查找表") for col in lookup_match_columns]
+            return_col_indices = [get_column_index(lookup_width, col, "查找表") for col in return_columns]
+            print(f"查找表匹配列索引: {lookup_col_indices}")
+            print(f"返回列索引: {return_col_indices}")
+        
+        if match_mode != 'exact' and (len(main_columns) != 1 or len(lookup_match_columns) != 1):
+            raise ValueError("区间匹配和模糊匹配只支持单列匹配")
+        
+        # 两边都是多列匹配且列数相同时，用 64 位哈希作为组合键，不再逐行拼接字符串
+        use_hash = (HASHED_COMPOSITE_KEYS and main_match_type != 'single' and lookup_match_type != 'single'
+                    and len(main_columns) == len(lookup_match_columns))
+        
+        # 建立查找索引（键去重后一次建好，所有返回列一起取出）
+        if lookup_table:
+            _, lookup_index = lookup_registry.get_index(lookup_table, duplicate_policy, use_hash, match_mode)
+        else:
+            lookup_parts = pd.DataFrame({pos: normalize_keys(lookup_df[idx])
+                                         for pos, idx in enumerate(lookup_col_indices)})
+            lookup_index = index_class(match_mode, duplicate_policy).from_parts(
+                lookup_parts, lookup_df[return_col_indices], duplicate_policy, hashed=use_hash)
+        
+        # 返回列的表头（查找表第一行），结果的表头行直接写入，不依赖表头行的匹配结果
+        if lookup_table:
+            headers = lookup_entry['returnHeaders']
+        else:
+            first_row = lookup_df.iloc[0] if len(lookup_df) else None
+            headers = ['' if first_row is None or pd.isna(first_row[idx]) else str(first_row[idx])
+                       for idx in return_col_indices]
+        
+        return {'name': name, 'main_indices': main_col_indices, 'index': lookup_index, 'match_mode': match_mode,
+                'duplicate_policy': duplicate_policy, 'headers': headers}
+
     def cleanup(self):
         """清理临时文件"""
         max_attempts = 3
@@ -196,11 +247,12 @@ class VlookupProcessor:
 
         for _ in range(max_attempts):
             try:
-                if os.path.exists(self.main_file_path):
+                if os.path.exists(self.main_file_path) and not workbook_cache.is_session_file(self.main_file_path):
                     os.close(os.open(self.main_file_path, os.O_RDONLY))
                     os.remove(self.main_file_path)
 
-                if os.path.exists(self.lookup_file_path):
+                if self.lookup_file_path and os.path.exists(self.lookup_file_path) and \
+                        not workbook_cache.is_session_file(self.lookup_file_path):
                     os.close(os.open(self.lookup_file_path, os.O_RDONLY))
                     os.remove(self.lookup_file_path)
 
@@ -209,4 +261,92 @@ class VlookupProcessor:
                 if _ < max_attempts - 1:
                     time.sleep(delay)
                 else:
-                    print(f"清理文件时出错: {e}")
\ No newline at end of file
+                    print(f"清理文件时出错: {e}")
+
+
+def _expand_rows(rows: np.ndarray, main_df: pd.DataFrame, normalized: dict, main_keys: dict,
+                 chunk_results: List[pd.Series]):
+    """按行号展开主表块及其已标准化的列、已生成的键和已取出的结果列（展开后重新编号）"""
+    main_df = main_df.iloc[rows].reset_index(drop=True)
+    
+    def expand(series: pd.Series) -> pd.Series:
+        return pd.Series(series.to_numpy()[rows], index=main_df.index, dtype=series.dtype)
+    
+    return (main_df,
+            {key: expand(value) for key, value in normalized.items()},
+            {key: expand(value) for key, value in main_keys.items()},
+            [expand(result) for result in chunk_results])
+
+
+def match_chunk(prepared: List[dict], main_df: pd.DataFrame, chunk_number: int) -> Tuple[pd.DataFrame, List[dict]]:
+    """
+    主表的一块依次匹配所有查找表，把结果列追加到块的末尾
+    同一主表列只标准化一次，匹配列相同的查找共用同一组键
+    :return: (追加了结果列的块, 每个查找的统计 {'rows', 'probed', 'matched', 'fuzzy', 'unmatched'})
+    """
+    rows = len(main_df)
+    normalized = {}  # 主表列索引 -> 标准化后的值
+    main_keys = {}   # (主表列索引, 是否哈希键) -> 键
+    chunk_results = []
+    chunk_stats = []
+    
+    for lookup in prepared:
+        lookup_index = lookup['index']
+        for idx in lookup['main_indices']:
+            if idx not in normalized:
+                normalized[idx] = normalize_keys(main_df[idx])
+        main_parts = pd.DataFrame({part: normalized[idx]
+                                   for part, idx in enumerate(lookup['main_indices'])})
+        key_id = (tuple(lookup['main_indices']), lookup_index.hashed)
+        if key_id not in main_keys:
+            main_keys[key_id] = lookup_index.make_keys(main_parts)
+        main_key = main_keys[key_id]
+        
+        stats = {'rows': rows, 'probed': len(main_df), 'matched': 0, 'fuzzy': 0, 'unmatched': []}
+        if lookup['duplicate_policy'] == 'all':
+            positions = lookup_index.probe(main_parts, main_key)
+            expanded_rows, value_rows = lookup_index.expand(positions)
+            if len(expanded_rows) != len(main_df):
+                # 主表行按匹配数展开，已算好的列和键一起展开
+                main_df, normalized, main_keys, chunk_results = _expand_rows(
+                    expanded_rows, main_df, normalized, main_keys, chunk_results)
+            chunk_results.extend(lookup_index.take(value_rows, index=main_df.index))
+        else:
+            if lookup['match_mode'] == 'fuzzy':
+                positions, scores, fuzzy = lookup_index.match(main_parts, main_key)
+                stats['fuzzy'] = int(fuzzy.sum())
+            else:
+                positions = lookup_index.probe(main_parts, main_key)
+            lookup_results = lookup_index.take(positions, index=main_df.index)
+            labels = ['匹配数'] if lookup['duplicate_policy'] == 'count' else list(lookup['headers'])
+            if lookup['match_mode'] == 'fuzzy':
+                # 返回列之后追加相似度列
+                lookup_results.append(pd.Series(np.round(scores, 3), index=main_df.index, dtype=object))
+                labels.append('相似度')
+            if chunk_number == 0 and len(main_df):
+                # 表头行写列名，不用表头行的匹配结果（区间、模糊匹配和汇总结果与表头无关）
+                lookup_results = [result.astype(object) for result in lookup_results]
+                for result, label in zip(lookup_results, labels):
+                    result.iloc[0] = label
+            chunk_results.extend(lookup_results)
+        
+        matched_mask = positions >= 0
+        stats['matched'] = int(matched_mask.sum())
+        
+        # 收集未匹配的值（每块最多 6 个，足够判断是否超过示例数量）
+        if not matched_mask.all():
+            unmatched_keys = main_key[~matched_mask]
+            if lookup_index.hashed:
+                # 哈希键不便阅读，示例显示各列的原值
+                unmatched_parts = main_parts[~matched_mask]
+                unmatched_keys = combine_keys([unmatched_parts[part] for part in unmatched_parts.columns])
+            stats['unmatched'] = list(unmatched_keys.unique()[:6])
+        chunk_stats.append(stats)
+    
+    # 所有查找完成后再追加结果列，避免影响后续查找读取主表列
+    width = len(main_df.columns)
+    for idx, result_series in enumerate(chunk_results):
+        main_df[width + idx] = result_series.fillna('')
+    
+    return main_df, chunk_stats
+
@@ -0,0 +1,218 @@
+import pandas as pd
+import os
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Iterator, List, Optional
+
+from functions.reader import list_sheets, read_excel, iter_excel_chunks
+from functions.columnar_store import columnar_store, project_columns
+from config import (
+    UPLOAD_FOLDER, WORKBOOK_CACHE_MAX_BYTES, WORKBOOK_SESSION_EXPIRY,
+    CHUNK_SIZE, MAX_ROWS, CHUNKED_PROCESSING, ERROR_MESSAGES
+)
+
+
+class RowLimitError(ValueError):
+    """数据行数超过上限：调用方不应跳过出错的工作表继续处理，而应停止整个操作"""
+
+
+class WorkbookCache:
+    """
+    工作簿会话缓存
+    上传的工作簿按内容哈希保存一次，哈希值作为 token 返回给前端；
+    解析后的工作表以 (token, 工作表, 表头行) 为键缓存在内存中，按字节预算做 LRU 淘汰
+    """
+
+    def __init__(self, upload_folder: str, max_bytes: int, expiry: int):
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+
+        self._lock = threading.Lock()
+        self._sessions = {}        # token -> {'path', 'filename', 'sheets', 'last_access'}
+        self._path_tokens = {}     # 绝对路径 -> token
+        self._frames = OrderedDict()  # (token, sheet, header) -> (DataFrame, 字节数)
+        self._cached_bytes = 0
+
+        os.makedirs(self.upload_folder, exist_ok=True)
+
+    def register(self, file) -> str:
+        """保存上传的文件并返回 token，相同内容的文件只保存一次"""
+        self.purge_expired()
+
+        ext = os.path.splitext(file.filename)[1].lower()
+        temp_path = os.path.join(self.upload_folder, f"upload_{uuid.uuid4().hex}{ext}")
+
+        # 边写入边计算哈希，避免把整个文件读入内存
+        hasher = hashlib.sha256()
+        with open(temp_path, 'wb') as f:
+            while True:
+                block = file.stream.read(1024 * 1024)
+                if not block:
+                    break
+                hasher.update(block)
+                f.write(block)
+
+        token = hasher.hexdigest()[:32]
+        path = os.path.abspath(os.path.join(self.upload_folder, f"workbook_{token}{ext}"))
+
+        with self._lock:
+            if token in self._sessions:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+                self._sessions[token] = {
+                    'path': path,
+                    'filename': file.filename,
+                    'sheets': None,
+                    'last_access': time.time()
+                }
+                self._path_tokens[path] = token
+            self._sessions[token]['last_access'] = time.time()
+
+        return token
+
+    def get_path(self, token: str) -> str:
+        """根据 token 获取工作簿文件路径"""
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None or not os.path.exists(session['path']):
+                raise ValueError("工作簿会话已过期，请重新上传文件")
+            session['last_access'] = time.time()
+            return session['path']
+
+    def get_filename(self, token: str) -> str:
+        """根据 token 获取上传时的原始文件名"""
+        self.get_path(token)
+        return self._sessions[token]['filename']
+
+    def get_token(self, file_path: str) -> Optional[str]:
+        """获取文件路径对应的 token，非会话文件返回 None"""
+        return self._path_tokens.get(os.path.abspath(file_path))
+
+    def is_session_file(self, file_path: str) -> bool:
+        """判断文件是否由会话缓存管理（此类文件不应被处理器清理）"""
+        return self.get_token(file_path) is not None
+
+    def get_sheets(self, token: str) -> List[str]:
+        """获取工作簿的工作表名称（每个会话只读取一次）"""
+        path = self.get_path(token)
+        session = self._sessions[token]
+        if session['sheets'] is None:
+            session['sheets'] = list_sheets(path)
+        return list(session['sheets'])
+
+    def read_sheet(self, file_path: str, sheet_name: str, header=0,
+                   usecols: Optional[List[int]] = None) -> pd.DataFrame:
+        """
+        读取工作表，依次尝试内存缓存、Arrow 列式文件，最后才解析 Excel
+        只有会话中的工作簿才转存为列式文件；没有会话的一次性上传直接解析 Excel（请求结束即删除，转存只会多一次写入）
+        返回的是缓存数据的副本，调用方可以自由修改
+        :param usecols: 只需要的列位置（从0开始），None 表示全部列；
+                        返回结果的 attrs['sheet_width'] 记录工作表的原始列数
+        """
+        token = self.get_token(file_path)
+        if token is not None:
+            key = (token, sheet_name, header)
+            with self._lock:
+                entry = self._frames.get(key)
+                if entry is not None:
+                    self._frames.move_to_end(key)
+                    self._sessions[token]['last_access'] = time.time()
+                    return project_columns(entry[0], usecols)
+
+        if token is not None and columnar_store.enabled:
+            # 只需要部分列时直接从列式文件读取，不必物化整个工作表
+            if usecols is not None:
+                return columnar_store.read(file_path, sheet_name, header, usecols, file_hash=token)
+            df = columnar_store.read(file_path, sheet_name, header, file_hash=token)
+        else:
+            df = read_excel(file_path, sheet_name=sheet_name, header=header)
+            df.attrs['sheet_width'] = len(df.columns)
+
+        if token is None:
+            return df if usecols is None else project_columns(df, usecols)
+
+        self._store(key, df)
+        return project_columns(df, usecols)
+
+    def iter_chunks(self, file_path: str, sheet_name: str, header=0,
+                    chunk_size: int = CHUNK_SIZE, max_rows: int = MAX_ROWS) -> Iterator[pd.DataFrame]:
+        """
+        分块读取工作表，每块都是独立的副本，调用方可以自由修改
+        已缓存的工作表直接切片；否则按 CHUNKED_PROCESSING 流式读取 Excel 或整表读取
+        行数超过 max_rows 时，在读到超出的那一块时立即报错，不会先读完整张表
+        """
+        token = self.get_token(file_path)
+        with self._lock:
+            entry = self._frames.get((token, sheet_name, header)) if token is not None else None
+
+        if entry is not None:
+            chunks = self._slice_frame(entry[0], chunk_size)
+        else:
+            store_path = None
+            if token is not None:
+                store_path = columnar_store.stored_path(file_path, sheet_name, header, file_hash=token)
+            if store_path is not None:
+                chunks = columnar_store.iter_frames(store_path, chunk_size)
+            elif CHUNKED_PROCESSING:
+                chunks = iter_excel_chunks(file_path, sheet_name, header, chunk_size)
+            else:
+                chunks = iter([self.read_sheet(file_path, sheet_name, header)])
+
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            if max_rows and rows > max_rows:
+                raise RowLimitError(ERROR_MESSAGES['too_many_rows'].format(max_rows=max_rows))
+            yield chunk
+
+    @staticmethod
+    def _slice_frame(df: pd.DataFrame, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """按行切片，每块复制一份"""
+        width = len(df.columns)
+        for start in range(0, max(len(df), 1), chunk_size):
+            chunk = df.iloc[start:start + chunk_size].copy()
+            chunk.attrs['sheet_width'] = width
+            yield chunk
+
+    def _store(self, key, df: pd.DataFrame):
+        """放入缓存并按字节预算淘汰最久未使用的工作表"""
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._frames:
+                return
+            self._frames[key] = (df, nbytes)
+            self._cached_bytes += nbytes
+            while self._cached_bytes > self.max_bytes and self._frames:
+                _, (_, evicted_bytes) = self._frames.popitem(last=False)
+                self._cached_bytes -= evicted_bytes
+
+    def purge_expired(self):
+        """清理过期的会话文件及其缓存（包括转存的列式文件）"""
+        now = time.time()
+        with self._lock:
+            expired = [token for token, session in self._sessions.items()
+                       if now - session['last_access'] > self.expiry]
+            for token in expired:
+                session = self._sessions.pop(token)
+                self._path_tokens.pop(session['path'], None)
+                for key in [k for k in self._frames if k[0] == token]:
+                    _, nbytes = self._frames.pop(key)
+                    self._cached_bytes -= nbytes
+                try:
+                    if os.path.exists(session['path']):
+                        os.remove(session['path'])
+                except Exception as e:
+                    print(f"清理会话文件失败: {str(e)}")
+                columnar_store.remove(token)
+
+
+# 全局共享的工作簿缓存
+workbook_cache = WorkbookCache(UPLOAD_FOLDER, WORKBOOK_CACHE_MAX_BYTES, WORKBOOK_SESSION_EXPIRY)
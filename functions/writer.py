@@ -0,0 +1,321 @@
+import pandas as pd
+import numpy as np
+from itertools import islice
+from typing import Iterable, List, Optional, Sequence
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+
+try:
+    import xlsxwriter
+except ImportError:  # xlsxwriter 为可选依赖，未安装时带样式的结果用 openpyxl 只写模式输出
+    xlsxwriter = None
+
+from config import CHUNK_SIZE, AUTOFIT_SAMPLE_ROWS, STYLED_WRITER_ENGINE
+
+# 表头样式与 pandas to_excel 默认样式一致
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+# 带样式的表格（透视表）各类单元格共用的样式
+THIN_BORDER = HEADER_BORDER
+BOLD_FONT = Font(bold=True)
+TABLE_HEADER_ALIGNMENT = Alignment(horizontal='center')
+LABEL_ALIGNMENT = Alignment(horizontal='left', vertical='center')
+VALUE_ALIGNMENT = Alignment(horizontal='right')
+
+MAX_COLUMN_WIDTH = 50  # 自动列宽的上限
+
+
+def autofit_widths(df: pd.DataFrame, header: bool = True, sample_rows: int = AUTOFIT_SAMPLE_ROWS,
+                   max_width: Optional[int] = MAX_COLUMN_WIDTH) -> List[int]:
+    """
+    按字符数计算各列宽度（最长值 + 2）
+    行数超过 sample_rows 时在全表范围内等距采样，每列用向量化的 str.len() 计算
+    :param max_width: 列宽上限，None 表示不限制
+    """
+    if len(df) > sample_rows:
+        df = df.iloc[np.linspace(0, len(df) - 1, sample_rows).astype(int)]
+
+    widths = []
+    for pos in range(len(df.columns)):
+        values = df.iloc[:, pos].dropna()
+        length = int(values.astype(str).str.len().max()) if len(values) else 0
+        if header:
+            length = max(length, len(str(df.columns[pos])))
+        width = length + 2
+        widths.append(width if max_width is None else min(width, max_width))
+    return widths
+
+
+def set_column_widths(worksheet, widths: List[int]):
+    """设置列宽，列号超过 Z 时同样适用"""
+    for idx, width in enumerate(widths):
+        worksheet.column_dimensions[get_column_letter(idx + 1)].width = width
+
+
+def frame_rows(df: pd.DataFrame, chunk_size: int = CHUNK_SIZE):
+    """
+    按块把 DataFrame 转换为行（空值转为 None），每次只转换 chunk_size 行
+    """
+    for start in range(0, len(df), chunk_size):
+        block = df.iloc[start:start + chunk_size].astype(object)
+        block = block.where(block.notna(), None)
+        yield from block.itertuples(index=False, name=None)
+
+
+class SheetWriter:
+    """
+    流式写入单个工作表
+    行写出后即释放，不保留单元格对象；列宽在写入第一批数据时确定
+    （write-only 模式下列宽必须在写入数据之前设置）
+    """
+
+    def __init__(self, worksheet, header: bool = True, autofit: bool = True,
+                 max_width: int = MAX_COLUMN_WIDTH):
+        self.worksheet = worksheet
+        self.header = header
+        self.autofit = autofit
+        self.max_width = max_width
+        self.columns = None
+        self.rows_written = 0
+        self._started = False
+
+    def write_frame(self, df: pd.DataFrame):
+        """写入一个 DataFrame 块，第一次写入时根据该块的采样行计算列宽并写出表头"""
+        if not self._started:
+            widths = autofit_widths(df, header=self.header, max_width=self.max_width) if self.autofit else None
+            self._start(list(df.columns), widths)
+        for row in frame_rows(df):
+            self._append(row)
+
+    def write_rows(self, rows: Iterable[Sequence], columns: Optional[List] = None):
+        """
+        写入行迭代器
+        :param columns: 表头，只在第一次写入时使用
+        """
+        rows = iter(rows)
+        if not self._started:
+            # 先缓存第一批数据，边读边统计列宽，再连同表头一起写出
+            first_block = list(islice(rows, AUTOFIT_SAMPLE_ROWS))
+            widths = self._measure(columns, first_block) if self.autofit else None
+            self._start(columns, widths)
+            for row in first_block:
+                self._append(row)
+
+        for row in rows:
+            self._append(row)
+
+    def _start(self, columns: Optional[List], widths: Optional[List[int]]):
+        self._started = True
+        self.columns = list(columns) if columns is not None else None
+
+        if widths:
+            set_column_widths(self.worksheet, widths)
+
+        if self.header and self.columns is not None:
+            cells = []
+            for value in self.columns:
+                cell = WriteOnlyCell(self.worksheet, value=value)
+                cell.font = HEADER_FONT
+                cell.border = HEADER_BORDER
+                cell.alignment = HEADER_ALIGNMENT
+                cells.append(cell)
+            self.worksheet.append(cells)
+
+    def _measure(self, columns: Optional[List], sample_rows: List[Sequence]) -> List[int]:
+        """按表头和缓存行逐行累计每列的最大字符数"""
+        lengths = []
+        if self.header and columns is not None:
+            lengths = [len(str(value)) for value in columns]
+        for row in sample_rows:
+            for idx, value in enumerate(row):
+                length = len(str(value)) if value is not None else 0
+                if idx >= len(lengths):
+                    lengths.append(length)
+                elif length > lengths[idx]:
+                    lengths[idx] = length
+        return [min(length + 2, self.max_width) for length in lengths]
+
+    def _append(self, row: Sequence):
+        self.worksheet.append(list(row))
+        self.rows_written += 1
+
+
+class StreamingWriter:
+    """
+    基于 openpyxl write-only 模式的 xlsx 输出
+    内存占用只与当前写入的数据块有关，与输出文件的总行数无关
+
+    用法：
+        with StreamingWriter(path) as writer:
+            sheet = writer.add_sheet('Sheet1')
+            for chunk in chunks:
+                sheet.write_frame(chunk)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {}
+
+    def add_sheet(self, title: str, header: bool = True, autofit: bool = True) -> SheetWriter:
+        """新建工作表，标题重复时由 openpyxl 自动加序号"""
+        worksheet = self.workbook.create_sheet(title=title)
+        sheet = SheetWriter(worksheet, header=header, autofit=autofit)
+        self.sheets[worksheet.title] = sheet
+        return sheet
+
+    def close(self):
+        """保存文件；没有任何工作表时写入一个空表，保证生成合法的 xlsx"""
+        if not self.sheets:
+            self.workbook.create_sheet(title='Sheet1')
+        self.workbook.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        return False
+
+
+def save_frame(path: str, df: pd.DataFrame, sheet_name: str = 'Sheet1',
+               header: bool = True, autofit: bool = True):
+    """把单个 DataFrame 流式写入 xlsx 文件"""
+    with StreamingWriter(path) as writer:
+        writer.add_sheet(sheet_name, header=header, autofit=autofit).write_frame(df)
+
+
+def merge_ranges(labels: pd.DataFrame, breaks: Optional[np.ndarray] = None) -> List[tuple]:
+    """
+    用游程检测找出标签列中需要合并的单元格，返回 [(列位置, 起始行, 结束行)]（行位置从 0 开始，包含结束行）
+    某列的值变化、或者外层标签列的值变化时开始新的一段；breaks 为 True 的行（小计、总计）不参与合并
+    """
+    rows = len(labels)
+    if rows < 2:
+        return []
+    breaks = np.zeros(rows, dtype=bool) if breaks is None else np.asarray(breaks, dtype=bool)
+    values = labels.to_numpy(dtype=object)
+
+    ranges = []
+    boundary = breaks.copy()
+    boundary[0] = True
+    for col in range(values.shape[1]):
+        column = values[:, col]
+        changed = np.ones(rows, dtype=bool)
+        changed[1:] = column[1:] != column[:-1]
+        boundary |= changed
+        # breaks 行及其下一行都从新的一段开始；只合并长度大于 1 且不是 breaks 的段
+        starts = np.flatnonzero(boundary | np.r_[False, breaks[:-1]])
+        ends = np.r_[starts[1:], rows] - 1
+        keep = (ends > starts) & ~breaks[starts]
+        ranges.extend((col, int(start), int(end)) for start, end in zip(starts[keep], ends[keep]))
+    return ranges
+
+
+def styled_writer_engine(engine: Optional[str] = None) -> str:
+    """带样式结果的写出引擎：优先按配置，xlsxwriter 未安装时使用 openpyxl"""
+    preferred = engine or STYLED_WRITER_ENGINE
+    if preferred not in ('auto', 'xlsxwriter', 'openpyxl'):
+        raise ValueError(f"未知的 Excel 写出引擎: {preferred}")
+    if preferred in ('auto', 'xlsxwriter') and xlsxwriter is not None:
+        return 'xlsxwriter'
+    return 'openpyxl'
+
+
+def save_styled_table(path: str, df: pd.DataFrame, label_cols: int, emphasis: Optional[np.ndarray] = None,
+                      sheet_name: str = 'Sheet1', engine: Optional[str] = None):
+    """
+    写出带样式的表格（透视表）：表头加粗居中，标签列左对齐，值列右对齐，所有单元格细边框，
+    emphasis 为 True 的行（小计、总计）加粗；标签列中相同的值合并单元格（见 merge_ranges）
+    样式对象只创建一次，按行套用；列宽按采样行计算
+    :param label_cols: 前几列是标签列
+    """
+    emphasis = np.zeros(len(df), dtype=bool) if emphasis is None else np.asarray(emphasis, dtype=bool)
+    ranges = merge_ranges(df.iloc[:, :label_cols], emphasis)
+    widths = autofit_widths(df, max_width=None)
+    if styled_writer_engine(engine) == 'xlsxwriter':
+        _save_styled_xlsxwriter(path, df, label_cols, emphasis, ranges, widths, sheet_name)
+    else:
+        _save_styled_openpyxl(path, df, label_cols, emphasis, ranges, widths, sheet_name)
+
+
+def _save_styled_openpyxl(path, df, label_cols, emphasis, ranges, widths, sheet_name):
+    """openpyxl 只写模式：每种行样式每列一个单元格模板，逐行只替换值"""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_name)
+    set_column_widths(worksheet, widths)
+    # 合并区域互不重叠，直接整体设置（逐个 add 时每次都要检查已有区域）
+    worksheet.merged_cells = MultiCellRange([
+        CellRange(min_col=col + 1, min_row=start + 2, max_col=col + 1, max_row=end + 2)
+        for col, start, end in ranges
+    ])
+
+    def template(bold: bool, alignment: Alignment) -> WriteOnlyCell:
+        cell = WriteOnlyCell(worksheet)
+        cell.border = THIN_BORDER
+        cell.alignment = alignment
+        if bold:
+            cell.font = BOLD_FONT
+        return cell
+
+    header = [template(True, TABLE_HEADER_ALIGNMENT) for _ in df.columns]
+    for cell, value in zip(header, df.columns):
+        cell.value = value
+    worksheet.append(header)
+
+    # 行写出时单元格立即被序列化，同一列的模板可以在各行之间复用
+    templates = {
+        bold: [template(bold, LABEL_ALIGNMENT if pos < label_cols else VALUE_ALIGNMENT)
+               for pos in range(len(df.columns))]
+        for bold in (False, True)
+    }
+    for row, bold in zip(frame_rows(df), emphasis.tolist()):
+        cells = templates[bold]
+        for cell, value in zip(cells, row):
+            cell.value = value
+        worksheet.append(cells)
+
+    workbook.save(path)
+
+
+def _save_styled_xlsxwriter(path, df, label_cols, emphasis, ranges, widths, sheet_name):
+    """xlsxwriter：整列按格式写出，加粗的行覆盖写一次，合并区域按范围写出"""
+    workbook = xlsxwriter.Workbook(path)
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        formats = {}
+        for bold in (False, True):
+            formats[bold, 'label'] = workbook.add_format({'border': 1, 'bold': bold, 'align': 'left',
+                                                          'valign': 'vcenter'})
+            formats[bold, 'value'] = workbook.add_format({'border': 1, 'bold': bold, 'align': 'right'})
+        header_format = workbook.add_format({'border': 1, 'bold': True, 'align': 'center'})
+
+        for pos, width in enumerate(widths):
+            worksheet.set_column(pos, pos, width)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+
+        block = df.astype(object)
+        block = block.where(block.notna(), None)
+        for pos in range(len(df.columns)):
+            kind = 'label' if pos < label_cols else 'value'
+            worksheet.write_column(1, pos, block.iloc[:, pos].tolist(), formats[False, kind])
+        for row in np.flatnonzero(emphasis).tolist():
+            for pos, value in enumerate(block.iloc[row].tolist()):
+                worksheet.write(row + 1, pos, value, formats[True, 'label' if pos < label_cols else 'value'])
+        for col, start, end in ranges:
+            worksheet.merge_range(start + 1, col, end + 1, col, block.iat[start, col], formats[False, 'label'])
+    finally:
+        workbook.close()
+
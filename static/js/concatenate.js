@@ -1,18 +1,25 @@
+// 已上传工作簿的 token，选择工作表和处理时不再重复上传文件
+let concatenateWorkbookToken = null;
+// 最近一次处理结果的 ID，下载时使用
+let concatenateResultId = null;
+
 async function handleConcatenateFileUpload() {
     resetError('concatenateStatus');
     const file = document.getElementById('concatenateFile').files[0];
+    concatenateWorkbookToken = null;
     if (file) {
         const formData = new FormData();
         formData.append('file', file);
         
         try {
-            const response = await fetch('/api/get-sheets', {
+            const response = await fetch('/api/upload-workbook', {
                 method: 'POST',
                 body: formData
             });
             const data = await response.json();
             
             if (data.success) {
+                concatenateWorkbookToken = data.token;
                 const select = document.getElementById('concatenateSheet');
                 select.innerHTML = '<option value="">请选择工作表</option>' + 
                     data.sheets.map(sheet => `<option value="${sheet}">${sheet}</option>`).join('');
@@ -31,12 +38,11 @@ let concatenateColumns = null;
 
 async function handleConcatenateSheetChange() {
     resetError('concatenateStatus');
-    const file = document.getElementById('concatenateFile').files[0];
     const sheet = document.getElementById('concatenateSheet').value;
     
-    if (file && sheet) {
+    if (concatenateWorkbookToken && sheet) {
         const formData = new FormData();
-        formData.append('file', file);
+        formData.append('token', concatenateWorkbookToken);
         formData.append('sheet', sheet);
         formData.append('concatenateFile', 'true');
         
@@ -162,7 +168,7 @@ async function processConcatenate() {
         };
     }).filter(data => data.column);
     
-    if (!file || !sheet) {
+    if (!file || !concatenateWorkbookToken || !sheet) {
         showError('请选择文件和工作表', 'concatenateStatus');
         return;
     }
@@ -173,7 +179,7 @@ async function processConcatenate() {
     }
 
     const formData = new FormData();
-    formData.append('file', file);
+    formData.append('token', concatenateWorkbookToken);
     formData.append('sheet', sheet);
     formData.append('columnsData', JSON.stringify(columnsData));
 
@@ -189,6 +195,7 @@ async function processConcatenate() {
         
         if (data.success) {
             status.textContent = '处理完成！';
+            concatenateResultId = data.resultId;
             document.getElementById('concatenateDownloadBtn').disabled = false;
         } else {
             showError(data.error || '处理失败', 'concatenateStatus');
@@ -199,7 +206,9 @@ async function processConcatenate() {
 }
 
 function downloadConcatenateResult() {
-    window.location.href = '/api/download-result';
+    if (concatenateResultId) {
+        window.location.href = `/api/download-result?id=${concatenateResultId}`;
+    }
 }
 
 function showError(message, statusId) {
@@ -238,11 +238,9 @@ async function mergeFiles() {
     formData.append('filename', filename);
 
     try {
-        const response = await fetch('/api/merge-excel', {
-            method: 'POST',
-            body: formData
+        const data = await runJob('/api/merge-excel', formData, (progress, message) => {
+            status.textContent = `正在处理... ${message}（${progress}%）`;
         });
-        const data = await response.json();
 
         if (data.success) {
             status.textContent = '处理完成！';
@@ -401,15 +401,15 @@ window.handleImportData = async function() {
         }
 
         console.log('发送导入请求...');
-        const response = await fetch('/api/import-data', {
-            method: 'POST',
-            body: formData
+        const result = await runJob('/api/import-data', formData, (progress, message) => {
+            const loadingMessage = document.querySelector('#loading-overlay .loading-message');
+            if (loadingMessage) {
+                loadingMessage.textContent = `正在导入数据... ${message}`;
+            }
         });
-
-        const result = await response.json();
         console.log('导入响应:', result);
 
-        if (!response.ok) {
+        if (!result.success) {
             throw new Error(result.error || '导入失败');
         }
 
@@ -0,0 +1,45 @@
+// 后台任务：提交后轮询任务状态，完成后返回与同步接口相同的结果
+
+const JOB_POLL_INTERVAL = 1000;  // 轮询间隔（毫秒）
+
+/**
+ * 以后台任务方式调用处理接口
+ * @param {string} url 处理接口地址
+ * @param {FormData} formData 请求参数
+ * @param {function} onProgress 可选，进度回调 (progress, message)
+ * @returns {Promise<object>} 任务结果（与同步调用接口时的返回内容相同）
+ */
+async function runJob(url, formData, onProgress) {
+    formData.append('async', 'true');
+
+    const response = await fetch(url, {
+        method: 'POST',
+        body: formData
+    });
+    const data = await response.json();
+
+    // 接口直接返回了结果（参数错误等情况）
+    if (!data.jobId) {
+        return data;
+    }
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+
+        const statusResponse = await fetch(`/api/jobs/${data.jobId}`);
+        const status = await statusResponse.json();
+        if (!status.success) {
+            return status;
+        }
+
+        const job = status.job;
+        if (onProgress) {
+            onProgress(job.progress, job.message);
+        }
+
+        if (job.status === 'finished' || job.status === 'failed') {
+            const resultResponse = await fetch(`/api/jobs/${data.jobId}/result`);
+            return await resultResponse.json();
+        }
+    }
+}
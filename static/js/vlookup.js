@@ -1,22 +1,121 @@
+// 已上传工作簿的 token，选择工作表和处理时不再重复上传文件
+let mainWorkbookToken = null;
+let lookupWorkbookToken = null;
+// 最近一次处理结果的 ID，下载时使用
+let vlookupResultId = null;
+// 已注册的常用查找表
+let registeredLookupTables = [];
+
+document.addEventListener('DOMContentLoaded', loadRegisteredLookups);
+
+async function loadRegisteredLookups() {
+    try {
+        const response = await fetch('/api/lookup-tables');
+        const data = await response.json();
+        if (!data.success) {
+            return;
+        }
+        
+        registeredLookupTables = data.tables;
+        const select = document.getElementById('registeredLookup');
+        const current = select.value;
+        select.innerHTML = '<option value="">不使用常用查找表（上传文件）</option>';
+        data.tables.forEach(table => {
+            const option = document.createElement('option');
+            option.value = table.name;
+            option.textContent = `${table.name}（${table.sourceName}，${table.rows} 行，返回 ${table.returnHeaders.join('、')}）`;
+            select.appendChild(option);
+        });
+        if (data.tables.some(table => table.name === current)) {
+            select.value = current;
+        }
+        handleRegisteredLookupChange();
+    } catch (error) {
+        console.error('加载常用查找表失败:', error);
+    }
+}
+
+function handleRegisteredLookupChange() {
+    // 使用常用查找表时不需要上传和配置查找表
+    const useRegistered = !!document.getElementById('registeredLookup').value;
+    document.getElementById('lookupFile').style.display = useRegistered ? 'none' : '';
+    document.getElementById('lookupFileConfig').style.display =
+        !useRegistered && lookupWorkbookToken ? 'block' : 'none';
+}
+
+async function registerLookupTable() {
+    resetError('status');
+    const lookupSheet = document.getElementById('lookupSheet').value;
+    if (!lookupWorkbookToken || !lookupSheet) {
+        showError('请先上传查找表并选择工作表');
+        return;
+    }
+    
+    const lookupMatchType = document.querySelector('input[name="lookupMatchType"]:checked').value;
+    const matchColumns = lookupMatchType === 'single'
+        ? [document.getElementById('lookupMatchValue').value].filter(value => value)
+        : Array.from(document.querySelectorAll('#lookupMatchColumns select')).map(select => select.value).filter(value => value);
+    const returnType = document.querySelector('input[name="returnType"]:checked').value;
+    const returnColumns = returnType === 'single'
+        ? [document.getElementById('lookupReturnValue').value].filter(value => value)
+        : Array.from(document.querySelectorAll('#returnColumns select')).map(select => select.value).filter(value => value);
+    if (matchColumns.length === 0 || returnColumns.length === 0) {
+        showError('请先选择查找表的匹配列和返回列');
+        return;
+    }
+    
+    const name = prompt('请输入常用查找表名称（同名查找表会被替换）');
+    if (!name) {
+        return;
+    }
+    
+    const formData = new FormData();
+    formData.append('name', name);
+    formData.append('token', lookupWorkbookToken);
+    formData.append('sheet', lookupSheet);
+    formData.append('matchColumns', JSON.stringify(matchColumns));
+    formData.append('returnColumns', JSON.stringify(returnColumns));
+    
+    try {
+        const response = await fetch('/api/lookup-tables', {
+            method: 'POST',
+            body: formData
+        });
+        const data = await response.json();
+        if (data.success) {
+            const status = document.getElementById('status');
+            status.textContent = `已保存常用查找表：${data.table.name}（${data.table.rows} 行）`;
+            status.className = 'status-message status-success';
+            await loadRegisteredLookups();
+        } else {
+            showError(data.error || '保存常用查找表失败');
+        }
+    } catch (error) {
+        showError('保存常用查找表时发生错误: ' + error.message);
+    }
+}
+
 async function handleMainFileUpload() {
     resetError('status');
     const file = document.getElementById('mainFile').files[0];
     
     // 无论是否选择了文件，都重置主表相关的选择
     resetMainTableSelections();
+    mainWorkbookToken = null;
     
     if (file) {
         const formData = new FormData();
         formData.append('file', file);
         
         try {
-            const response = await fetch('/api/get-sheets', {
+            const response = await fetch('/api/upload-workbook', {
                 method: 'POST',
                 body: formData
             });
             const data = await response.json();
             
             if (data.success) {
+                mainWorkbookToken = data.token;
                 const select = document.getElementById('mainSheet');
                 select.innerHTML = '<option value="">请选择工作表</option>' + 
                     data.sheets.map(sheet => `<option value="${sheet}">${sheet}</option>`).join('');
@@ -35,12 +134,11 @@ async function handleMainFileUpload() {
 
 async function handleMainSheetChange() {
     resetError('status');
-    const file = document.getElementById('mainFile').files[0];
     const sheet = document.getElementById('mainSheet').value;
     
-    if (file && sheet) {
+    if (mainWorkbookToken && sheet) {
         const formData = new FormData();
-        formData.append('file', file);
+        formData.append('token', mainWorkbookToken);
         formData.append('sheet', sheet);
         
         try {
@@ -68,19 +166,21 @@ async function handleLookupFileUpload() {
     
     // 无论是否选择了文件，都重置查找表相关的选择
     resetLookupTableSelections();
+    lookupWorkbookToken = null;
     
     if (file) {
         const formData = new FormData();
         formData.append('file', file);
         
         try {
-            const response = await fetch('/api/get-sheets', {
+            const response = await fetch('/api/upload-workbook', {
                 method: 'POST',
                 body: formData
             });
             const data = await response.json();
             
             if (data.success) {
+                lookupWorkbookToken = data.token;
                 const select = document.getElementById('lookupSheet');
                 select.innerHTML = '<option value="">请选择工作表</option>' + 
                     data.sheets.map(sheet => `<option value="${sheet}">${sheet}</option>`).join('');
@@ -99,12 +199,11 @@ async function handleLookupFileUpload() {
 
 async function handleLookupSheetChange() {
     resetError('status');
-    const file = document.getElementById('lookupFile').files[0];
     const sheet = document.getElementById('lookupSheet').value;
     
-    if (file && sheet) {
+    if (lookupWorkbookToken && sheet) {
         const formData = new FormData();
-        formData.append('file', file);
+        formData.append('token', lookupWorkbookToken);
         formData.append('sheet', sheet);
         
         try {
@@ -313,21 +412,26 @@ function addReturnColumn() {
     columnList.appendChild(columnItem);
 }
 
-function processFiles() {
+/**
+ * 读取并验证当前页面上的查找配置
+ * @returns {object|null} 查找配置（字段与 /api/vlookup 的参数一致），验证失败时返回 null
+ */
+function collectLookupConfig() {
     // 验证文件和工作表选择
     const mainFile = document.getElementById('mainFile').files[0];
     const mainSheet = document.getElementById('mainSheet').value;
     const lookupFile = document.getElementById('lookupFile').files[0];
     const lookupSheet = document.getElementById('lookupSheet').value;
     
-    if (!mainFile || !mainSheet) {
+    if (!mainFile || !mainWorkbookToken || !mainSheet) {
         showError('请选择主数据表文件并选择工作表');
-        return;
+        return null;
     }
     
-    if (!lookupFile || !lookupSheet) {
+    const lookupTable = document.getElementById('registeredLookup').value;
+    if (!lookupTable && (!lookupFile || !lookupWorkbookToken || !lookupSheet)) {
         showError('请选择查找数据表文件并选择工作表');
-        return;
+        return null;
     }
     
     const mainMatchType = document.querySelector('input[name="mainMatchType"]:checked').value;
@@ -340,7 +444,7 @@ function processFiles() {
         const mainColumn = document.getElementById('mainLookupValue').value;
         if (!mainColumn) {
             showError('请选择主表的匹配列');
-            return;
+            return null;
         }
         mainColumns.push(mainColumn);
     } else {
@@ -349,83 +453,201 @@ function processFiles() {
             .filter(value => value);
         if (mainColumns.length === 0) {
             showError('请至少选择一个主表匹配列');
-            return;
+            return null;
         }
     }
     
-    // 获取查找表匹配列
     let lookupMatchColumns = [];
-    if (lookupMatchType === 'single') {
-        const lookupColumn = document.getElementById('lookupMatchValue').value;
-        if (!lookupColumn) {
-            showError('请选择查找表的匹配列');
-            return;
+    let returnColumns = [];
+    if (lookupTable) {
+        // 常用查找表的匹配列和返回列以注册时的配置为准
+        const table = registeredLookupTables.find(item => item.name === lookupTable);
+        if (!table) {
+            showError('常用查找表不存在，请刷新页面后重试');
+            return null;
         }
-        lookupMatchColumns.push(lookupColumn);
+        lookupMatchColumns = table.matchColumns;
+        returnColumns = table.returnColumns;
     } else {
-        lookupMatchColumns = Array.from(document.querySelectorAll('#lookupMatchColumns select'))
-            .map(select => select.value)
-            .filter(value => value);
-        if (lookupMatchColumns.length === 0) {
-            showError('请至少选择一个查找表匹配列');
-            return;
+        // 获取查找表匹配列
+        if (lookupMatchType === 'single') {
+            const lookupColumn = document.getElementById('lookupMatchValue').value;
+            if (!lookupColumn) {
+                showError('请选择查找表的匹配列');
+                return null;
+            }
+            lookupMatchColumns.push(lookupColumn);
+        } else {
+            lookupMatchColumns = Array.from(document.querySelectorAll('#lookupMatchColumns select'))
+                .map(select => select.value)
+                .filter(value => value);
+            if (lookupMatchColumns.length === 0) {
+                showError('请至少选择一个查找表匹配列');
+                return null;
+            }
         }
-    }
     
-    // 获取返回列
-    let returnColumns = [];
-    if (returnType === 'single') {
-        const returnColumn = document.getElementById('lookupReturnValue').value;
-        if (!returnColumn) {
-            showError('请选择返回列');
-            return;
-        }
-        returnColumns.push(returnColumn);
-    } else {
-        returnColumns = Array.from(document.querySelectorAll('#returnColumns select'))
-            .map(select => select.value)
-            .filter(value => value);
-        if (returnColumns.length === 0) {
-            showError('请至少选择一个返回列');
-            return;
+        // 获取返回列
+        if (returnType === 'single') {
+            const returnColumn = document.getElementById('lookupReturnValue').value;
+            if (!returnColumn) {
+                showError('请选择返回列');
+                return null;
+            }
+            returnColumns.push(returnColumn);
+        } else {
+            returnColumns = Array.from(document.querySelectorAll('#returnColumns select'))
+                .map(select => select.value)
+                .filter(value => value);
+            if (returnColumns.length === 0) {
+                showError('请至少选择一个返回列');
+                return null;
+            }
         }
+    
     }
     
     // 验证匹配列数
     if (mainMatchType === 'multiple' && mainColumns.length !== lookupMatchColumns.length) {
         showError('主表和查找表的匹配列数必须相同');
-        return;
+        return null;
+    }
+    
+    const matchMode = document.getElementById('matchMode').value;
+    if (matchMode !== 'exact' && (mainColumns.length !== 1 || lookupMatchColumns.length !== 1)) {
+        showError('区间匹配和模糊匹配只支持单列匹配');
+        return null;
+    }
+    
+    const duplicatePolicy = document.getElementById('duplicatePolicy').value;
+    if (matchMode !== 'exact' && ['all', 'count', 'sum', 'join'].includes(duplicatePolicy)) {
+        showError('全部匹配、匹配数、求和、连接只支持精确匹配');
+        return null;
     }
     
     // 验证重复列
     if (new Set(mainColumns).size !== mainColumns.length) {
         showError('主表存在重复的匹配列，请检查');
-        return;
+        return null;
     }
     
     if (new Set(lookupMatchColumns).size !== lookupMatchColumns.length) {
         showError('查找表存在重复的匹配列，请检查');
-        return;
+        return null;
     }
     
     if (new Set(returnColumns).size !== returnColumns.length) {
         showError('返回列存在重复选择，请检查');
+        return null;
+    }
+    
+    return {
+        mainSheet: mainSheet,
+        mainMatchType: mainMatchType,
+        mainColumns: mainColumns,
+        lookupTable: lookupTable,
+        lookupToken: lookupTable ? '' : lookupWorkbookToken,
+        lookupSheet: lookupTable ? '' : lookupSheet,
+        lookupMatchType: lookupMatchType,
+        lookupMatchColumns: lookupMatchColumns,
+        returnType: returnType,
+        returnColumns: returnColumns,
+        duplicatePolicy: duplicatePolicy,
+        matchMode: matchMode,
+        label: lookupTable
+            ? `常用查找表 ${lookupTable}`
+            : `${lookupFile.name} / ${lookupSheet}：${lookupMatchColumns.join('+')} → ${returnColumns.join('、')}`
+    };
+}
+
+// 批量查找：同一主表依次匹配多个查找表，主表只读取一次，结果写入同一个文件
+let batchLookups = [];
+let batchMainSheet = null;
+
+function addToBatch() {
+    resetError('status');
+    const config = collectLookupConfig();
+    if (!config) {
+        return;
+    }
+    if (batchLookups.length > 0 && config.mainSheet !== batchMainSheet) {
+        showError('批量查找只能使用同一个主表工作表，请先清空批量列表');
         return;
     }
     
-    // 所有验证通过，开始处理
+    batchMainSheet = config.mainSheet;
+    batchLookups.push(config);
+    renderBatchLookups();
+}
+
+function clearBatch() {
+    batchLookups = [];
+    batchMainSheet = null;
+    renderBatchLookups();
+}
+
+function renderBatchLookups() {
+    const section = document.getElementById('batchLookupSection');
+    const list = document.getElementById('batchLookupList');
+    list.innerHTML = '';
+    batchLookups.forEach((config, index) => {
+        const item = document.createElement('div');
+        item.className = 'batch-lookup-item';
+        
+        const label = document.createElement('span');
+        label.textContent = `${index + 1}. 主表 ${config.mainColumns.join('+')} 匹配 ${config.label}`;
+        
+        const removeBtn = document.createElement('button');
+        removeBtn.className = 'remove-column-btn';
+        removeBtn.textContent = '删除';
+        removeBtn.onclick = function() {
+            batchLookups.splice(index, 1);
+            renderBatchLookups();
+        };
+        
+        item.appendChild(label);
+        item.appendChild(removeBtn);
+        list.appendChild(item);
+    });
+    section.style.display = batchLookups.length > 0 ? 'block' : 'none';
+}
+
+function processFiles() {
+    resetError('status');
     const formData = new FormData();
-    formData.append('mainFile', mainFile);
-    formData.append('mainSheet', mainSheet);
-    formData.append('mainMatchType', mainMatchType);
-    formData.append('mainColumns', JSON.stringify(mainColumns));
-    
-    formData.append('lookupFile', lookupFile);
-    formData.append('lookupSheet', lookupSheet);
-    formData.append('lookupMatchType', lookupMatchType);
-    formData.append('lookupMatchColumns', JSON.stringify(lookupMatchColumns));
-    formData.append('returnType', returnType);
-    formData.append('returnColumns', JSON.stringify(returnColumns));
+    formData.append('mainToken', mainWorkbookToken);
+    
+    if (batchLookups.length > 0) {
+        // 批量列表中的查找依次执行，结果列按列表顺序追加
+        if (!mainWorkbookToken) {
+            showError('请选择主数据表文件并选择工作表');
+            return;
+        }
+        formData.append('mainSheet', batchMainSheet);
+        formData.append('lookups', JSON.stringify(batchLookups.map(({ label, mainSheet, ...spec }) => spec)));
+    } else {
+        const config = collectLookupConfig();
+        if (!config) {
+            return;
+        }
+        
+        formData.append('mainSheet', config.mainSheet);
+        formData.append('mainMatchType', config.mainMatchType);
+        formData.append('mainColumns', JSON.stringify(config.mainColumns));
+        
+        if (config.lookupTable) {
+            formData.append('lookupTable', config.lookupTable);
+        } else {
+            formData.append('lookupToken', config.lookupToken);
+            formData.append('lookupSheet', config.lookupSheet);
+            formData.append('lookupMatchType', config.lookupMatchType);
+            formData.append('lookupMatchColumns', JSON.stringify(config.lookupMatchColumns));
+            formData.append('returnType', config.returnType);
+            formData.append('returnColumns', JSON.stringify(config.returnColumns));
+        }
+        formData.append('duplicatePolicy', config.duplicatePolicy);
+        formData.append('matchMode', config.matchMode);
+    }
     
     const status = document.getElementById('status');
     const matchStats = document.getElementById('match-stats');
@@ -434,16 +656,15 @@ function processFiles() {
     status.className = 'status-message status-processing';
     matchStats.textContent = '';
     
-    fetch('/api/vlookup', {
-        method: 'POST',
-        body: formData
+    runJob('/api/vlookup', formData, (progress, message) => {
+        status.textContent = `正在处理... ${message}`;
     })
-    .then(response => response.json())
     .then(data => {
         if (data.success) {
             status.textContent = '处理完成！';
             status.className = 'status-message status-success';
             matchStats.textContent = data.error || '';  // 显示匹配统计信息
+            vlookupResultId = data.resultId;
             document.getElementById('downloadBtn').disabled = false;
         } else {
             showError(data.error || '处理失败，请检查数据是否正确');
@@ -457,7 +678,9 @@ function processFiles() {
 }
 
 function downloadResult() {
-    window.location.href = '/api/download-result';
+    if (vlookupResultId) {
+        window.location.href = `/api/download-result?id=${vlookupResultId}`;
+    }
 }
 
 function updateSelectOptions(selectId, data) {
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.lookup_index import (
+    LookupIndex, RangeLookupIndex, FuzzyLookupIndex, GroupedLookupIndex, index_class, FUZZY_MAX_POSTINGS
+)
+from functions.match_keys import normalize_keys
+from functions.vlookup import match_chunk
+
+
+def _fuzzy_index(keys, threshold=0.6) -> FuzzyLookupIndex:
+    keys = pd.Series(keys, dtype=object)
+    return FuzzyLookupIndex(keys, pd.DataFrame({'value': keys}), threshold=threshold)
+
+
+def _match(index: FuzzyLookupIndex, values):
+    keys = pd.Series(values, dtype=object)
+    return index.match(keys.to_frame(), keys)
+
+
+def test_fuzzy_probe_with_only_common_bigrams():
+    # 查找值 abcd 的每个二元组都出现在超过 FUZZY_MAX_POSTINGS 个键中，最相似的 abcde 仍要找到
+    count = FUZZY_MAX_POSTINGS + 100
+    keys = [f"ab{i}" for i in range(count)] + [f"{i}bcd" for i in range(100, 100 + count)] + ['abcde']
+    positions, scores, _ = _match(_fuzzy_index(keys), ['abcd'])
+    assert positions[0] == len(keys) - 1
+    assert np.isclose(scores[0], 8 / 11)
+
+
+def test_fuzzy_pass_matches_are_flagged_even_with_full_score():
+    index = _fuzzy_index(['ABC公司', '北京贸易'])
+    positions, scores, fuzzy = _match(index, ['ABC公司', 'abc 公司', '北京贸易有限', '无关'])
+    assert positions.tolist() == [0, 0, 1, -1]
+    assert scores[:2].tolist() == [1.0, 1.0]
+    assert np.isnan(scores[3])
+    assert fuzzy.tolist() == [False, True, True, False]
+
+
+def _range_index(keys, values) -> RangeLookupIndex:
+    keys = normalize_keys(pd.Series(keys, dtype=object))
+    return RangeLookupIndex(keys, pd.DataFrame({'value': values}))
+
+
+def _probe(index: LookupIndex, values) -> list:
+    keys = normalize_keys(pd.Series(values, dtype=object))
+    return index.probe(keys.to_frame(), keys).tolist()
+
+
+def test_range_returns_largest_key_not_above_value():
+    index = _range_index([60, 0, 90, 80, 70], ['D', 'E', 'A', 'B', 'C'])
+    positions = _probe(index, [-1, 0, 59.9, 60, 85, 1000])
+    assert [index.take(np.array([pos]))[0].iloc[0] if pos >= 0 else None for pos in positions] == \
+        [None, 'E', 'E', 'D', 'B', 'A']
+
+
+def test_range_text_keys_match_exactly():
+    index = _range_index(['分数', 0, 60], ['等级', '不及格', '及格'])
+    assert _probe(index, ['分数', '其他', 75]) == [2, -1, 1]
+    assert index.take(np.array([2]))[0].tolist() == ['等级']
+
+
+def test_range_duplicate_policy():
+    index = RangeLookupIndex(normalize_keys(pd.Series([10, 10])), pd.DataFrame({'value': ['a', 'b']}), 'first')
+    assert index.take(np.array(_probe(index, [15])))[0].tolist() == ['a']
+
+
+def test_fuzzy_below_threshold_is_unmatched():
+    positions, scores, fuzzy = _match(_fuzzy_index(['上海浦东发展银行']), ['北京'])
+    assert positions.tolist() == [-1]
+    assert np.isnan(scores[0]) and not fuzzy[0]
+
+
+def _grouped(policy, separator='、') -> GroupedLookupIndex:
+    keys = pd.Series(['a', 'b', 'a', 'c', 'a'], dtype=object)
+    values = pd.DataFrame({'name': ['x', 'y', None, 'z', 'w'], 'amount': [1, '2', 3, 'n/a', 4.5]})
+    return GroupedLookupIndex(keys, values, policy, separator=separator)
+
+
+def _take(index: GroupedLookupIndex, values) -> list:
+    positions = index.get_positions(pd.Series(values, dtype=object))
+    return [result.tolist() for result in index.take(positions)]
+
+
+def test_grouped_count():
+    assert _take(_grouped('count'), ['a', 'b', 'd']) == [[3, 1, 0]]
+
+
+def test_grouped_sum_ignores_non_numbers():
+    names, amounts = _take(_grouped('sum'), ['a', 'b', 'c', 'd'])
+    assert np.isnan(names).all()
+    assert amounts[:2] == [8.5, 2.0]
+    assert np.isnan(amounts[2]) and np.isnan(amounts[3])
+
+
+def test_grouped_join_keeps_order_and_skips_blanks():
+    assert _take(_grouped('join'), ['a', 'c']) == [['x、w', 'z'], ['1、3、4.5', 'n/a']]
+    names, _ = _take(_grouped('join', separator=''), ['a', 'd'])
+    assert names[0] == 'xw' and pd.isna(names[1])
+
+
+def test_grouped_all_expands_rows():
+    index = _grouped('all')
+    rows, value_rows = index.expand(index.get_positions(pd.Series(['c', 'd', 'a'], dtype=object)))
+    assert rows.tolist() == [0, 1, 2, 2, 2]
+    names, amounts = [result.tolist() for result in index.take(value_rows)]
+    assert names[0] == 'z' and pd.isna(names[1]) and names[2] == 'x' and pd.isna(names[3]) and names[4] == 'w'
+    assert amounts[2:] == [1, 3, 4.5]
+
+
+def test_index_class():
+    assert index_class('exact') is LookupIndex
+    assert index_class('range', 'first') is RangeLookupIndex
+    assert index_class('fuzzy') is FuzzyLookupIndex
+    assert index_class('exact', 'join') is GroupedLookupIndex
+    with pytest.raises(ValueError):
+        index_class('fuzzy', 'count')
+
+
+@pytest.mark.parametrize('match_mode, policy, expected', [
+    ('exact', 'last', ['单价']),
+    ('range', 'last', ['单价']),
+    ('fuzzy', 'last', ['单价', '相似度']),
+    ('exact', 'count', ['匹配数']),
+    ('exact', 'sum', ['单价']),
+    ('exact', 'join', ['单价']),
+])
+def test_header_row_is_labelled(match_mode, policy, expected):
+    # 主表和查找表的表头文字不同，结果的表头行仍写查找表的列名
+    lookup_keys = normalize_keys(pd.Series(['编号', 1, 2], dtype=object))
+    lookup_values = pd.DataFrame({0: ['单价', 10, 20]})
+    index = index_class(match_mode, policy).from_parts(lookup_keys.to_frame(), lookup_values, policy)
+    prepared = [{'name': '价格', 'main_indices': [0], 'index': index, 'match_mode': match_mode,
+                 'duplicate_policy': policy, 'headers': ['单价']}]
+    main_df = pd.DataFrame({0: ['产品编号', 2, 1]})
+
+    result, stats = match_chunk(prepared, main_df, 0)
+    assert result.iloc[0, 1:].tolist() == expected
+    assert stats[0]['rows'] == 3
+
+    # 之后的块没有表头行
+    result, _ = match_chunk(prepared, pd.DataFrame({0: [1]}), 1)
+    assert result.iloc[0, 1] not in ('', '单价', '匹配数')
@@ -0,0 +1,92 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.match_keys import standardize_value, normalize_keys, combine_keys, hash_keys
+
+
+def _expected(values) -> list:
+    return [standardize_value(value) for value in values]
+
+
+def _check(series: pd.Series):
+    result = normalize_keys(series)
+    assert result.index.equals(series.index)
+    assert result.tolist() == _expected(series.tolist())
+
+
+MIXED_VALUES = [
+    1, 0, -7, 10000, 2 ** 53, 2 ** 70, np.int64(42), np.uint8(3), np.int32(-5),
+    1.0, 1.5, -0.0, 0.1, 1e20, 1e-7, 123456789.125, float('inf'), float('-inf'), np.float32(2.5),
+    '1', '1.0', ' 1.0 ', '001', '1e3', '1_000', '1__0', '.5', '+3', '-2.50', '１２', 'inf', 'NaN', '0x10',
+    'abc', '  a   b\t c  ', 'A  B', '', '   ', '　全角　空格', '中文 测试',
+    None, np.nan, pd.NaT,
+    True, False,
+    datetime.date(2024, 1, 2), datetime.datetime(2024, 1, 2, 3, 4, 5), pd.Timestamp('2024-01-02'),
+    datetime.time(12, 30),
+]
+
+
+def test_mixed_object_column():
+    _check(pd.Series(MIXED_VALUES, dtype=object))
+
+
+@pytest.mark.parametrize('value', MIXED_VALUES)
+def test_single_values(value):
+    _check(pd.Series([value, 'x'], dtype=object))
+
+
+@pytest.mark.parametrize('series', [
+    pd.Series([1, 2, 30000, -4], dtype=np.int64),
+    pd.Series([1, 2], dtype=np.uint64),
+    pd.Series([1.0, 2.5, np.nan, -3.0, 1e16, 1e300]),
+    pd.Series([1.5, 2.0], dtype=np.float32),
+    pd.Series([True, False, True]),
+    pd.Series(['1', ' 2.0', 'a  b', None]),
+    pd.Series(['1', 'x', None], dtype='string'),
+    pd.Series(pd.to_datetime(['2024-01-02 00:00:00', None, '2023-12-31 08:00:00'])),
+    pd.Series([1, None, 3], dtype='Int64'),
+    pd.Series([], dtype=object),
+], ids=['int64', 'uint64', 'float64', 'float32', 'bool', 'str', 'string', 'datetime', 'Int64', 'empty'])
+def test_typed_columns(series):
+    _check(series)
+
+
+def test_non_default_index():
+    _check(pd.Series([1.0, ' a ', None], index=[10, 5, 7], dtype=object))
+
+
+def test_random_values_match_standardize_value():
+    rng = np.random.default_rng(0)
+    pool = MIXED_VALUES + [str(v) for v in rng.normal(0, 1e4, 50)] + list(rng.integers(-1e9, 1e9, 50)) + \
+        [f"{v:.2f}" for v in rng.random(50)] + [f" {v} " for v in rng.integers(0, 100, 50)]
+    for _ in range(20):
+        values = [pool[pos] for pos in rng.integers(0, len(pool), 200)]
+        _check(pd.Series(values, dtype=object))
+
+
+def test_composite_keys_match_standardize_value():
+    columns = [
+        pd.Series([1, 1.0, '1', ' 1.0 ', None, 'a  b', True], dtype=object),
+        pd.Series([2.0, '2', np.nan, 'x', 'y  z', 0, datetime.date(2024, 1, 2)], dtype=object),
+        pd.Series([10, 20, 30, 40, 50, 60, 70], dtype=np.int64),
+    ]
+    result = combine_keys([normalize_keys(column) for column in columns])
+    expected = ['|'.join(parts) for parts in zip(*(_expected(column.tolist()) for column in columns))]
+    assert result.tolist() == expected
+    assert combine_keys([normalize_keys(columns[0])]).tolist() == _expected(columns[0].tolist())
+
+
+def test_hashed_composite_keys_follow_combined_keys():
+    columns = [
+        pd.Series([1, '1.0', 1.0, 'a', 'a ', None], dtype=object),
+        pd.Series(['x', 'x', ' x', 2, 2.0, None], dtype=object),
+    ]
+    parts = pd.DataFrame({pos: normalize_keys(column) for pos, column in enumerate(columns)})
+    combined = combine_keys([parts[pos] for pos in parts.columns])
+    hashes = hash_keys(parts)
+    for i in range(len(parts)):
+        for j in range(len(parts)):
+            assert (hashes.iloc[i] == hashes.iloc[j]) == (combined.iloc[i] == combined.iloc[j])
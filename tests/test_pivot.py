@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from functions.pivot_engine import PivotCube, numeric_columns, pivot_frame, crosstab_frame, TOTAL_LABEL
+from functions.pivot_cache import PivotCubeCache
+from functions.writer import merge_ranges, save_styled_table
+
+SALES = pd.DataFrame({
+    '区域': ['东', '东', '西', '西', '东', None],
+    '城市': ['杭州', '宁波', '成都', '成都', '杭州', '未知'],
+    '产品': ['A', 'B', 'A', 'A', 'A', 'B'],
+    '金额': [10, 20, 30, 50, 40, 100],
+})
+
+
+def _cube(group_cols, values=('金额',), details=()) -> PivotCube:
+    return PivotCube.build(SALES, list(group_cols), numeric_columns(SALES, list(values)), details)
+
+
+def test_pivot_totals_are_overall_statistics():
+    values = [('金额', 'sum'), ('金额', 'mean'), ('金额', 'max'), ('金额', 'min'), ('金额', 'count')]
+    result = pivot_frame(_cube(['区域', '产品']).coarsen(['区域']), values)
+    assert result['区域'].tolist() == ['东', '西', TOTAL_LABEL]
+    assert result['金额(sum)'].tolist() == [70, 80, 150]
+    # 平均值的总计是整体平均（150 / 5），不是各分组平均值的合计
+    assert result['金额(mean)'].tolist() == pytest.approx([70 / 3, 40, 30])
+    assert result['金额(max)'].tolist() == [40, 50, 50]
+    assert result['金额(min)'].tolist() == [10, 30, 10]
+    assert result['金额(count)'].tolist() == [3, 2, 5]
+
+
+def test_coarsen_matches_direct_build():
+    values = [('金额', 'sum'), ('金额', 'mean'), ('城市', 'nunique'), ('金额', 'median')]
+    details = [('城市', 'distinct'), ('金额', 'quantile')]
+    coarse = PivotCube.build(SALES, ['区域', '城市', '产品'], numeric_columns(SALES, ['金额']), details)
+    direct = PivotCube.build(SALES, ['产品', '区域'], numeric_columns(SALES, ['金额']), details)
+    pd.testing.assert_frame_equal(pivot_frame(coarse.coarsen(['产品', '区域']), values),
+                                  pivot_frame(direct.coarsen(['产品', '区域']), values))
+
+
+def test_rollup_keeps_rows_with_blank_group_values():
+    cube = _cube(['区域', '产品'])
+    assert cube.rollup([])['sum0'].tolist() == [250]
+    assert cube.rollup(['产品'])['sum0'].tolist() == [130, 120]
+    # 透视表分组列为空值的行在 coarsen 时去掉
+    assert cube.coarsen(['产品']).rollup([])['sum0'].tolist() == [250]
+    assert cube.coarsen(['区域']).rollup([])['sum0'].tolist() == [150]
+
+
+def test_crosstab_with_subtotals():
+    cube = _cube(['区域', '城市', '产品']).coarsen(['区域', '城市', '产品'])
+    result = crosstab_frame(cube, ['区域', '城市'], ['产品'], [('金额', 'sum')])
+    assert result.columns.tolist() == ['区域', '城市', 'A / 金额(sum)', 'B / 金额(sum)', '总计 / 金额(sum)']
+    assert result['区域'].tolist() == ['东', '东', '东 汇总', '西', '西 汇总', TOTAL_LABEL]
+    assert result['城市'].tolist() == ['宁波', '杭州', '', '成都', '', '']
+    assert result['A / 金额(sum)'].fillna(-1).tolist() == [-1, 50, 50, 80, 80, 130]
+    assert result['B / 金额(sum)'].fillna(-1).tolist() == [20, -1, 20, -1, -1, 20]
+    assert result['总计 / 金额(sum)'].tolist() == [20, 50, 70, 80, 80, 150]
+
+
+@pytest.fixture
+def sales_file(tmp_path):
+    path = str(tmp_path / 'sales.xlsx')
+    SALES.to_excel(path, index=False)
+    return path
+
+
+def test_cache_reuses_superset_cube(sales_file, monkeypatch):
+    cache = PivotCubeCache(max_bytes=1 << 30)
+    builds = []
+    original = PivotCubeCache._build
+
+    def counting_build(*args):
+        builds.append(args[2])
+        return original(*args)
+
+    monkeypatch.setattr(PivotCubeCache, '_build', staticmethod(counting_build))
+
+    fine, names = cache.get_cube(sales_file, 'Sheet1', [0, 2], [3])
+    coarse, _ = cache.get_cube(sales_file, 'Sheet1', [2], [3])
+    assert builds == [[0, 2]]
+    assert coarse.group_cols == [names[2]]
+    assert pivot_frame(coarse, [('金额', 'sum')])['金额(sum)'].tolist() == [130, 120, 250]
+
+    # 缺少明细或值列时重新建立立方体
+    cache.get_cube(sales_file, 'Sheet1', [2], [3], details=[(3, 'quantile')])
+    assert builds == [[0, 2], [2]]
+
+
+def test_merge_ranges_stop_at_outer_changes_and_breaks():
+    labels = pd.DataFrame({'a': ['东', '东', '东', '西', '西', '西'], 'b': ['x', 'x', 'x', 'x', 'x', 'y']})
+    breaks = np.array([False, False, True, False, False, False])
+    assert merge_ranges(labels, breaks) == [(0, 0, 1), (0, 3, 5), (1, 0, 1), (1, 3, 4)]
+    assert merge_ranges(labels.iloc[:1]) == []
+
+
+def test_save_styled_table_openpyxl(tmp_path):
+    df = pd.DataFrame({'区域': ['东', '东', '东 汇总'], '城市': ['宁波', '杭州', ''], '金额': [20, 50, 70]})
+    path = str(tmp_path / 'styled.xlsx')
+    save_styled_table(path, df, label_cols=2, emphasis=np.array([False, False, True]), engine='openpyxl')
+
+    sheet = load_workbook(path).active
+    assert [str(cells) for cells in sheet.merged_cells.ranges] == ['A2:A3']
+    assert [cell.value for cell in sheet[1]] == ['区域', '城市', '金额']
+    assert sheet['A4'].value == '东 汇总' and sheet['C4'].value == 70
+    assert sheet['A1'].font.b and sheet['C4'].font.b and not sheet['C2'].font.b
+    assert sheet['A2'].alignment.horizontal == 'left' and sheet['C2'].alignment.horizontal == 'right'
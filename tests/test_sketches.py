@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.sketches import ddsketch_table, ddsketch_quantile, hll_table, hll_estimate
+
+ACCURACY = 0.01
+
+
+def _keys(values, groups=None):
+    return pd.DataFrame({'g': groups if groups is not None else np.zeros(len(values), dtype=np.int64)})
+
+
+@pytest.mark.parametrize('values', [
+    np.random.default_rng(0).normal(0, 0.5, 20000),         # 绝对值大多小于 1，正负都有
+    np.random.default_rng(1).uniform(0.001, 0.9, 5000),     # 全部为小于 1 的正数
+    -np.random.default_rng(2).uniform(0.001, 0.9, 5000),    # 全部为绝对值小于 1 的负数
+    np.random.default_rng(3).lognormal(3, 2, 20000) * np.random.default_rng(4).choice([-1, 1], 20000),
+])
+@pytest.mark.parametrize('q', [0.01, 0.5, 0.9, 0.99])
+def test_quantile_matches_exact_within_accuracy(values, q):
+    series = pd.Series(values)
+    sketch = ddsketch_table(_keys(values), series, ACCURACY)
+    estimate = ddsketch_quantile(sketch, [], q, ACCURACY)
+
+    # 与 Series.quantile 比较：相对误差不超过 accuracy，另外允许插值位置两侧相邻值之间的差
+    ordered = np.sort(values)
+    position = q * (len(values) - 1)
+    gap = ordered[int(np.ceil(position))] - ordered[int(np.floor(position))]
+    exact = series.quantile(q)
+    assert abs(estimate - exact) <= ACCURACY * abs(exact) + gap + 1e-12
+
+
+def test_grouped_quantile_small_magnitudes():
+    rng = np.random.default_rng(5)
+    values = pd.Series(rng.normal(0, 0.5, 30000))
+    groups = rng.choice(['a', 'b', 'c'], len(values))
+    sketch = ddsketch_table(_keys(values, groups), values, ACCURACY)
+    estimates = ddsketch_quantile(sketch, ['g'], 0.5, ACCURACY)
+    exact = values.groupby(groups).quantile(0.5)
+    spread = values.groupby(groups).quantile(0.51) - values.groupby(groups).quantile(0.49)
+    assert list(estimates.index) == ['a', 'b', 'c']
+    assert ((estimates - exact).abs() <= spread.abs()).all()
+
+
+def test_quantile_with_zero_and_missing_values():
+    values = pd.Series([0.0, 0.0, 0.0, np.nan, 0.5, -0.25])
+    sketch = ddsketch_table(_keys(values), values, ACCURACY)
+    assert ddsketch_quantile(sketch, [], 0.5, ACCURACY) == 0.0
+    assert abs(ddsketch_quantile(sketch, [], 0.0, ACCURACY) + 0.25) <= 0.25 * ACCURACY
+    assert abs(ddsketch_quantile(sketch, [], 1.0, ACCURACY) - 0.5) <= 0.5 * ACCURACY
+
+
+def test_distinct_count_estimate():
+    values = pd.Series(np.random.default_rng(6).integers(0, 50000, 200000).astype(str))
+    estimate = hll_estimate(hll_table(_keys(values), values), [])
+    assert abs(estimate - values.nunique()) <= 0.05 * values.nunique()